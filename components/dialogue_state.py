@@ -0,0 +1,195 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from components.slot_schema import SLOT_SCHEMAS, coerce_value, is_null
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class StateSnapshot(NamedTuple):
+    """Immutable view of a dialogue state at a given version."""
+
+    version: int
+    intent: Optional[str]
+    names: Tuple[str, ...]
+    values: Tuple[Any, ...]
+
+    def as_dict(self) -> dict:
+        return dict(zip(self.names, self.values))
+
+
+def freeze(value):
+    """Convert a slot value to a hashable equivalent."""
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    return value
+
+
+def state_signature(state: dict) -> tuple:
+    """Compute the signature of a state in the dict format returned by `get_state`.
+
+    The signature is the frozen state itself, so that two different states never share it.
+    """
+    return (state["intent"], freeze(state["slots"]))
+
+
+class SlotState:
+    """Typed storage for the slots of one intent.
+
+    The slot names and kinds come from the intent schema in `SLOT_SCHEMAS`. Intents
+    without a schema (e.g. SHOW_HOUSES, FALLBACK_POLICY) are open: their slots are
+    defined by the values they are created with.
+    The values are stored positionally and each slot has a dirty bit, set when its
+    value differs from the one it had at the beginning of the turn (see `begin_turn`).
+
+    Attributes:
+        intent (str): The intent the slots belong to
+        names (tuple): The slot names
+        kinds (tuple): The slot kinds, None for open intents
+        values (list): The slot values
+        version (int): Incremented every time a slot value changes
+    """
+
+    __slots__ = ("intent", "names", "kinds", "values", "version", "_baseline", "_dirty")
+
+    def __init__(self, intent: Optional[str] = None, slots: Optional[dict] = None):
+        self.intent = intent
+        schema = SLOT_SCHEMAS.get(intent)
+        if schema is not None:
+            self.names = tuple(schema.keys())
+            self.kinds = tuple(schema.values())
+        else:
+            self.names = tuple(slots.keys()) if slots else ()
+            self.kinds = None
+        self.values: List[Any] = [None] * len(self.names)
+        self.version = 0
+        self._baseline: List[Any] = list(self.values)
+        self._dirty = 0
+
+        if slots:
+            self.update(slots)
+        self.begin_turn()
+
+    def _index(self, name: str) -> int:
+        try:
+            return self.names.index(name)
+        except ValueError:
+            return -1
+
+    def get(self, name: str, default=None):
+        idx = self._index(name)
+        return self.values[idx] if idx >= 0 else default
+
+    def __getitem__(self, name: str):
+        idx = self._index(name)
+        if idx < 0:
+            raise KeyError(name)
+        return self.values[idx]
+
+    def __setitem__(self, name: str, value):
+        self.set(name, value)
+
+    def set(self, name: str, value) -> bool:
+        """Set the value of a slot, converting it to the type of its kind.
+
+        Returns:
+            changed (bool): If the value of the slot has changed
+        """
+        idx = self._index(name)
+        if idx < 0:
+            if self.kinds is not None:
+                logger.debug("Ignoring unknown slot %s for %s", name, self.intent)
+                return False
+            # Open intent, add the new slot
+            self.names += (name,)
+            self.values.append(None)
+            self._baseline.append(None)
+            idx = len(self.names) - 1
+
+        if self.kinds is not None:
+            try:
+                value = coerce_value(self.kinds[idx], value)
+            except (TypeError, ValueError):
+                logger.warning("Invalid value for slot %s: %r", name, value)
+                value = None
+        elif is_null(value):
+            value = None
+
+        if self.values[idx] == value:
+            return False
+
+        self.values[idx] = value
+        self.version += 1
+        if value != self._baseline[idx]:
+            self._dirty |= 1 << idx
+        else:
+            self._dirty &= ~(1 << idx)
+        return True
+
+    def update(self, slots: dict) -> bool:
+        """Update the slots with the filled values of the given slots.
+
+        Returns:
+            changed (bool): If any slot value has changed
+        """
+        changed = False
+        for name, value in slots.items():
+            if not is_null(value):
+                changed = self.set(name, value) or changed
+        return changed
+
+    def begin_turn(self):
+        """Mark the current values as the reference for the dirty tracking."""
+        self._baseline = list(self.values)
+        self._dirty = 0
+
+    def is_dirty(self, name: Optional[str] = None) -> bool:
+        """Check if a slot (or any slot) has changed since the beginning of the turn."""
+        if name is None:
+            return self._dirty != 0
+        idx = self._index(name)
+        return idx >= 0 and bool(self._dirty >> idx & 1)
+
+    def changed_slots(self) -> List[str]:
+        return [name for i, name in enumerate(self.names) if self._dirty >> i & 1]
+
+    def missing_slots(self) -> List[str]:
+        return [n for n, v in zip(self.names, self.values) if v is None]
+
+    def is_complete(self) -> bool:
+        """Check if all the slots are filled"""
+        return all(value is not None for value in self.values)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(zip(self.names, self.values))
+
+    def snapshot(self) -> StateSnapshot:
+        return StateSnapshot(
+            self.version, self.intent, self.names, tuple(freeze(v) for v in self.values)
+        )
+
+    def signature(self) -> int:
+        """Hashable signature of the intent and slot values, cheap to compare."""
+        return hash((self.intent, freeze(self.as_dict())))
+
+    def to_payload(self) -> list:
+        """Compact serializable representation of the state."""
+        if self.kinds is not None:
+            return [self.intent, self.version, self.values]
+        return [self.intent, self.version, self.values, list(self.names)]
+
+    @classmethod
+    def from_payload(cls, payload: list) -> "SlotState":
+        intent, version, values = payload[:3]
+        state = cls(intent)
+        if len(payload) > 3:
+            state.names = tuple(payload[3])
+        state.values = list(values)
+        state.version = version
+        state.begin_turn()
+        return state
+
+    def __repr__(self):
+        return f"SlotState({self.intent!r}, {self.as_dict()!r}, version={self.version})"
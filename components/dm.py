@@ -1,21 +1,45 @@
-import os
+import re
+import threading
+
+from collections import OrderedDict
+from typing import Optional
 
 from utils.logger import get_logger
-from utils.utils import generate
+from utils.utils import generate, generate_batch, last_batch_usage
 from .state_tracker import StateTracker
+from .dialogue_state import state_signature
+from .prompt_builder import PromptBuilder
+from utils.profiler import section
 
 logger = get_logger(__name__)
 
+# A single action with its argument, e.g. request_slot(house_bhk)
+ACTION = re.compile(r"(\w+)\(.*\)")
+
 
 class DM:
     """Dialogue Manager (DM) class for managing dialogue states and generating responses.
     This class is responsible for interpreting the current state of the dialogue and generating appropriate outputs.
     """
 
-    def __init__(self, model, tokenizer, args):
+    def __init__(self, model, tokenizer, args, cache_size=0):
         self.model = model
         self.tokenizer = tokenizer
         self.args = args
+        self.prompt_builder = PromptBuilder(
+            args.domain,
+            tokenizer,
+            getattr(args, "prompt_mode", "static"),
+            getattr(args, "few_shot_k", 3),
+        )
+
+        # LLM decisions cached by state signature, disabled with cache_size=0. Only valid
+        # with a greedy generation, a sampled decision would be reused for every later
+        # occurrence of the state. The DM is shared by the sessions of the load generator,
+        # so the cache is guarded by a lock.
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
 
     def __call__(self, current_state, deterministic=False) -> str:
         """Generate the dialogue manager output based on the current state.
@@ -27,27 +51,108 @@ class DM:
             str: The generated dialogue manager output.
         """
 
-        if current_state["intent"] == "SHOW_HOUSES" and current_state["slots"] != {}:
-            return "show_houses(HOUSE_SEARCH)"
-        elif current_state["intent"] == "SHOW_HOUSES" and current_state["slots"] == {}:
-            return "fallback_policy('No houses found for the given search criteria.')"
-        elif current_state["intent"] == "FALLBACK_POLICY":
-            reason = current_state["slots"]["reason"]
-            return f'fallback_policy("{reason}")'
+        rule_output = self.rule_based_choice(current_state)
+        if rule_output is not None:
+            return rule_output
 
         if deterministic:
             return self.deterministic_choice(current_state)
 
-        path = os.path.join("prompts", self.args.domain, "dm.txt")
-        system_prompt = open(path, "r").read()
-        system_prompt = self.args.chat_template.format(
-            system_prompt, str(current_state)
-        )
+        signature = state_signature(current_state)
+        cached = self.cached_output(signature)
+        if cached is not None:
+            logger.debug("DM cache hit for state %s", current_state)
+            return cached
 
-        logger.debug(f"DM Text: '{system_prompt}'")
+        system_prompt = self.build_prompt(current_state)
+        logger.debug("DM Text: '%s'", system_prompt)
         dm_output = generate(self.model, system_prompt, self.tokenizer, self.args)
 
-        return self.post_process(dm_output)
+        dm_output = self.post_process(dm_output)
+        self.cache_output(signature, dm_output)
+
+        return dm_output
+
+    def batch(self, states, deterministic=False, use_cache=True, return_usage=False):
+        """Generate the dialogue manager outputs for a batch of states.
+        The states that need the LLM are generated together in a single batch.
+
+        Args:
+            states (list): The states of the dialogues.
+            deterministic (bool): If True, the outputs will be deterministic.
+            use_cache (bool): If True, reuse the outputs cached for the same states.
+            return_usage (bool): If True, also return the token counts of each state,
+                zero for the states not generated by the LLM.
+
+        Returns:
+            list: The dialogue manager outputs, one for each state.
+        """
+        outputs = [None] * len(states)
+        usage = [{"prompt_tokens": 0, "completion_tokens": 0} for _ in states]
+        to_generate = []
+        for i, state in enumerate(states):
+            outputs[i] = self.rule_based_choice(state)
+            if outputs[i] is not None:
+                continue
+            if deterministic:
+                outputs[i] = self.deterministic_choice(state)
+                continue
+            if use_cache:
+                outputs[i] = self.cached_output(state_signature(state))
+            if outputs[i] is None:
+                to_generate.append(i)
+
+        if to_generate:
+            prompts = [self.build_prompt(states[i]) for i in to_generate]
+            generated = generate_batch(self.model, prompts, self.tokenizer, self.args)
+            for i, dm_output, generated_usage in zip(to_generate, generated, last_batch_usage()):
+                outputs[i] = self.post_process(dm_output)
+                usage[i] = generated_usage
+                self.cache_output(state_signature(states[i]), outputs[i])
+
+        if return_usage:
+            return outputs, usage
+        return outputs
+
+    def build_prompt(self, current_state) -> str:
+        """Build the DM prompt for the given state."""
+        with section("build_prompt"):
+            system_prompt = self.prompt_builder.dm_prompt(current_state)
+            text = self.args.chat_template.format(system_prompt, str(current_state))
+            self.prompt_builder.record("dm", text)
+        return text
+
+    def cached_output(self, signature):
+        """The output cached for the state signature, None if not cached."""
+        if not self.cache_size:
+            return None
+        with self.cache_lock:
+            dm_output = self.cache.get(signature)
+            if dm_output is not None:
+                self.cache.move_to_end(signature)
+            return dm_output
+
+    def cache_output(self, signature, dm_output):
+        if not self.cache_size:
+            return
+        with self.cache_lock:
+            self.cache[signature] = dm_output
+            self.cache.move_to_end(signature)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def rule_based_choice(self, current_state):
+        """
+        Return the action for the states that do not need a decision, None otherwise.
+        """
+        if current_state["intent"] == "SHOW_HOUSES" and current_state["slots"] != {}:
+            return "show_houses(HOUSE_SEARCH)"
+        elif current_state["intent"] == "SHOW_HOUSES" and current_state["slots"] == {}:
+            return "fallback_policy('No houses found for the given search criteria.')"
+        elif current_state["intent"] == "FALLBACK_POLICY":
+            reason = current_state["slots"]["reason"]
+            return f'fallback_policy("{reason}")'
+        return None
 
     def post_process(self, dm_output: str):
         """
@@ -57,6 +162,11 @@ class DM:
 
         return dm_output
 
+    def parse_action(self, dm_output: str) -> Optional[str]:
+        """The name of the action of a DM output, None if it is not exactly one action."""
+        match = ACTION.fullmatch(self.post_process(dm_output).strip())
+        return match.group(1) if match else None
+
     def deterministic_choice(self, current_state):
         """
         Generate a deterministic choice based on the current state.
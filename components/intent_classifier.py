@@ -0,0 +1,128 @@
+import zlib
+
+import numpy as np
+
+from typing import List, Optional, Sequence, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class IntentClassifier:
+    """Small CPU intent classifier: TF-IDF over hashed character n-grams and a
+    multinomial logistic regression.
+
+    It answers only when its confidence is above the threshold, the other requests are
+    left to the LLM.
+
+    Attributes:
+        labels (list): The intents the classifier was trained on
+        threshold (float): The minimum probability to answer
+        n_features (int): The number of buckets of the hashed n-grams
+        ngram_range (tuple): The minimum and maximum length of the character n-grams
+        answered (int): The number of requests answered by the classifier
+        deferred (int): The number of requests left to the LLM
+    """
+
+    def __init__(self, threshold=0.7, n_features=2**12, ngram_range=(2, 4)):
+        self.threshold = threshold
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.labels: List[str] = []
+        self.idf = np.ones(n_features, dtype=np.float32)
+        self.weights = np.zeros((n_features, 0), dtype=np.float32)
+        self.bias = np.zeros(0, dtype=np.float32)
+        self.answered = 0
+        self.deferred = 0
+
+    def counts(self, texts: Sequence[str]) -> np.ndarray:
+        """Counts of the hashed character n-grams of each text."""
+        counts = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        low, high = self.ngram_range
+        for i, text in enumerate(texts):
+            text = f" {' '.join(text.lower().split())} "
+            buckets = [
+                zlib.crc32(text[start : start + n].encode("utf-8")) % self.n_features
+                for n in range(low, high + 1)
+                for start in range(len(text) - n + 1)
+            ]
+            np.add.at(counts[i], buckets, 1.0)
+        return counts
+
+    def features(self, texts: Sequence[str]) -> np.ndarray:
+        """L2-normalized TF-IDF vectors of the texts."""
+        tfidf = np.log1p(self.counts(texts)) * self.idf
+        norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+        return tfidf / np.maximum(norms, 1e-12)
+
+    def fit(self, texts: Sequence[str], labels: Sequence[str], epochs=200, lr=10.0, l2=1e-4):
+        """Train the classifier with full-batch gradient descent on the cross-entropy."""
+        self.labels = sorted(set(labels))
+        codes = np.array([self.labels.index(label) for label in labels])
+        counts = self.counts(texts)
+        document_frequency = (counts > 0).sum(axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        x = self.features(texts)
+        y = np.eye(len(self.labels), dtype=np.float32)[codes]
+
+        self.weights = np.zeros((self.n_features, len(self.labels)), dtype=np.float32)
+        self.bias = np.zeros(len(self.labels), dtype=np.float32)
+        for _ in range(epochs):
+            error = (self._softmax(x @ self.weights + self.bias) - y) / len(texts)
+            self.weights -= lr * (x.T @ error + l2 * self.weights)
+            self.bias -= lr * error.sum(axis=0)
+        logger.info(
+            "Intent classifier trained on %d samples, training accuracy %.3f",
+            len(texts),
+            float((self.predict_proba(texts).argmax(axis=1) == codes).mean()),
+        )
+        return self
+
+    @staticmethod
+    def _softmax(logits: np.ndarray) -> np.ndarray:
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict_proba(self, texts: Sequence[str]) -> np.ndarray:
+        return self._softmax(self.features(texts) @ self.weights + self.bias)
+
+    def predict(self, texts: Sequence[str]) -> List[Tuple[str, float]]:
+        """The most likely intent of each text, with its probability."""
+        probabilities = self.predict_proba(texts)
+        return [
+            (self.labels[code], float(probabilities[i, code]))
+            for i, code in enumerate(probabilities.argmax(axis=1))
+        ]
+
+    def classify(self, text: str) -> Optional[str]:
+        """The intent of the text, None if the classifier is not confident enough."""
+        intent, confidence = self.predict([text])[0]
+        if confidence >= self.threshold:
+            self.answered += 1
+            logger.debug("Intent classified locally: %s (%.2f)", intent, confidence)
+            return intent
+        self.deferred += 1
+        logger.debug("Intent classifier not confident (%s, %.2f), deferring to the LLM", intent, confidence)
+        return None
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            labels=np.array(self.labels),
+            idf=self.idf,
+            weights=self.weights,
+            bias=self.bias,
+            config=np.array([self.n_features, *self.ngram_range]),
+        )
+
+    @staticmethod
+    def load(path: str, threshold=0.7) -> "IntentClassifier":
+        data = np.load(path)
+        n_features, low, high = data["config"].tolist()
+        classifier = IntentClassifier(threshold, n_features, (low, high))
+        classifier.labels = data["labels"].tolist()
+        classifier.idf = data["idf"]
+        classifier.weights = data["weights"]
+        classifier.bias = data["bias"]
+        return classifier
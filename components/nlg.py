@@ -2,7 +2,10 @@ import os
 from utils.logger import get_logger
 from components.state_tracker import StateTracker
 from utils.utils import generate
+from components.nlg_context import SUMMARY_FIELDS, houses_table, needs_market_context, property_fields
+from components.prompt_builder import PromptBuilder
 from prompts.house_agency.nlg_prompts import NLG_PROMPTS
+from utils.profiler import section
 
 logger = get_logger(__name__)
 
@@ -12,6 +15,7 @@ class NLG:
         self.model = model
         self.tokenizer = tokenizer
         self.args = args
+        self.prompt_builder = PromptBuilder(args.domain, tokenizer)
 
     def select_nlg_prompt(self, next_best_action, conversation, state_tracker):
         if "show_houses" in next_best_action:
@@ -19,13 +23,23 @@ class NLG:
             return NLG_PROMPTS["show_houses"]
         elif "provide_info" in next_best_action:
             logger.debug("Selecting provide_info prompt")
-            house_info = "House Info:\n" + str(state_tracker.active_house)
+            properties = None
+            if state_tracker.current_intent == "ASK_INFO":
+                properties = state_tracker.state["properties"]
+            fields = property_fields(properties)
+            house_info = "House Info:\n" + houses_table([state_tracker.active_house], fields)
+            if state_tracker.market_context and needs_market_context(fields):
+                house_info += "\nMarket statistics:\n" + state_tracker.market_context
             return NLG_PROMPTS["provide_info"].format(conversation, house_info)
         elif "confirmation(COMPARE_HOUSES)" in next_best_action:
             logger.debug("Selecting compare_houses prompt")
+            fields = property_fields(state_tracker.properties_to_compare)
+            houses_info = houses_table(state_tracker.houses_to_compare, fields)
+            if state_tracker.market_context and needs_market_context(fields):
+                houses_info += "\nMarket statistics:\n" + state_tracker.market_context
             return NLG_PROMPTS["compare_houses"].format(
                 conversation,
-                state_tracker.houses_to_compare,
+                houses_info,
                 state_tracker.properties_to_compare,
             )
         elif "confirmation" in next_best_action:
@@ -38,20 +52,31 @@ class NLG:
             logger.debug("Selecting request_info prompt")
             return NLG_PROMPTS["request_info"].format(conversation)
 
+    def project_state(self, next_best_action, state_tracker):
+        """The part of the state needed by the action: the shown houses as a compact table
+        with their summary fields, the current intent and slots otherwise.
+        """
+        if "show_houses" in next_best_action:
+            context = houses_table(state_tracker.current_houses, SUMMARY_FIELDS)
+            note = state_tracker.current_slots.get("note")
+            return f"{note}\n{context}" if note else context
+        return str(state_tracker.get_state())
+
     def __call__(self, state_tracker: StateTracker, conversation=[], stream=False):
 
         dm_output = [state_tracker.next_best_actions[-1]]
-        state_tracker_state = state_tracker.get_state()
 
         nlg_outputs = []
 
         for next_best_action in dm_output:
-            system_prompt = self.select_nlg_prompt(
-                next_best_action, conversation, state_tracker
-            )
-            nlg_input = next_best_action + "\n" + str(state_tracker_state)
-            system_prompt = self.args.chat_template.format(system_prompt, nlg_input)
-            logger.debug(f"NLG Text: '{system_prompt}'")
+            with section("build_prompt"):
+                system_prompt = self.select_nlg_prompt(
+                    next_best_action, conversation, state_tracker
+                )
+                nlg_input = next_best_action + "\n" + self.project_state(next_best_action, state_tracker)
+                system_prompt = self.args.chat_template.format(system_prompt, nlg_input)
+                self.prompt_builder.record("nlg", system_prompt)
+            logger.debug("NLG Text: '%s'", system_prompt)
 
             nlg_output = generate(self.model, system_prompt, self.tokenizer, self.args)
             nlg_outputs.append(nlg_output)
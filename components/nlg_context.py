@@ -0,0 +1,60 @@
+import re
+
+from typing import List, Optional, Sequence
+
+from data.houses import House
+
+# Keywords of the requested properties -> fields of the house, checked in order. The
+# words matched by a keyword are not matched again by the next ones (e.g. "bathroom"
+# is not a "room", "super area" is not a locality "area").
+PROPERTY_FIELDS = [
+    (("area type", "carpet area", "super area", "built area", "carpet", "built"), ["area_type"]),
+    (("rent", "price", "cost", "budget", "expensive", "cheap"), ["rent"]),
+    (("size", "square", "sq", "big", "large", "space"), ["size"]),
+    (("bath",), ["bathroom"]),
+    (("bhk", "bedroom", "room"), ["bhk"]),
+    (("floor",), ["floor"]),
+    (("furnish",), ["furnishing_status"]),
+    (("tenant", "bachelor", "family"), ["tenant_preferred"]),
+    (("contact", "owner", "agent", "builder", "call"), ["point_of_contact"]),
+    (("posted", "date", "available", "listed"), ["posted_on"]),
+    (("location", "address", "position", "locality", "where", "area", "neighbourhood"), ["area_locality"]),
+    (("city",), ["city"]),
+]
+
+# Fields of the houses shown after a search, and when no known property is requested
+SUMMARY_FIELDS = ["bhk", "size", "area_locality", "city", "rent", "furnishing_status", "tenant_preferred"]
+
+# Fields described by the market statistics
+MARKET_FIELDS = {"rent", "size"}
+
+
+def property_fields(properties: Optional[Sequence[str]]) -> List[str]:
+    """Fields of the house needed to answer the requested properties, in the house order.
+    The summary fields if no requested property is recognized.
+    """
+    fields = set()
+    for prop in properties or []:
+        prop = str(prop).lower()
+        # A property can ask for several fields, e.g. "size and bhk"
+        for keywords, names in PROPERTY_FIELDS:
+            matched = [keyword for keyword in keywords if keyword in prop]
+            if matched:
+                fields.update(names)
+                for keyword in matched:
+                    prop = re.sub(r"\w*" + re.escape(keyword) + r"\w*", " ", prop)
+    if not fields:
+        return list(SUMMARY_FIELDS)
+    return [name for name in House.FIELDS if name in fields]
+
+
+def houses_table(houses: Sequence[House], fields: Sequence[str]) -> str:
+    """Compact table of the given fields of the houses, numbered from 1."""
+    lines = [" | ".join(["house", *fields])]
+    for i, house in enumerate(houses):
+        lines.append(" | ".join([str(i + 1), *(str(getattr(house, name)) for name in fields)]))
+    return "\n".join(lines)
+
+
+def needs_market_context(fields: Sequence[str]) -> bool:
+    return bool(MARKET_FIELDS & set(fields))
@@ -1,40 +1,75 @@
 import os, json
 from utils.logger import get_logger
-from utils.utils import generate
-from prompts.house_agency.nlu_prompts import NLU_PROMPTS
+from utils.utils import generate, generate_batch
+from utils.json_parser import JSONStreamExtractor, extract_json
+from components.prompt_builder import PromptBuilder
+from components.slot_schema import SLOT_SCHEMAS, validate_slots
+from prompts.house_agency.nlu_prompts import CHUNKING_PROMPT, NLU_PROMPTS
+from utils.profiler import section
 
 logger = get_logger(__name__)
 
 
 class NLU:
-    def __init__(self, model, tokenizer, args):
+    def __init__(self, model, tokenizer, args, slot_extractor=None):
         self.model = model
         self.tokenizer = tokenizer
         self.args = args
-
-    def generate_chunks(self, user_input):
-        prompt = NLU_PROMPTS[self.args.domain]["NLU"]["CHUNKING"]
-        nlu_text = self.args.chat_template.format(prompt, user_input)
-        nlu_output = generate(self.model, nlu_text, self.tokenizer, self.args)
-        nlu_output = nlu_output.strip()
-
-        try:
-            chunks = json.loads(nlu_output)
-        except Exception as e:
+        self.intent_classifier = getattr(args, "intent_classifier", None)
+        self.slot_extractor = slot_extractor
+        self.prompt_builder = PromptBuilder(
+            args.domain,
+            tokenizer,
+            getattr(args, "prompt_mode", "static"),
+            getattr(args, "few_shot_k", 3),
+        )
+
+    def generate_chunks(self, user_input, conversation):
+        """Split the user input into chunks, one per intent.
+
+        Falls back to the classification of the whole input as a single intent if the
+        model output is not a valid list of chunks.
+        """
+        system_prompt = CHUNKING_PROMPT.format(conversation)
+        nlu_text = self.args.chat_template.format(system_prompt, user_input)
+        nlu_output = generate(
+            self.model,
+            nlu_text,
+            self.tokenizer,
+            self.args,
+            extractor=JSONStreamExtractor(root="["),
+        )
+
+        chunks = extract_json(nlu_output, root="[")
+        if (
+            not isinstance(chunks, list)
+            or not chunks
+            or not all(
+                isinstance(chunk, dict)
+                and isinstance(chunk.get("chunk"), str)
+                and isinstance(chunk.get("intent"), str)
+                for chunk in chunks
+            )
+        ):
             logger.error(
                 "The NLU output [CHUNKING] is not in the expected json format. Output: '%s'",
                 nlu_output,
             )
-            raise e
+            return self.classify_intent(user_input, conversation)
 
         return chunks
 
     def classify_intent(self, user_input, conversation):
-        path = os.path.join("prompts", self.args.domain, "intent.txt")
-        system_prompt = open(path, "r").read()
+        if self.intent_classifier is not None:
+            intent = self.intent_classifier.classify(user_input)
+            if intent is not None:
+                return [{"intent": intent, "chunk": user_input}]
+
+        system_prompt = self.prompt_builder.intent_prompt(user_input)
 
         input_query = f"History:\n{conversation}\n\nUser: {user_input}"
         nlu_text = self.args.chat_template.format(system_prompt, input_query)
+        self.prompt_builder.record("intent", nlu_text)
         nlu_output = generate(self.model, nlu_text, self.tokenizer, self.args)
         nlu_output = nlu_output.strip().strip("\n").strip("`")
 
@@ -51,56 +86,113 @@ class NLU:
 
         return [{"intent": nlu_output, "chunk": user_input}]
 
-    def __call__(self, user_input, conversation=[], chunks=False):
+    def __call__(self, user_input, conversation=[], chunks=None):
+        """Extract the intents and slots of the user input.
+
+        In multi-intent mode (`chunks=True` or the `--multi-intent` argument) the input is
+        split into chunks first, and the slots of all the chunks are extracted with one
+        batched generation. The outputs keep the order of the chunks.
+
+        With a slot extractor, the HOUSE_SEARCH slots recognized deterministically are
+        merged into the LLM output, and the LLM is not called if all of them are found.
+        """
+        if chunks is None:
+            chunks = getattr(self.args, "multi_intent", False)
 
         if chunks:
-            chunks = self.generate_chunks(user_input)
+            chunks = self.generate_chunks(user_input, conversation)
             logger.debug("NLU Chunks found: %s", chunks)
         else:
             chunks = self.classify_intent(user_input, conversation)
 
         nlu_outputs = []
+        extracted_slots = []
+        prompts = []
 
         for chunk in chunks:
             intent = chunk["intent"].upper()
-            user_input = chunk["chunk"]
             if intent not in NLU_PROMPTS.keys():
                 nlu_outputs.append(("OUT_OF_DOMAIN", {}))
+                extracted_slots.append({})
+                continue
+            extracted = {}
+            if self.slot_extractor is not None and intent == "HOUSE_SEARCH":
+                with section("slot_extraction"):
+                    extracted = self.slot_extractor.extract(chunk["chunk"])
+                logger.debug("Slots extracted before the LLM: %s", extracted)
+            extracted_slots.append(extracted)
+            if extracted and set(extracted) == set(SLOT_SCHEMAS[intent]):
+                self.slot_extractor.resolved += 1
+                nlu_outputs.append((intent, extracted))
                 continue
             system_prompt = NLU_PROMPTS[intent].format(conversation)
-            system_prompt = self.args.chat_template.format(system_prompt, user_input)
-            nlu_output = generate(self.model, system_prompt, self.tokenizer, self.args)
-            nlu_outputs.append((intent, nlu_output))
+            system_prompt = self.args.chat_template.format(system_prompt, chunk["chunk"])
+            prompts.append((len(nlu_outputs), system_prompt))
+            nlu_outputs.append((intent, None))
+
+        if len(prompts) == 1:
+            _, system_prompt = prompts[0]
+            outputs = [
+                generate(
+                    self.model,
+                    system_prompt,
+                    self.tokenizer,
+                    self.args,
+                    extractor=JSONStreamExtractor(),
+                )
+            ]
+        elif prompts:
+            outputs = generate_batch(
+                self.model, [prompt for _, prompt in prompts], self.tokenizer, self.args
+            )
+        else:
+            outputs = []
+        for (i, _), output in zip(prompts, outputs):
+            nlu_outputs[i] = (nlu_outputs[i][0], output)
 
-        self.post_process(nlu_outputs)
+        with section("post_process"):
+            self.post_process(nlu_outputs, extracted_slots)
 
         return nlu_outputs
 
-    def post_process(self, nlu_outputs):
+    def post_process(self, nlu_outputs, extracted_slots=None):
         """
         Apply simple post-processing to the NLU outputs by converting them to a dictionary.
+        The JSON object is extracted from the generated text, repaired if malformed and
+        validated against the slot schema of the intent.
+
+        The slots extracted deterministically (`extracted_slots`, one dictionary per
+        output) replace the LLM values, except for the location, which is only filled
+        when the LLM did not find it.
         """
+        if extracted_slots is None:
+            extracted_slots = [{}] * len(nlu_outputs)
+
         to_remove = []
         for i, (intent, nlu_output) in enumerate(nlu_outputs):
-            if nlu_output == {}:  # OUT_OF_DOMAIN case
-                nlu_outputs[i] = {"intent": intent, "slots": {}}
+            extracted = extracted_slots[i]
+            if isinstance(nlu_output, dict):  # OUT_OF_DOMAIN or already extracted
+                nlu_outputs[i] = {"intent": intent, "slots": validate_slots(intent, nlu_output)}
                 continue
 
             try:
-                if "{" in nlu_output and "}" in nlu_output:
-                    nlu_output = nlu_output[
-                        nlu_output.index("{") : nlu_output.index("}") + 1
-                    ]
-                nlu_output_dict = json.loads(nlu_output)
-                nlu_outputs[i] = {"intent": intent, "slots": nlu_output_dict}
+                nlu_output_dict = extract_json(nlu_output)
+                slots = validate_slots(intent, nlu_output_dict)
             except Exception as e:
-                logger.error(
-                    "The NLU output '%s' is not in the expected json format.",
-                    nlu_output,
-                )
-                to_remove.append(i)
-
-        for i in to_remove:
+                if not extracted:
+                    logger.error(
+                        "The NLU output '%s' is not in the expected json format.",
+                        nlu_output,
+                    )
+                    to_remove.append(i)
+                    continue
+                slots = validate_slots(intent, {})
+            for name, value in extracted.items():
+                if name != "house_location" or slots.get(name) is None:
+                    slots[name] = value
+            nlu_outputs[i] = {"intent": intent, "slots": slots}
+
+        for i in reversed(to_remove):
             nlu_outputs.pop(i)
 
         return nlu_outputs
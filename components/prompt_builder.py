@@ -0,0 +1,144 @@
+import importlib
+import logging
+import os
+import re
+
+from collections import defaultdict
+from typing import Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+WORD = re.compile(r"\w+")
+
+
+def words(text: str) -> set:
+    return set(WORD.findall(text.lower()))
+
+
+def is_complete(state: dict) -> bool:
+    """Check if all the slots of a state are filled."""
+    return all(value not in (None, "None", "null", []) for value in state.get("slots", {}).values())
+
+
+class PromptBuilder:
+    """Assemble the intent classification and DM system prompts.
+
+    In `static` mode the prompts are the full files of the domain (`intent.txt` and
+    `dm.txt`). In `dynamic` mode they are assembled from the bank of the domain
+    (`prompt_bank.py`), keeping only the actions of the current intent and the `k`
+    examples most relevant to the current user text or state.
+
+    The number of tokens of the assembled prompts is recorded per kind of prompt. The
+    prompts are tokenized again to count them, so they are only counted when `count` is
+    set (e.g. to compare the prompt variants) or when debug logging is enabled.
+
+    Attributes:
+        domain (str): The domain of the prompts
+        tokenizer: The tokenizer used to count the tokens, None to estimate them
+        mode (str): "static" or "dynamic"
+        k (int): The number of examples of the dynamic prompts
+        count (bool): If True, count the tokens of the prompts even without debug logging
+        prompts (dict): kind -> number of the recorded prompts
+        tokens (dict): kind -> total tokens of the recorded prompts
+        turn_tokens (dict): kind -> tokens of the prompts recorded since the last turn report
+    """
+
+    def __init__(self, domain: str, tokenizer=None, mode="static", k=3, count=False):
+        self.domain = domain
+        self.tokenizer = tokenizer
+        self.mode = mode
+        self.k = k
+        self.count = count
+        self.prompts = defaultdict(int)
+        self.tokens = defaultdict(int)
+        self.turn_tokens = defaultdict(int)
+        self.static = {}
+        self.bank = importlib.import_module(f"prompts.{domain}.prompt_bank") if mode == "dynamic" else None
+
+    def static_prompt(self, name: str) -> str:
+        if name not in self.static:
+            with open(os.path.join("prompts", self.domain, name), "r") as f:
+                self.static[name] = f.read()
+        return self.static[name]
+
+    def count_tokens(self, text: str) -> int:
+        """The number of tokens of the text, estimated as 4 characters per token without a tokenizer."""
+        if self.tokenizer is not None:
+            return len(self.tokenizer(text).input_ids)
+        return len(text) // 4
+
+    def record(self, kind: str, text: str) -> Optional[int]:
+        """Record the tokens of a prompt sent to the model, None if the prompts are not counted."""
+        if not (self.count or logger.isEnabledFor(logging.DEBUG)):
+            return None
+        n_tokens = self.count_tokens(text)
+        self.prompts[kind] += 1
+        self.tokens[kind] += n_tokens
+        self.turn_tokens[kind] += n_tokens
+        logger.debug("%s prompt (%s): %d tokens", kind, self.mode, n_tokens)
+        return n_tokens
+
+    def report(self) -> dict:
+        return {
+            kind: {"prompts": n_prompts, "mean_tokens": self.tokens[kind] / n_prompts}
+            for kind, n_prompts in self.prompts.items()
+            if n_prompts
+        }
+
+    def turn_report(self) -> dict:
+        """The tokens of the prompts recorded since the last call, per kind."""
+        report = dict(self.turn_tokens)
+        self.turn_tokens.clear()
+        return report
+
+    def intent_prompt(self, user_input: str) -> str:
+        """System prompt of the intent classification of the user input."""
+        if self.mode != "dynamic":
+            return self.static_prompt("intent.txt")
+
+        query = words(user_input)
+        examples = sorted(
+            self.bank.INTENT_EXAMPLES,
+            key=lambda example: -len(query & words(example["user"])) / (len(query | words(example["user"])) or 1),
+        )[: self.k]
+        lines = [self.bank.INTENT_HEADER, "", "## 💡 Examples", ""]
+        for i, example in enumerate(examples):
+            lines += [
+                f"{i + 1}. **User:** \"{example['user']}\"",
+                f"   **Output:** `{example['intent']}`",
+                "",
+            ]
+        lines.append("Output:")
+        return "\n".join(lines)
+
+    def dm_prompt(self, state: dict) -> str:
+        """System prompt of the DM decision for the given state."""
+        if self.mode != "dynamic":
+            return self.static_prompt("dm.txt")
+
+        intent = state.get("intent")
+        complete = is_complete(state)
+        actions = [
+            action["text"]
+            for action in self.bank.DM_ACTIONS
+            if action["intents"] is None or intent in action["intents"]
+        ]
+        examples = sorted(
+            self.bank.DM_EXAMPLES,
+            key=lambda example: -(2 * (example["intent"] == intent) + (example["complete"] == complete)),
+        )[: self.k]
+
+        lines = [self.bank.DM_HEADER, "", "## Available Actions:"]
+        lines += [f"{i + 1}. {action}" for i, action in enumerate(actions)]
+        lines.append("")
+        for i, example in enumerate(examples):
+            lines += [
+                f"### Example {i + 1}:",
+                f"User: {example['state']}",
+                f"Action: {example['action']}",
+                "",
+            ]
+        lines.append(self.bank.DM_FOOTER)
+        return "\n".join(lines)
@@ -0,0 +1,161 @@
+import re
+
+from typing import Dict, Iterable, Optional
+
+from data.database import Database
+from data.houses import CATEGORIES
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Other names of the cities of the dataset
+CITY_ALIASES = {
+    "bengaluru": "bangalore",
+    "bombay": "mumbai",
+    "calcutta": "kolkata",
+    "madras": "chennai",
+    "new delhi": "delhi",
+}
+
+# Words of the requests that are never a locality, even if a listing uses them
+NON_LOCALITIES = {
+    "house", "houses", "flat", "flats", "apartment", "apartments", "home", "room",
+    "near", "city", "area", "road", "main road", "street", "west", "east", "north",
+    "south", "new", "old", "park", "the", "furnished", "unfurnished", "semi-furnished",
+}
+
+MIN_RENT = 1000
+
+WORD = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+AMOUNT = r"(\d[\d,]*(?:\.\d+)?)\s*(k|lakhs?|lacs?)?"
+
+BHK_PATTERN = re.compile(r"(\d+)\s*-?\s*(?:bhk|bedrooms?\b|bed\b|rk\b)")
+SIZE_PATTERN = re.compile(
+    r"(\d[\d,]*)\s*(?:sq\.?\s*(?:ft|feet)\b|sqft\b|square\s*(?:feet|foot|ft)\b)"
+)
+RENT_PATTERNS = [
+    re.compile(r"(?:₹|\brs\.?|\binr)\s*" + AMOUNT),
+    re.compile(AMOUNT + r"\s*(?:rupees|inr|rs\b|₹|per month|/month|a month)"),
+    re.compile(
+        r"(?:under|below|within|budget(?: of| is)?|max(?:imum)?|up to|upto|less than|rent(?: of)?)\s*(?:₹|rs\.?|inr)?\s*"
+        + AMOUNT
+    ),
+]
+FURNISHING_PATTERNS = [
+    (re.compile(r"\bsemi[- ]?furnished\b"), "semi-furnished"),
+    (re.compile(r"\b(?:unfurnished|not furnished|non[- ]furnished)\b"), "unfurnished"),
+    (re.compile(r"\b(?:fully )?furnished\b"), "furnished"),
+]
+
+
+def parse_amount(number: str, unit: Optional[str]) -> Optional[int]:
+    """Parse an amount like "25,000", "25k" or "1.5 lakh"."""
+    try:
+        value = float(number.replace(",", ""))
+    except ValueError:
+        return None
+    if unit == "k":
+        value *= 1000
+    elif unit:  # lakh
+        value *= 100000
+    return int(value)
+
+
+def normalize(text: str) -> str:
+    return " ".join(WORD.findall(text.lower()))
+
+
+class SlotExtractor:
+    """Deterministic extractor of the HOUSE_SEARCH slots.
+
+    Numbers are recognized with regular expressions, cities, localities and furnishing
+    statuses with gazetteers of the distinct values of the database. The values are
+    canonical and typed: integers for the numeric slots, the lowercase database values
+    for the text slots.
+
+    Attributes:
+        cities (dict): normalized name -> city
+        localities (dict): normalized phrase -> locality (or part of it) as in the database
+        max_phrase_words (int): The number of words of the longest locality phrase
+        resolved (int): The number of requests with all the slots extracted
+    """
+
+    def __init__(self, cities: Iterable[str], localities: Iterable[str]):
+        self.cities = {normalize(city): city for city in cities}
+        for alias, city in CITY_ALIASES.items():
+            if city in self.cities.values():
+                self.cities[alias] = city
+
+        # The normalized phrases are mapped to the text of the database, since the search
+        # matches the location as a substring of the raw locality
+        self.localities = {}
+        for locality in localities:
+            for text in [locality] + locality.split(","):
+                text = text.lower().strip()
+                phrase = normalize(text)
+                if (
+                    len(phrase) > 3
+                    and not phrase.isdigit()
+                    and phrase not in self.cities
+                    and phrase not in NON_LOCALITIES
+                ):
+                    self.localities.setdefault(phrase, text)
+        self.max_phrase_words = max((len(p.split()) for p in self.localities), default=0)
+        self.resolved = 0
+
+    @staticmethod
+    def from_database(database: Database) -> "SlotExtractor":
+        extractor = SlotExtractor(
+            CATEGORIES["city"].values,
+            {house.area_locality for house in database.database},
+        )
+        logger.info(
+            "Slot extractor built with %d cities and %d locality phrases.",
+            len(extractor.cities),
+            len(extractor.localities),
+        )
+        return extractor
+
+    def find_phrase(self, words: list, gazetteer: Dict[str, str], max_words: int) -> Optional[str]:
+        """The value of the longest phrase of the gazetteer found in the words."""
+        for n in range(min(max_words, len(words)), 0, -1):
+            for start in range(len(words) - n + 1):
+                phrase = " ".join(words[start : start + n])
+                if phrase in gazetteer:
+                    return gazetteer[phrase]
+        return None
+
+    def extract(self, text: str) -> Dict[str, object]:
+        """Extract the HOUSE_SEARCH slots found in the text, the missing slots are omitted."""
+        lowered = text.lower()
+        slots = {}
+
+        # The matched numbers are removed, so that they are not taken as the rent
+        match = BHK_PATTERN.search(lowered)
+        if match:
+            slots["house_bhk"] = int(match.group(1))
+            lowered = lowered[: match.start()] + " " + lowered[match.end() :]
+        match = SIZE_PATTERN.search(lowered)
+        if match:
+            slots["house_size"] = int(match.group(1).replace(",", ""))
+            lowered = lowered[: match.start()] + " " + lowered[match.end() :]
+        for pattern in RENT_PATTERNS:
+            match = pattern.search(lowered)
+            if match:
+                rent = parse_amount(match.group(1), match.group(2))
+                if rent is not None and rent >= MIN_RENT:
+                    slots["house_rent"] = rent
+                    break
+        for pattern, status in FURNISHING_PATTERNS:
+            if pattern.search(lowered):
+                slots["house_furnished"] = status
+                break
+
+        words = WORD.findall(lowered)
+        city = self.find_phrase(words, self.cities, 2)
+        if city is not None:
+            slots["house_city"] = city
+        locality = self.find_phrase(words, self.localities, self.max_phrase_words)
+        if locality is not None:
+            slots["house_location"] = locality
+        return slots
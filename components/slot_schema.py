@@ -0,0 +1,106 @@
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Slot kinds:
+# - number: an integer value (e.g. bhk, size, rent); free-text values are kept as strings
+# - text: a string value
+# - index: an integer index over the houses shown to the user
+# - text_list / index_list: a list of the above
+SLOT_SCHEMAS = {
+    "HOUSE_SEARCH": {
+        "house_size": "number",
+        "house_bhk": "number",
+        "house_rent": "number",
+        "house_location": "text",
+        "house_city": "text",
+        "house_furnished": "text",
+    },
+    "HOUSE_SELECTION": {"house_selected": "index"},
+    "ASK_INFO": {"properties": "text_list"},
+    "COMPARE_HOUSES": {"houses": "index_list", "properties": "text_list"},
+}
+
+NULL_VALUES = (None, "", "None", "none", "null", "NULL", "Null")
+
+
+def is_null(value) -> bool:
+    """Check if a slot value should be considered as not filled."""
+    if isinstance(value, (list, dict)):
+        return len(value) == 0
+    return value in NULL_VALUES
+
+
+def coerce_value(kind: str, value):
+    """Convert a slot value to the type expected by its kind.
+
+    Raises:
+        ValueError: If the value cannot be converted
+    """
+    if is_null(value):
+        return None
+
+    if kind == "number":
+        if isinstance(value, bool):
+            raise ValueError(f"Invalid number {value!r}")
+        if isinstance(value, (int, float)):
+            return int(value)
+        value = str(value).strip()
+        digits = value.replace(",", "")
+        return int(digits) if digits.isdigit() else value
+    elif kind == "index":
+        if isinstance(value, bool):
+            raise ValueError(f"Invalid index {value!r}")
+        return int(value)
+    elif kind == "text":
+        if isinstance(value, (list, dict)):
+            raise ValueError(f"Invalid text {value!r}")
+        return str(value).strip()
+    elif kind == "text_list":
+        values = value if isinstance(value, list) else [value]
+        return [coerce_value("text", v) for v in values if not is_null(v)] or None
+    elif kind == "index_list":
+        values = value if isinstance(value, list) else [value]
+        return [coerce_value("index", v) for v in values if not is_null(v)] or None
+    else:
+        raise ValueError(f"Unknown slot kind {kind}")
+
+
+def validate_slots(intent: str, slots) -> dict:
+    """Validate the slots extracted by the NLU against the schema of the given intent.
+
+    Unknown slots are dropped, missing slots are set to None and values are converted
+    to the type expected by the schema. Values that cannot be converted are set to None,
+    so that the DM can request them again instead of discarding the whole output.
+
+    Args:
+        intent (str): The intent of the user request
+        slots (dict): The slots extracted by the NLU
+
+    Returns:
+        validated_slots (dict): The slots following the schema of the intent
+
+    Raises:
+        ValueError: If the slots are not a dictionary
+    """
+    if not isinstance(slots, dict):
+        raise ValueError(f"The slots for {intent} must be a JSON object, got {slots!r}")
+    schema = SLOT_SCHEMAS.get(intent)
+    if schema is None:
+        return slots
+
+    validated_slots = {}
+    for name, kind in schema.items():
+        try:
+            validated_slots[name] = coerce_value(kind, slots.get(name))
+        except (TypeError, ValueError):
+            logger.warning(
+                "Invalid value for slot %s (%s): %r", name, intent, slots.get(name)
+            )
+            validated_slots[name] = None
+
+    unknown_slots = set(slots) - set(schema)
+    if unknown_slots:
+        logger.debug("Dropping unknown slots for %s: %s", intent, unknown_slots)
+
+    return validated_slots
@@ -3,9 +3,15 @@ import traceback
 from utils.logger import get_logger
 
 from data.database import Database
+from components.dialogue_state import SlotState
+from utils.history import BoundedHistory
+from utils.profiler import section
 
 logger = get_logger(__name__)
 
+# Radiuses (in km) around the searched location tried when a search has no results
+WIDEN_RADII_KM = (2.0, 5.0, 10.0)
+
 
 class StateTracker:
     """The state tracker class is responsible for keeping track of the state of the system.
@@ -13,36 +19,54 @@ class StateTracker:
 
     Attributes:
         database (Database): The database object
+        state (SlotState): The typed slots of the current intent
         current_intent (str): The current intent of the user request
         current_slots (dict): The current slots of the user request
-        next_best_actions (list): The next best actions to be taken by the system
+        next_best_actions (BoundedHistory): The last next best actions taken by the system
         current_houses (list): The current houses found in the database
+        search_cursor (SearchCursor): The cursor of the last search, to show the next houses
         houses_to_compare (list): The houses to be compared
         properties_to_compare (list): The properties to be compared
         active_house (House): The active house selected by the user
+        market_context (str): How the active house or the houses to compare relate to the market
     """
 
-    def __init__(self, database: Database):
+    def __init__(self, database: Database, nba_retention=16, archive=None):
         self.database = database
         self.last_active_state = None
+        self.nba_retention = nba_retention
+        self.archive = archive
 
         # Tracked from NLU
-        self.current_intent = None
-        self.current_slots = {}
+        self.state = SlotState()
 
         # Tracked from DM
-        self.next_best_actions = []
+        self.next_best_actions = self._new_nba_history()
 
         # HOUSE_SEARCH information
         self.current_houses = []
+        self.search_cursor = None
 
         # ASK_INFO information
         self.active_house = None
+        self.market_context = ""
 
         # COMPARE_HOUSES information
         self.houses_to_compare = []
         self.properties_to_compare = []
 
+    @property
+    def current_intent(self):
+        return self.state.intent
+
+    @property
+    def current_slots(self):
+        return self.state.as_dict()
+
+    def set_state(self, intent, slots=None):
+        """Replace the current state with a new intent and its slots."""
+        self.state = SlotState(intent, slots)
+
     def update(self, nlu_output):
 
         if not isinstance(nlu_output, list) or len(nlu_output) == 0:
@@ -64,54 +88,38 @@ class StateTracker:
                 self.fallback_policy(
                     "Unknown intent for the current system, please try again."
                 )
+                continue
             elif intent == "OUT_OF_DOMAIN":
                 self.fallback_policy(
                     "The intent of the user request is out of the domain of the current system."
                 )
-            else:
-                self.current_intent = intent
-                self.initialize_slots(intent, slots)
+                continue
 
-            if not self.current_intent:  # Initial state
-                self.current_intent = intent
-                self.initialize_slots(intent, slots)
-            elif intent == self.current_intent:  # Same intent
+            self.state.begin_turn()
+            if intent == self.current_intent:  # Same intent
                 changed = self.update_slots(slots)
-
-                if self.check_slots(self.current_slots):
-                    self.handle_intent(intent, changed)
             else:
-                if not self.check_slots(self.current_slots):
-                    self.fallback_policy(
-                        "Unfortunatly, it seems that the task you are trying to perform is not coherent with the current state of the system. Please try again."
-                    )
-                else:
-                    self.current_intent = intent
-                    self.current_slots = slots
-                    logger.debug("Changing intent to %s with slots %s", intent, slots)
-                    self.initialize_slots(intent, slots)
+                logger.debug("Changing intent to %s with slots %s", intent, slots)
+                self.initialize_slots(intent, slots)
+                changed = False
+
+            if intent == self.current_intent and self.state.is_complete():
+                self.handle_intent(intent, changed)
 
     def initialize_slots(self, intent, slots):
         """Initialize the slots for the current intent.
-        Make sure that all the slots for a given intent are inserted in the current_slots dictionary.
+        Make sure that all the slots for a given intent are inserted in the current slots.
         """
         if intent == "HOUSE_SEARCH":
-            self.current_slots = {
-                "house_size": None,
-                "house_bhk": None,
-                "house_rent": None,
-                "house_location": None,
-                "house_city": None,
-                "house_furnished": None,
-            }
-            for key, value in slots.items():
-                if value is not None and value != "None" and value != "null":
-                    self.current_slots[key] = value
+            if self.current_intent == "SHOW_HOUSES" and self.search_cursor:
+                # Asking for more houses or refining the last search
+                slots = {
+                    **self.search_cursor.slots,
+                    **{k: v for k, v in slots.items() if v is not None},
+                }
+            self.set_state(intent, slots)
         elif intent == "HOUSE_SELECTION":
-            self.current_slots = {"house_selected": None}
-            for key, value in slots.items():
-                if value is not None and value != "None" and value != "null":
-                    self.current_slots[key] = value
+            self.set_state(intent, slots)
             self.handle_intent(intent, False)
         elif intent == "ASK_INFO":
             if not self.active_house:
@@ -119,18 +127,22 @@ class StateTracker:
                     "No house selected, you must search or select a house first."
                 )
             else:
-                self.current_slots = slots
+                self.set_state(intent, slots)
         elif intent == "COMPARE_HOUSES":
             if not self.current_houses:
                 self.fallback_policy(
                     "No houses found to be compared, you must search for houses first."
                 )
             else:
+                self.set_state(intent, slots)
+                self.houses_to_compare = []
                 try:
-                    self.houses_to_compare = [
-                        self.current_houses[idx] for idx in slots["houses"]
-                    ]
-                    self.properties_to_compare = slots["properties"]
+                    if self.state["houses"] is not None:
+                        self.houses_to_compare = [
+                            self.current_houses[idx] for idx in self.state["houses"]
+                        ]
+                        self.market_context = self.describe_market(self.houses_to_compare)
+                    self.properties_to_compare = self.state["properties"]
                     logger.info("Comparing houses: %s", self.houses_to_compare)
                 except Exception as e:
                     logger.error(
@@ -148,7 +160,7 @@ class StateTracker:
     def check_slots(self, slots: dict):
         """Check if all the slots are filled for the current intent"""
         for val in slots.values():
-            if not val:
+            if val is None:
                 return False
         return True
 
@@ -162,19 +174,21 @@ class StateTracker:
             changed (bool): If the slots have been changed in the current turn
         """
 
-        prev_slots = self.current_slots.copy()
-        for key, value in slots.items():
-            if value is not None and value != "None" and value != "null":
-                self.current_slots[key] = value
-        if (
-            self.check_slots(self.current_slots)
-            and self.check_slots(prev_slots)
+        was_complete = self.state.is_complete()
+        self.state.update(slots)
+        if self.state.is_dirty():
+            logger.debug("Slots changed: %s", self.state.changed_slots())
+        return (
+            was_complete
+            and self.state.is_complete()
             and self.current_intent == "HOUSE_SEARCH"
-        ):
-            logger.debug("Slots changed: %s -> %s", prev_slots, self.current_slots)
-            return sorted(prev_slots.values()) != sorted(self.current_slots.values())
-        else:
-            return False
+            and self.state.is_dirty()
+        )
+
+    def _new_nba_history(self, actions=(), restore=False):
+        if restore:
+            return BoundedHistory.restored(actions, self.nba_retention, self.archive, kind="nba")
+        return BoundedHistory(actions, self.nba_retention, self.archive, kind="nba")
 
     def update_nba(self, dm_output: str):
         self.next_best_actions.append(dm_output)
@@ -188,42 +202,51 @@ class StateTracker:
         """
 
         if intent == "HOUSE_SEARCH":
+            last_action = self.next_best_actions[-1] if self.next_best_actions else ""
             if (
-                "confirmation" in self.next_best_actions[-1]
-                and "HOUSE_SEARCH" in self.next_best_actions[-1]
+                "show_houses" in last_action
+                and self.search_cursor
+                and self.search_cursor.slots == self.current_slots
+            ):
+                # Same search after showing the houses, continue with the next page
+                with section("database_search"):
+                    houses = self.search_cursor.next_page()
+                self.show_houses(houses)
+            elif (
+                "confirmation" in last_action
+                and "HOUSE_SEARCH" in last_action
                 and not changed
             ):
-                self.current_houses = self.database.get_houses(self.current_slots)
-                houses = self.current_houses
-                self.current_intent = "SHOW_HOUSES"
-                self.current_slots = {
-                    f"option_{i}": str(house) for i, house in enumerate(houses)
-                }
-                logger.info("The search resulted in %d houses.", len(houses))
+                with section("database_search"):
+                    self.search_cursor = self.database.search(self.current_slots)
+                    houses = self.search_cursor.next_page()
+                    if not houses:
+                        houses = self.widen_search()
+                self.show_houses(houses)
         elif intent == "HOUSE_SELECTION":
-            if self.current_slots["house_selected"] is not None:
+            if self.state["house_selected"] is not None:
                 try:
-                    index = int(self.current_slots["house_selected"])
+                    index = int(self.state["house_selected"])
                     self.active_house = self.current_houses[index - 1]
+                    self.market_context = self.describe_market([self.active_house])
                     logger.info("House activated: %s", self.active_house)
-                    self.current_intent = "ASK_INFO"
-                    self.current_slots = {"properties": None}
+                    self.set_state("ASK_INFO")
                 except Exception:
                     logger.error("Error in parsing the house selection intent")
                     self.fallback_policy(
                         "Error in processing the user selection. Please reselect the house."
                     )
         elif intent == "COMPARE_HOUSES":
-            self.properties_to_compare = self.current_slots["properties"]
-            if self.houses_to_compare == []:
+            self.properties_to_compare = self.state["properties"]
+            if self.houses_to_compare == [] or self.state.is_dirty("houses"):
                 try:
                     self.houses_to_compare = [
-                        self.current_houses[i] for i in self.current_slots["houses"]
+                        self.current_houses[i] for i in self.state["houses"]
                     ]
+                    self.market_context = self.describe_market(self.houses_to_compare)
                 except Exception:
                     logger.error("Error in parsing the compare houses intent")
-                    self.current_intent = "COMPARE_HOUSES"
-                    self.current_slots = {"houses": None, "properties": None}
+                    self.set_state("COMPARE_HOUSES")
         elif intent == "ASK_INFO":
             if not self.active_house:
                 self.fallback_policy(
@@ -232,23 +255,105 @@ class StateTracker:
         else:
             raise Exception(f"StateTracker Error: Handling an unknown intent {intent}.")
 
+    def widen_search(self):
+        """Search the houses around the location of a search without results."""
+        for radius_km in WIDEN_RADII_KM:
+            cursor = self.database.search(self.current_slots, radius_km)
+            houses = cursor.next_page()
+            if houses:
+                logger.info("Search widened to %.0f km around the location.", radius_km)
+                self.search_cursor = cursor
+                return houses
+        return []
+
+    def show_houses(self, houses):
+        self.current_houses = houses
+        slots = {f"option_{i}": str(house) for i, house in enumerate(houses)}
+        if houses and self.search_cursor.radius_km is not None:
+            slots["note"] = (
+                f"No houses found in {self.search_cursor.slots['house_location']}, "
+                f"these houses are within {self.search_cursor.radius_km:.0f} km from it."
+            )
+        self.set_state("SHOW_HOUSES", slots)
+        logger.info(
+            "The search resulted in %d houses (%d shown so far).",
+            len(houses),
+            self.search_cursor.offset,
+        )
+
+    def describe_market(self, houses) -> str:
+        """Describe the given houses with respect to the aggregate statistics of the database."""
+        if self.database.stats is None:
+            return ""
+        return "\n".join(
+            f"House {i + 1}:\n{self.database.stats.describe(house)}"
+            for i, house in enumerate(houses)
+        )
+
     def get_state(self) -> dict:
         info = {"intent": self.current_intent, "slots": self.current_slots}
         return info
 
+    def get_signature(self) -> int:
+        """Cheap signature of the current state, e.g. to cache the DM decisions."""
+        return self.state.signature()
+
     def fallback_policy(self, reason: str):
         logger.warning("Fallback policy activated: %s", reason)
         logger.debug("Saving last active state: %s", self.get_state())
 
-        self.last_active_state = self.get_state()
-        self.current_intent = "FALLBACK_POLICY"
-        self.current_slots = {"reason": reason}
+        self.last_active_state = self.state.snapshot()
+        self.set_state("FALLBACK_POLICY", {"reason": reason})
 
     def reset(self):
-        self.current_intent = None
-        self.current_slots = {}
-        self.next_best_actions = []
+        self.state = SlotState()
+        self.next_best_actions = self._new_nba_history()
         self.current_houses = []
+        self.search_cursor = None
         self.houses_to_compare = []
         self.properties_to_compare = []
         self.active_house = None
+        self.market_context = ""
+
+    def to_payload(self) -> dict:
+        """Serializable representation of the state, houses are stored as row ids."""
+        return {
+            "state": self.state.to_payload(),
+            "nba": list(self.next_best_actions),
+            "houses": [house.row_id for house in self.current_houses],
+            "cursor": (
+                {
+                    "slots": self.search_cursor.slots,
+                    "offset": self.search_cursor.offset,
+                    "radius_km": self.search_cursor.radius_km,
+                }
+                if self.search_cursor
+                else None
+            ),
+            "active": self.active_house.row_id if self.active_house else None,
+            "compare": [house.row_id for house in self.houses_to_compare],
+            "properties": self.properties_to_compare,
+        }
+
+    def load_payload(self, payload: dict):
+        """Restore the state from a payload created by `to_payload`."""
+        self.state = SlotState.from_payload(payload["state"])
+        self.next_best_actions = self._new_nba_history(payload["nba"], restore=True)
+        self.current_houses = self.database.get_houses_by_ids(payload["houses"])
+        self.search_cursor = None
+        if payload.get("cursor"):
+            self.search_cursor = self.database.search(
+                payload["cursor"]["slots"], payload["cursor"].get("radius_km")
+            )
+            self.search_cursor.offset = payload["cursor"]["offset"]
+        self.active_house = (
+            self.database.get_house(payload["active"])
+            if payload["active"] is not None
+            else None
+        )
+        self.houses_to_compare = self.database.get_houses_by_ids(payload["compare"])
+        self.properties_to_compare = payload["properties"]
+        if self.houses_to_compare:
+            self.market_context = self.describe_market(self.houses_to_compare)
+        elif self.active_house:
+            self.market_context = self.describe_market([self.active_house])
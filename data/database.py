@@ -1,85 +1,301 @@
+import json
+import os
+import threading
+import time
+
 import pandas as pd
 
-from typing import List, Dict
+from collections import OrderedDict
+
+from pydantic import ValidationError
+from typing import List, Dict, NamedTuple, Optional, Tuple
 from data.houses import House
+from data.stats import MarketStats
+from data.geo import GeoIndex, Gazetteer
+from data.search import SearchCursor, SearchScan, normalize_slots
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
 
+class DatabaseSnapshot(NamedTuple):
+    """Immutable version of the database, readers keep using it while updates are applied."""
+
+    version: int
+    houses: Dict[int, House]
+    rows: Tuple[House, ...]
+    stats: MarketStats
+    geo: Optional[GeoIndex] = None
+
+
 class Database:
-    def __init__(self, database_path):
+    """In-memory database of the houses.
+
+    The houses and the indexes built on them live in an immutable snapshot. Updates
+    build a new snapshot and swap it atomically, so that concurrent readers always see
+    a consistent version of the data.
+
+    Attributes:
+        database_path (str): The path of the csv file of the houses
+        gazetteer (Gazetteer): The coordinates of the localities, None to disable the geo search
+        snapshot (DatabaseSnapshot): The current version of the database
+    """
+
+    def __init__(self, database_path, search_cache_size=64, gazetteer_path=None):
         self.database_path = database_path
-        self.database: List[House] = None
+        self.gazetteer = Gazetteer.from_csv(gazetteer_path) if gazetteer_path else None
+        self.snapshot: DatabaseSnapshot = DatabaseSnapshot(0, {}, (), MarketStats())
+        self.write_lock = threading.RLock()
+        self.watcher = None
+        self.search_cache = OrderedDict()
+        self.search_cache_size = search_cache_size
+        self.cache_lock = threading.Lock()
         self.init_db(database_path)
 
+    @property
+    def database(self) -> Tuple[House, ...]:
+        return self.snapshot.rows
+
+    @property
+    def stats(self) -> MarketStats:
+        return self.snapshot.stats
+
     def init_db(self, database_path):
         """Initialize the database with the given path."""
         if database_path:
             dataframe = pd.read_csv(database_path)
-            self.database = House.from_dataframe(dataframe)
-            logger.info(f"Database initialized with {len(self.database)} houses.")
+            houses = House.from_dataframe(dataframe)
+            self.snapshot = DatabaseSnapshot(
+                0,
+                {house.row_id: house for house in houses},
+                tuple(houses),
+                MarketStats(houses),
+                GeoIndex(self.gazetteer, houses) if self.gazetteer else None,
+            )
+            logger.info("Database initialized with %d houses.", len(houses))
 
-    def get_houses(self, slots: Dict[str, str], first_n=5) -> List[House]:
-        """Get all houses from the database that match the given slots."""
+    def get_house(self, row_id: int) -> Optional[House]:
+        """Get a house given its row id, None if it has been deleted."""
+        return self.snapshot.houses.get(row_id)
 
-        # Filter slots values to match the database types
-        try:
-            house_bhk = slots.get("house_bhk")
-            if isinstance(house_bhk, str):
-                if " " in house_bhk:
-                    house_bhk = [
-                        int(word) for word in house_bhk.split() if word.isdigit()
-                    ]
-                else:
-                    house_bhk = [int(house_bhk)]
-            house_bhk = min(house_bhk) if house_bhk else 0
-            house_bhk = [i for i in range(house_bhk, 6)]
-
-            house_size = slots.get("house_size")
-            if isinstance(house_size, str):
-                if " " in house_size:
-                    house_size = [
-                        int(word) for word in house_size.split() if word.isdigit()
-                    ]
-                else:
-                    house_size = [int(house_size)]
-            house_size = min(house_size) if house_size else 0
-
-            house_rent = slots.get("house_rent")
-            if isinstance(house_rent, str):
-                if " " in house_rent:
-                    house_rent = [
-                        int(word) for word in house_rent.split() if word.isdigit()
-                    ]
-                else:
-                    house_rent = [int(house_rent)]
-            house_rent = max(house_rent) if house_rent else 1000000
-
-            house_location = slots.get("house_location")
-            house_location = house_location.lower()
-            house_city = slots.get("house_city")
-            house_city = house_city.lower()
-            house_furnished = slots.get("house_furnished")
-            house_furnished = house_furnished.lower()
-
-            logger.info(
-                f"Filtering houses with BHK: {house_bhk}, Size: {house_size}, Rent: {house_rent}, Location: {house_location}, City: {house_city}, Furnished: {house_furnished}"
-            )
+    def get_houses_by_ids(self, row_ids: List[int]) -> List[House]:
+        houses = self.snapshot.houses
+        return [houses[row_id] for row_id in row_ids if row_id in houses]
+
+    def apply_changes(self, changes: List[dict], skip_invalid=False) -> int:
+        """Apply a batch of changes atomically.
+
+        Each change is a dictionary with:
+        - op: "upsert" or "delete"
+        - row_id: the id of the house, optional for new houses
+        - house: the fields of the house (for upserts), a subset of them to update an existing house
+
+        The snapshot is copied once per batch, whatever the number of changes.
+
+        Args:
+            skip_invalid (bool): If True, the invalid changes are logged and skipped and
+                the valid ones are applied, instead of rejecting the whole batch
+
+        Returns:
+            version (int): The version of the database after the changes
+
+        Raises:
+            ValueError: If a change is not valid and `skip_invalid` is False, in which
+                case no change is applied
+        """
+        with self.write_lock:
+            snapshot = self.snapshot
+            houses = dict(snapshot.houses)
+            stats = snapshot.stats.copy()
+            geo = snapshot.geo.copy() if snapshot.geo else None
+            next_id = max(houses, default=-1) + 1
 
-            filter_func = (
-                lambda house: house.bhk in house_bhk
-                and house.size >= house_size
-                and house.rent <= house_rent
-                and house_city in house.city
-                and house_furnished in house.furnishing_status
-                and house_location in house.area_locality
+            applied = 0
+            for change in changes:
+                try:
+                    next_id = self._apply_change(change, houses, stats, geo, next_id)
+                    applied += 1
+                except ValueError as e:
+                    if not skip_invalid:
+                        raise
+                    logger.error("Skipping the invalid change %s: %s", change, e)
+
+            self.snapshot = DatabaseSnapshot(
+                snapshot.version + 1, houses, tuple(houses.values()), stats, geo
             )
+        logger.info(
+            "Applied %d changes, database version %d with %d houses.",
+            applied,
+            self.snapshot.version,
+            len(houses),
+        )
+        return self.snapshot.version
+
+    @staticmethod
+    def _apply_change(change: dict, houses: Dict[int, House], stats: MarketStats, geo, next_id: int) -> int:
+        """Apply a change to the copies of a snapshot, returning the next free row id.
+
+        Raises:
+            ValueError: If the change is not valid, before anything is modified
+        """
+        if not isinstance(change, dict):
+            raise ValueError("A change must be a dictionary.")
+        op, row_id = change.get("op"), change.get("row_id")
+        if row_id is not None and (not isinstance(row_id, int) or isinstance(row_id, bool)):
+            raise ValueError(f"Invalid row id {row_id!r}.")
+        if op == "delete":
+            house = houses.pop(row_id, None)
+            if house is None:
+                raise ValueError(f"Cannot delete the missing house {row_id}.")
+            stats.remove(house)
+            if geo:
+                geo.remove(house)
+        elif op == "upsert":
+            if row_id is None:
+                row_id = next_id
+            old_house = houses.get(row_id)
+            fields = old_house.to_dict() if old_house else {}
+            fields.update(change.get("house") or {}, row_id=row_id)
+            try:
+                house = House.from_record(fields)
+            except (ValidationError, TypeError) as e:
+                raise ValueError(f"Invalid house {row_id}: {e}") from e
+            if old_house is not None:
+                stats.remove(old_house)
+                if geo:
+                    geo.remove(old_house)
+            houses[row_id] = house
+            stats.add(house)
+            if geo:
+                geo.add(house)
+            next_id = max(next_id, row_id + 1)
+        else:
+            raise ValueError(f"Unknown change operation {op}.")
+        return next_id
+
+    def add_house(self, fields: dict) -> int:
+        """Add a new house and return its row id."""
+        with self.write_lock:
+            row_id = max(self.snapshot.houses, default=-1) + 1
+            self.apply_changes([{"op": "upsert", "row_id": row_id, "house": fields}])
+        return row_id
+
+    def update_house(self, row_id: int, fields: dict):
+        if row_id not in self.snapshot.houses:
+            raise ValueError(f"Cannot update the missing house {row_id}.")
+        self.apply_changes([{"op": "upsert", "row_id": row_id, "house": fields}])
+
+    def delete_house(self, row_id: int):
+        self.apply_changes([{"op": "delete", "row_id": row_id}])
+
+    def ingest_changelog(self, path: str, offset=0) -> int:
+        """Apply the changes of a JSON lines change log, starting from the given offset.
+
+        Only complete lines are applied, all together as one batch. The lines that are
+        not valid JSON and the invalid changes are logged and skipped.
+
+        Returns:
+            offset (int): The offset after the last complete line, the first one not read yet
+        """
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+
+        changes = []
+        position = offset
+        for line in data[:end].splitlines(keepends=True):
+            if line.strip():
+                try:
+                    change = json.loads(line)
+                    if not isinstance(change, dict):
+                        raise ValueError("a change must be a JSON object")
+                    changes.append(change)
+                except ValueError as e:
+                    logger.error("Skipping the invalid line at offset %d of %s: %s", position, path, e)
+            position += len(line)
+        if not changes:
+            return offset + end
+
+        self.apply_changes(changes, skip_invalid=True)
+        return offset + end
 
-            # Filter houses based on the slots
-            filtered_houses = list(filter(filter_func, self.database))
+    def watch_changelog(self, path: str, interval=5.0):
+        """Poll a JSON lines change log in a background thread, applying the new changes."""
+
+        def watch():
+            offset = 0
+            while True:
+                try:
+                    if os.path.getsize(path) < offset:
+                        logger.info("The change log %s was truncated, reading it from the start.", path)
+                        offset = 0
+                    offset = self.ingest_changelog(path, offset)
+                except FileNotFoundError:
+                    offset = 0  # Not created yet, or removed to be replaced
+                except Exception as e:
+                    # The offset is kept, the lines are read again at the next poll
+                    logger.error("Error in ingesting the change log %s: %s", path, e)
+                time.sleep(interval)
+
+        self.watcher = threading.Thread(target=watch, name="changelog-watcher", daemon=True)
+        self.watcher.start()
+        logger.info("Watching the change log %s", path)
+
+    def locate(self, slots: Dict[str, str]) -> Optional[Tuple[float, float]]:
+        """Coordinates of the location of the given slots, None if unknown."""
+        if self.gazetteer is None or not slots.get("house_location") or not slots.get("house_city"):
+            return None
+        return self.gazetteer.locate(
+            str(slots["house_location"]).lower(), str(slots["house_city"]).lower()
+        )
+
+    def search(self, slots: Dict[str, str], radius_km: Optional[float] = None) -> SearchCursor:
+        """Search the houses matching the given slots, returning a cursor over the results.
+
+        With a radius, the location is not matched by name: the houses within the radius
+        from it are returned, the closest first. The result is empty if the location is
+        not in the gazetteer.
+
+        The scans are cached by database version and normalized query, so that identical
+        searches (e.g. from different users) share the houses already scanned.
+        """
+        try:
+            query = normalize_slots(slots)
         except Exception as e:
             logger.error("Error in filtering the houses: %s", e)
+            return SearchCursor(None, slots, radius_km=radius_km)
+
+        snapshot = self.snapshot
+        key = (snapshot.version, query, radius_km)
+        with self.cache_lock:
+            scan = self.search_cache.get(key)
+            if scan is None:
+                logger.info("Filtering houses with %s (radius %s km)", query, radius_km)
+                if radius_km is None:
+                    scan = SearchScan(query, snapshot.rows)
+                else:
+                    center = self.locate(slots)
+                    nearby = []
+                    if center is not None and snapshot.geo is not None:
+                        nearby = [house for _, house in snapshot.geo.within(center, radius_km)]
+                    scan = SearchScan(query._replace(location=""), nearby)
+                self.search_cache[key] = scan
+                if len(self.search_cache) > self.search_cache_size:
+                    self.search_cache.popitem(last=False)
+            else:
+                self.search_cache.move_to_end(key)
+                logger.debug("Search cache hit for %s", query)
+        return SearchCursor(scan, slots, radius_km=radius_km)
+
+    def nearest_houses(self, slots: Dict[str, str], k=5) -> List[House]:
+        """The k houses closest to the location of the given slots, regardless of the other slots."""
+        center = self.locate(slots)
+        geo = self.snapshot.geo
+        if center is None or geo is None:
             return []
+        return [house for _, house in geo.nearest(center, k)]
 
-        return filtered_houses[: min(len(filtered_houses), first_n)]
+    def get_houses(self, slots: Dict[str, str], first_n=5) -> List[House]:
+        """Get the first houses from the database that match the given slots."""
+        return self.search(slots).next_page(first_n)
@@ -0,0 +1,140 @@
+import csv
+import math
+
+from typing import Dict, List, Optional, Tuple
+
+from data.houses import House
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+Point = Tuple[float, float]
+
+
+def haversine_km(a: Point, b: Point) -> float:
+    """Great-circle distance in km between two (lat, lon) points."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+class Gazetteer:
+    """Coordinates of the localities of each city, loaded from a local csv file.
+
+    The file has the columns `locality,city,lat,lon`, e.g.
+    `hebbal,bangalore,13.0358,77.5970`.
+    """
+
+    def __init__(self, points: Dict[Tuple[str, str], Point]):
+        self.points = points
+        self.cache: Dict[Tuple[str, str], Optional[Point]] = {}
+
+    @staticmethod
+    def from_csv(path: str) -> "Gazetteer":
+        points = {}
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                key = (row["city"].strip().lower(), row["locality"].strip().lower())
+                points[key] = (float(row["lat"]), float(row["lon"]))
+        logger.info("Gazetteer loaded with %d localities.", len(points))
+        return Gazetteer(points)
+
+    def locate(self, locality: str, city: str) -> Optional[Point]:
+        """Find the coordinates of a locality, also given as a listing address
+        (e.g. "sai heights, hebbal") or a request (e.g. "near hebbal").
+        None if the locality is not in the gazetteer.
+        """
+        key = (city, locality)
+        if key not in self.cache:
+            text = locality.strip().lower()
+            if text.startswith("near "):
+                text = text[len("near ") :]
+            candidates = [text] + [part.strip() for part in reversed(text.split(","))]
+            self.cache[key] = next(
+                (
+                    self.points[(city, candidate)]
+                    for candidate in candidates
+                    if (city, candidate) in self.points
+                ),
+                None,
+            )
+        return self.cache[key]
+
+
+class GeoIndex:
+    """Uniform grid over the coordinates of the houses, for radius and nearest neighbours queries.
+
+    A query only visits the cells overlapping the searched circle, so its cost depends
+    on the houses around the point and not on the size of the database.
+
+    Attributes:
+        gazetteer (Gazetteer): The coordinates of the localities
+        cell_km (float): The size of the cells of the grid
+        cells (dict): cell -> row id -> house
+        points (dict): row id -> coordinates of the house
+    """
+
+    def __init__(self, gazetteer: Gazetteer, houses=(), cell_km=2.0):
+        self.gazetteer = gazetteer
+        self.cell_km = cell_km
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self.cells: Dict[Tuple[int, int], Dict[int, House]] = {}
+        self.points: Dict[int, Point] = {}
+        for house in houses:
+            self.add(house)
+
+    def copy(self) -> "GeoIndex":
+        index = GeoIndex(self.gazetteer, cell_km=self.cell_km)
+        index.cells = {cell: dict(houses) for cell, houses in self.cells.items()}
+        index.points = dict(self.points)
+        return index
+
+    def cell(self, point: Point) -> Tuple[int, int]:
+        return (int(point[0] // self.cell_deg), int(point[1] // self.cell_deg))
+
+    def add(self, house: House):
+        point = self.gazetteer.locate(house.area_locality, house.city)
+        if point is None:
+            return
+        self.points[house.row_id] = point
+        self.cells.setdefault(self.cell(point), {})[house.row_id] = house
+
+    def remove(self, house: House):
+        point = self.points.pop(house.row_id, None)
+        if point is None:
+            return
+        cell = self.cell(point)
+        del self.cells[cell][house.row_id]
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def within(self, center: Point, radius_km: float) -> List[Tuple[float, House]]:
+        """Houses within the given distance from the center, sorted by distance."""
+        lat_cells = math.ceil(radius_km / self.cell_km)
+        lon_scale = max(math.cos(math.radians(center[0])), 1e-6)
+        lon_cells = math.ceil(radius_km / (self.cell_km * lon_scale))
+        center_lat, center_lon = self.cell(center)
+        found = []
+        for i in range(center_lat - lat_cells, center_lat + lat_cells + 1):
+            for j in range(center_lon - lon_cells, center_lon + lon_cells + 1):
+                for row_id, house in self.cells.get((i, j), {}).items():
+                    distance = haversine_km(center, self.points[row_id])
+                    if distance <= radius_km:
+                        found.append((distance, house))
+        found.sort(key=lambda item: (item[0], item[1].row_id))
+        return found
+
+    def nearest(self, center: Point, k=5, max_radius_km=100.0) -> List[Tuple[float, House]]:
+        """The k houses closest to the center, within the given maximum distance."""
+        radius = self.cell_km
+        while True:
+            found = self.within(center, min(radius, max_radius_km))
+            if len(found) >= k or radius >= max_radius_km:
+                return found[:k]
+            radius *= 2
@@ -1,7 +1,11 @@
+import sys
+import threading
+
 import pandas as pd
 
 from pydantic import BaseModel
 from datetime import date
+from typing import Dict, List
 
 # Dataset Overview
 
@@ -18,7 +22,10 @@ from datetime import date
 # - **Point of Contact**: Whom should you contact for more information regarding the Houses/Apartments/Flats.
 
 
-class House(BaseModel):
+class HouseRecord(BaseModel):
+    """Validation model of a house, only used when the houses are ingested."""
+
+    row_id: int
     posted_on: date
     bhk: int
     rent: int
@@ -32,28 +39,165 @@ class House(BaseModel):
     bathroom: int
     point_of_contact: str
 
+
+class Vocabulary:
+    """Distinct values of a categorical field, each value is referred by its code."""
+
+    __slots__ = ("values", "codes", "lock")
+
+    def __init__(self):
+        self.values: List[str] = []
+        self.codes: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            with self.lock:
+                code = self.codes.get(value)
+                if code is None:
+                    code = len(self.values)
+                    self.values.append(sys.intern(value))
+                    self.codes[value] = code
+        return code
+
+    def decode(self, code: int) -> str:
+        return self.values[code]
+
+    def matching(self, text: str) -> frozenset:
+        """Codes of the values containing the given text."""
+        return frozenset(code for code, value in enumerate(self.values) if text in value)
+
+
+# Categorical fields, with only a few distinct values each, stored as codes
+CATEGORIES = {
+    "area_type": Vocabulary(),  # ['super area' 'carpet area' 'built area']
+    "city": Vocabulary(),  # ['kolkata' 'mumbai' 'bangalore' 'delhi' 'chennai' 'hyderabad']
+    "furnishing_status": Vocabulary(),  # ['unfurnished' 'semi-furnished' 'furnished']
+    "tenant_preferred": Vocabulary(),  # ['bachelors/family' 'bachelors' 'family']
+    "point_of_contact": Vocabulary(),  # ['contact owner' 'contact agent' 'contact builder']
+}
+
+TEXT_FIELDS = ["area_type", "area_locality", "city", "furnishing_status", "tenant_preferred", "point_of_contact"]
+
+
+def _categorical(name: str):
+    vocabulary = CATEGORIES[name]
+    return property(lambda self: vocabulary.values[getattr(self, name + "_code")])
+
+
+class House:
+    """Compact record of a house.
+
+    The categorical fields are stored as codes of the `CATEGORIES` vocabularies and
+    exposed as strings, the localities are interned. The fields are not validated: use
+    `from_record` or `from_dataframe` to create the houses from external data.
+    """
+
+    FIELDS = list(HouseRecord.model_fields)
+
+    __slots__ = (
+        "row_id",
+        "posted_on",
+        "bhk",
+        "rent",
+        "size",
+        "floor",
+        "area_type_code",
+        "area_locality",
+        "city_code",
+        "furnishing_status_code",
+        "tenant_preferred_code",
+        "bathroom",
+        "point_of_contact_code",
+    )
+
+    def __init__(
+        self,
+        row_id: int,
+        posted_on: date,
+        bhk: int,
+        rent: int,
+        size: int,
+        floor: str,
+        area_type: str,
+        area_locality: str,
+        city: str,
+        furnishing_status: str,
+        tenant_preferred: str,
+        bathroom: int,
+        point_of_contact: str,
+    ):
+        self.row_id = row_id
+        self.posted_on = posted_on
+        self.bhk = bhk
+        self.rent = rent
+        self.size = size
+        self.floor = floor
+        self.area_type_code = CATEGORIES["area_type"].encode(area_type)
+        self.area_locality = sys.intern(area_locality)
+        self.city_code = CATEGORIES["city"].encode(city)
+        self.furnishing_status_code = CATEGORIES["furnishing_status"].encode(furnishing_status)
+        self.tenant_preferred_code = CATEGORIES["tenant_preferred"].encode(tenant_preferred)
+        self.bathroom = bathroom
+        self.point_of_contact_code = CATEGORIES["point_of_contact"].encode(point_of_contact)
+
+    area_type = _categorical("area_type")
+    city = _categorical("city")
+    furnishing_status = _categorical("furnishing_status")
+    tenant_preferred = _categorical("tenant_preferred")
+    point_of_contact = _categorical("point_of_contact")
+
     @staticmethod
     def from_dataframe(dataframe: pd.DataFrame):
         #'Posted On', 'BHK', 'Rent', 'Size', 'Floor', 'Area Type', 'Area Locality', 'City', 'Furnishing Status', 'Tenant Preferred', 'Bathroom', 'Point of Contact'
+        dataframe = dataframe.rename(
+            columns={
+                "Posted On": "posted_on",
+                "BHK": "bhk",
+                "Rent": "rent",
+                "Size": "size",
+                "Floor": "floor",  # [i or floor_name] out of j
+                "Area Type": "area_type",
+                "Area Locality": "area_locality",
+                "City": "city",
+                "Furnishing Status": "furnishing_status",
+                "Tenant Preferred": "tenant_preferred",
+                "Bathroom": "bathroom",
+                "Point of Contact": "point_of_contact",
+            }
+        )
         return [
-            House(
-                posted_on=row["Posted On"],
-                bhk=row["BHK"],
-                rent=row["Rent"],
-                size=row["Size"],
-                floor=row["Floor"], # [i or floor_name] out of j
-                area_type=row["Area Type"].lower(),
-                area_locality=row["Area Locality"].lower(),
-                city=row["City"].lower(), # ['Kolkata' 'Mumbai' 'Bangalore' 'Delhi' 'Chennai' 'Hyderabad']
-                furnishing_status=row["Furnishing Status"].lower(), # ['Unfurnished' 'Semi-Furnished' 'Furnished']
-                tenant_preferred=row["Tenant Preferred"].lower(), # ['Bachelors/Family' 'Bachelors' 'Family']
-                bathroom=row["Bathroom"],
-                point_of_contact=row["Point of Contact"].lower() # ['Contact Owner' 'Contact Agent' 'Contact Builder']
-            )
-            for _, row in dataframe.iterrows()
+            House.from_record(dict(row, row_id=row_id))
+            for row_id, row in enumerate(dataframe.to_dict("records"))
         ]
 
+    @staticmethod
+    def from_record(fields: dict):
+        """Create a house from a dictionary of its fields, validating them and lowercasing the text fields"""
+        fields = dict(fields)
+        for name in TEXT_FIELDS:
+            if isinstance(fields.get(name), str):
+                fields[name] = fields[name].lower()
+        return House(**HouseRecord(**fields).model_dump())
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def __eq__(self, other):
+        return isinstance(other, House) and self.to_dict() == other.to_dict()
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={value!r}" for name, value in self.to_dict().items())
+        return f"House({fields})"
+
     def __str__(self):
         return f"A {self.bhk} BHK House ({self.size} sq.ft.) in {self.area_locality}, {self.city} for {self.rent}. Suitable for {self.tenant_preferred}."
-    
-    
\ No newline at end of file
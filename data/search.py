@@ -0,0 +1,148 @@
+import threading
+
+from typing import Callable, Dict, List, NamedTuple, Sequence
+
+from data.houses import CATEGORIES, House
+
+
+class SearchQuery(NamedTuple):
+    """Normalized search criteria, used as key of the query-result cache."""
+
+    bhk_min: int
+    size_min: int
+    rent_max: int
+    location: str
+    city: str
+    furnished: str
+
+    def matcher(self) -> Callable[[House], bool]:
+        """Build the filter of the query.
+
+        The text criteria are resolved once to the matching codes of the categorical
+        fields, and the substring checks on the (interned) localities are memoized.
+        """
+        cities = CATEGORIES["city"].matching(self.city)
+        furnishings = CATEGORIES["furnishing_status"].matching(self.furnished)
+        location = self.location
+        localities: Dict[str, bool] = {}
+        bhk_min, size_min, rent_max = self.bhk_min, self.size_min, self.rent_max
+
+        def match(house: House) -> bool:
+            if not (
+                bhk_min <= house.bhk <= 5
+                and house.size >= size_min
+                and house.rent <= rent_max
+                and house.city_code in cities
+                and house.furnishing_status_code in furnishings
+            ):
+                return False
+            locality = house.area_locality
+            found = localities.get(locality)
+            if found is None:
+                found = localities[locality] = location in locality
+            return found
+
+        return match
+
+
+def parse_numbers(value) -> List[int]:
+    """Parse a numeric slot value, either a number or a text containing numbers."""
+    if value is None:
+        return []
+    if isinstance(value, int):
+        return [value]
+    if " " in value:
+        return [int(word) for word in value.split() if word.isdigit()]
+    return [int(value)]
+
+
+def normalize_slots(slots: Dict[str, str]) -> SearchQuery:
+    """Convert the HOUSE_SEARCH slots to the database types.
+
+    Raises:
+        ValueError: If a numeric slot cannot be parsed
+        AttributeError: If a text slot is missing
+    """
+    house_bhk = parse_numbers(slots.get("house_bhk"))
+    house_size = parse_numbers(slots.get("house_size"))
+    house_rent = parse_numbers(slots.get("house_rent"))
+    return SearchQuery(
+        bhk_min=min(house_bhk) if house_bhk else 0,
+        size_min=min(house_size) if house_size else 0,
+        rent_max=max(house_rent) if house_rent else 1000000,
+        location=slots.get("house_location").lower(),
+        city=slots.get("house_city").lower(),
+        furnished=slots.get("house_furnished").lower(),
+    )
+
+
+class SearchScan:
+    """Lazy scan of the houses matching a query, shared by all the cursors of the query.
+
+    The houses are only scanned as far as needed to fill the pages requested so far.
+
+    Attributes:
+        query (SearchQuery): The search criteria
+        rows (tuple): The houses of the database snapshot being scanned
+        position (int): The index of the next row to scan
+        matches (list): The houses found so far
+    """
+
+    def __init__(self, query: SearchQuery, rows: Sequence[House]):
+        self.query = query
+        self.rows = rows
+        self.position = 0
+        self.matches: List[House] = []
+        self.match = query.matcher()
+        self.lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.position >= len(self.rows)
+
+    def fill(self, count: int):
+        """Scan the rows until `count` matches are found or the rows are over."""
+        with self.lock:
+            match = self.match
+            while len(self.matches) < count and self.position < len(self.rows):
+                house = self.rows[self.position]
+                self.position += 1
+                if match(house):
+                    self.matches.append(house)
+
+
+class SearchCursor:
+    """Cursor over the results of a search, returning them one page at a time.
+
+    Attributes:
+        scan (SearchScan): The scan of the query, None for an invalid query
+        slots (dict): The slots the search was created with
+        offset (int): The number of results already returned
+        radius_km (float): The search radius around the location, None to match it by name
+    """
+
+    def __init__(self, scan: SearchScan, slots: Dict[str, str], offset=0, radius_km=None):
+        self.scan = scan
+        self.slots = slots
+        self.offset = offset
+        self.radius_km = radius_km
+
+    @property
+    def query(self):
+        return self.scan.query if self.scan else None
+
+    @property
+    def exhausted(self) -> bool:
+        if self.scan is None:
+            return True
+        self.scan.fill(self.offset + 1)
+        return self.offset >= len(self.scan.matches)
+
+    def next_page(self, n=5) -> List[House]:
+        """Return the next `n` results of the search."""
+        if self.scan is None:
+            return []
+        self.scan.fill(self.offset + n)
+        page = self.scan.matches[self.offset : self.offset + n]
+        self.offset += len(page)
+        return page
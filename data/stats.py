@@ -0,0 +1,134 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from data.houses import House
+
+# Group dimensions: name -> attributes of the house forming the group key
+DIMENSIONS = {
+    "city": ("city",),
+    "locality": ("city", "area_locality"),
+    "bhk": ("city", "bhk"),
+    "furnishing": ("city", "furnishing_status"),
+}
+
+
+class GroupStats:
+    """Rent and size distribution of a group of houses.
+
+    The values are kept sorted, so that quantiles are O(1) lookups and the percentile
+    of a value is a binary search.
+    """
+
+    __slots__ = ("rents", "sizes")
+
+    def __init__(self):
+        self.rents: List[int] = []
+        self.sizes: List[int] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.rents)
+
+    def add(self, house: House):
+        insort(self.rents, house.rent)
+        insort(self.sizes, house.size)
+
+    def remove(self, house: House):
+        del self.rents[bisect_left(self.rents, house.rent)]
+        del self.sizes[bisect_left(self.sizes, house.size)]
+
+    @staticmethod
+    def _quantile(values: List[int], q: float) -> Optional[int]:
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def copy(self) -> "GroupStats":
+        group = GroupStats()
+        group.rents = list(self.rents)
+        group.sizes = list(self.sizes)
+        return group
+
+    def rent_quantile(self, q: float) -> Optional[int]:
+        return self._quantile(self.rents, q)
+
+    def size_quantile(self, q: float) -> Optional[int]:
+        return self._quantile(self.sizes, q)
+
+    def rent_percentile(self, rent: int) -> float:
+        """Percentage of houses of the group with a rent lower than or equal to the given one."""
+        return 100 * bisect_right(self.rents, rent) / self.count if self.count else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "rent_p25": self.rent_quantile(0.25),
+            "rent_median": self.rent_quantile(0.5),
+            "rent_p75": self.rent_quantile(0.75),
+            "size_p25": self.size_quantile(0.25),
+            "size_median": self.size_quantile(0.5),
+            "size_p75": self.size_quantile(0.75),
+        }
+
+
+class MarketStats:
+    """Aggregate rent/size statistics per city, locality, BHK and furnishing status.
+
+    Attributes:
+        groups (dict): dimension -> group key -> GroupStats
+    """
+
+    def __init__(self, houses: Iterable[House] = ()):
+        self.groups: Dict[str, Dict[Tuple, GroupStats]] = {d: {} for d in DIMENSIONS}
+        for house in houses:
+            self.add(house)
+
+    def copy(self) -> "MarketStats":
+        stats = MarketStats()
+        stats.groups = {
+            dimension: {key: group.copy() for key, group in groups.items()}
+            for dimension, groups in self.groups.items()
+        }
+        return stats
+
+    @staticmethod
+    def group_key(dimension: str, house: House) -> Tuple:
+        return tuple(getattr(house, attr) for attr in DIMENSIONS[dimension])
+
+    def add(self, house: House):
+        for dimension, groups in self.groups.items():
+            key = self.group_key(dimension, house)
+            if key not in groups:
+                groups[key] = GroupStats()
+            groups[key].add(house)
+
+    def remove(self, house: House):
+        for dimension, groups in self.groups.items():
+            key = self.group_key(dimension, house)
+            groups[key].remove(house)
+            if groups[key].count == 0:
+                del groups[key]
+
+    def lookup(self, dimension: str, *key) -> Optional[GroupStats]:
+        """Get the statistics of a group, e.g. `lookup("bhk", "mumbai", 2)`."""
+        return self.groups[dimension].get(tuple(key))
+
+    def describe(self, house: House) -> str:
+        """Describe how the house compares with the similar houses of its city."""
+        lines = []
+        for dimension, label in [
+            ("city", f"in {house.city}"),
+            ("locality", f"in {house.area_locality}"),
+            ("bhk", f"with {house.bhk} BHK in {house.city}"),
+            ("furnishing", f"{house.furnishing_status} in {house.city}"),
+        ]:
+            group = self.groups[dimension].get(self.group_key(dimension, house))
+            if group is None or group.count < 2:
+                continue
+            lines.append(
+                f"- {group.count} houses {label}: median rent {group.rent_quantile(0.5)} INR "
+                f"(25%-75%: {group.rent_quantile(0.25)}-{group.rent_quantile(0.75)}), "
+                f"median size {group.size_quantile(0.5)} sq.ft.; this rent is lower than "
+                f"{100 - group.rent_percentile(house.rent):.0f}% of them"
+            )
+        return "\n".join(lines)
@@ -1,40 +1,98 @@
+import hashlib
 import json
 import random
 import os
+import time
 
+import numpy as np
+
+from collections import defaultdict
 from string import Formatter
 from tqdm import tqdm
 
+from utils.metrics import (
+    classification_report,
+    compute_metrics,
+    fuzzy_scores,
+    plot_confusion_matrix,
+)
+
+TEST_SET_PATH = os.path.join("test", "house_agency", "test_set.json")
+
+LOCATIONS = ['Narayanapura', 'Aarna Enclave', 'Abbigere', 'Adugodi', 'Agrahara Layout',
+             'Colony-Velachery', 'Adambakkam', 'Adyar', 'Alandur', 'Thiruvanmiyur',
+             'Abiramapuram', 'Sardar Patel Road', 'Konnur Highroad', 'Hebbal', 'Singasandra',
+             'Mahadevapura', 'Kaggadasapura', 'Vidyaranyapura', 'Hosur Road', 'Ayanavaram']
+CITIES = ['Kolkata', 'Mumbai', 'Bangalore', 'Delhi', 'Chennai', 'Hyderabad']
+FURNISHING = ['furnished', 'unfurnished', 'semi-furnished']
+PROPERTIES = ['rent', 'location', 'size', 'bhk', 'number of bathrooms', 'tenant preferred by the landlord', 'point of contact', 'floors in the building']
+
+
 class Evaluator:
-    def __init__(self, nlu_test_path=None, dm_test_path=None):
+    def __init__(self, nlu_test_path=None, dm_test_path=None, plot=False, verbose=False, experiment_store=None, seed=0):
+        """
+        Args:
+            nlu_test_path (str): The path of the NLU test templates
+            dm_test_path (str): The path of the DM test templates
+            plot (bool): If True, save the intent confusion matrix as an image
+            verbose (bool): If True, print every failed sample
+            experiment_store (ExperimentStore): The store recording the raw model outputs
+            seed (int): The seed used to sample the values of the test set
+        """
+        self.plot = plot
+        self.verbose = verbose
+        self.experiment_store = experiment_store
+        self.seed = seed
+        self.nlu_data, self.dm_data = [], []
+        digest = hashlib.sha1()
         if nlu_test_path:
-            test_file = open(nlu_test_path)
-            self.nlu_data = json.load(test_file)
+            with open(nlu_test_path, "rb") as test_file:
+                content = test_file.read()
+            digest.update(content)
+            self.nlu_data = json.loads(content)
         
         if dm_test_path:
-            test_file = open(dm_test_path)
-            self.dm_data = json.load(test_file)
+            with open(dm_test_path, "rb") as test_file:
+                content = test_file.read()
+            digest.update(content)
+            self.dm_data = json.loads(content)
+        self.templates_digest = digest.hexdigest()
+
+        # Template fields parsed once: (intent, template, keys)
+        self.nlu_templates = [
+            (object["intent"], template, [t[1] for t in Formatter().parse(template) if t[1] is not None])
+            for object in self.nlu_data
+            for template in object["templates"]
+        ]
 
     def create_test_set(self, n_sample=3, cached=True):
-        """Create a test set for the NLU model and save it for later reproducibility"""
-        if cached and os.path.exists("test/house_agency/test_set.json"):
-            with open("test/house_agency/test_set.json") as f:
-                test_set = json.load(f)
-            return test_set
+        """Create a test set for the NLU model and save it for later reproducibility
 
-        test_set = {"nlu_data": [], "dm_data": []}
-        for object in self.nlu_data:
-            intent = object["intent"]
-            templates = object["templates"]
-            for template in templates:
-                for _ in range(n_sample):
-                    user_input, values = self.generate_nlu_sample(template)
-                    ground_truth = self.generate_nlu_gt(intent, values)
-                    
-                    test_set["nlu_data"].append({
-                        "user_input": user_input,
-                        "ground_truth": ground_truth
-                    })
+        The test set is deterministic given the test templates, the seed and the number of
+        samples, and it is cached on disk under the hash of these inputs: it is only
+        regenerated when one of them changes.
+        """
+        fingerprint = hashlib.sha1(
+            f"{self.templates_digest}-{self.seed}-{n_sample}-v2".encode()
+        ).hexdigest()
+        if cached and os.path.exists(TEST_SET_PATH):
+            with open(TEST_SET_PATH) as f:
+                test_set = json.load(f)
+            if test_set.get("fingerprint") == fingerprint:
+                return test_set
+
+        test_set = {"fingerprint": fingerprint, "nlu_data": [], "dm_data": []}
+        rng = random.Random(self.seed)
+        for template_id, (intent, template, keys) in enumerate(self.nlu_templates):
+            for _ in range(n_sample):
+                user_input, values = self.generate_nlu_sample(template, rng, keys)
+                ground_truth = self.generate_nlu_gt(intent, values)
+
+                test_set["nlu_data"].append({
+                    "user_input": user_input,
+                    "ground_truth": ground_truth,
+                    "template_id": template_id,
+                })
 
         for object in self.dm_data:
             intent = object["intent"]
@@ -47,52 +105,67 @@ class Evaluator:
                 })
 
         # Save the test set
-        test_set_path = os.path.join("test", "house_agency", "test_set.json")
-        with open(test_set_path, "w") as f:
+        with open(TEST_SET_PATH, "w") as f:
             json.dump(test_set, f, indent=4)
 
-
         return test_set
 
-    def generate_nlu_sample(self, template)-> tuple[str,dict]:
+    def iter_nlu_samples(self, n=None, seed=None):
+        """Lazily generate NLU samples cycling over the templates, e.g. for load tests
+
+        Args:
+            n (int): The number of samples to generate, None for an endless stream
+            seed (int): The seed of the samples, defaults to the evaluator seed
+
+        Yields:
+            sample (dict): A sample with the user input and its ground truth
+        """
+        rng = random.Random(self.seed if seed is None else seed)
+        count = 0
+        while n is None or count < n:
+            intent, template, keys = self.nlu_templates[count % len(self.nlu_templates)]
+            user_input, values = self.generate_nlu_sample(template, rng, keys)
+            yield {
+                "user_input": user_input,
+                "ground_truth": self.generate_nlu_gt(intent, values),
+            }
+            count += 1
+
+    def generate_nlu_sample(self, template, rng=random, keys=None)-> tuple[str,dict]:
         """Given a certain NLU template, generate a random user input based on the template
         
         Args:
             template (str): A template string
+            rng (random.Random): The random generator used to sample the values
+            keys (list): The fields of the template, parsed from the template if not given
 
         Returns:
             user_input (str): A user input generated from the template
             random_values (dict): A dictionary containing the random values used to generate the user input
         """
-        keys = [t[1] for t in Formatter().parse(template) if t[1] is not None]
+        if keys is None:
+            keys = [t[1] for t in Formatter().parse(template) if t[1] is not None]
 
-        indices_set = set(range(1,6))
-        properties_set = set(['rent', 'location', 'size', 'bhk', 'number of bathrooms', 'tenant preferred by the landlord', 'point of contact', 'floors in the building'])
+        indices = list(range(1,6))
+        properties = list(PROPERTIES)
         random_values = {}
         for key in keys:
-            if key is None:
-                continue
             if key == "house_bhk":
-                random_values[key] = str(random.randint(1,6))
+                random_values[key] = str(rng.randint(1,6))
             elif key == "house_size":
-                random_values[key] = str(random.choice(range(500, 3000, 100)))
+                random_values[key] = str(rng.choice(range(500, 3000, 100)))
             elif key == "house_rent":
-                random_values[key] = str(random.choice(range(2000, 100000, 1000)))
+                random_values[key] = str(rng.choice(range(2000, 100000, 1000)))
             elif key == "house_location":
-                random_values[key] = random.choice(['Narayanapura', 'Aarna Enclave', 'Abbigere', 'Adugodi', 'Agrahara Layout',
-                                                'Colony-Velachery', 'Adambakkam', 'Adyar', 'Alandur', 'Thiruvanmiyur',
-                                                'Abiramapuram', 'Sardar Patel Road', 'Konnur Highroad', 'Hebbal', 'Singasandra',
-                                                'Mahadevapura', 'Kaggadasapura', 'Vidyaranyapura', 'Hosur Road', 'Ayanavaram'])
+                random_values[key] = rng.choice(LOCATIONS)
             elif key == "house_city":
-                random_values[key] = random.choice(['Kolkata', 'Mumbai', 'Bangalore', 'Delhi', 'Chennai', 'Hyderabad'])
+                random_values[key] = rng.choice(CITIES)
             elif key == "house_furnished":
-                random_values[key] = random.choice(['furnished', 'unfurnished', 'semi-furnished'])
+                random_values[key] = rng.choice(FURNISHING)
             elif "info_type" in key or "property" in key:
-                random_values[key] = random.choice(list(properties_set))
-                properties_set.remove(random_values[key])
+                random_values[key] = properties.pop(rng.randrange(len(properties)))
             elif "house_index" in key or "house_selected" in key:
-                random_values[key] = str(random.choice(list(indices_set)))
-                indices_set.remove(int(random_values[key]))
+                random_values[key] = str(indices.pop(rng.randrange(len(indices))))
 
 
         user_input = template.format(**random_values)
@@ -218,88 +291,59 @@ class Evaluator:
         Args:
             y_true (list): Ground truth values
             y_pred (list): Predicted values
-            task_type (str): 'intent' or 'slots'
+            task_type (str): 'intent', 'slots' or 'dm'
             fuzz_th (int): Fuzzy matching threshold (used only for slots)
         
         Returns:
-            tuple or None: Precision, Recall, F1 (only returned for 'slots' mode)
+            dict: The computed metrics (accuracy, macro precision/recall/F1, per class scores)
         """
-        from sklearn.metrics import (
-            accuracy_score,
-            precision_score,
-            recall_score,
-            f1_score,
-            confusion_matrix,
-            classification_report
-        )
-        import matplotlib.pyplot as plt
-        import seaborn as sns
-
         if task_type == 'intent':
-            accuracy = accuracy_score(y_true, y_pred)
-            precision = precision_score(y_true, y_pred, average='macro')
-            recall = recall_score(y_true, y_pred, average='macro')
-            f1 = f1_score(y_true, y_pred, average='macro')
+            stats = compute_metrics(y_true, y_pred)
 
-            print(f"Accuracy:        {accuracy:.2f}")
-            print(f"Macro Precision: {precision:.2f}")
-            print(f"Macro Recall:    {recall:.2f}")
-            print(f"Macro F1-score:  {f1:.2f}")
+            print(f"Accuracy:        {stats['accuracy']:.2f}")
+            print(f"Macro Precision: {stats['precision']:.2f}")
+            print(f"Macro Recall:    {stats['recall']:.2f}")
+            print(f"Macro F1-score:  {stats['f1']:.2f}")
 
             print("\nClassification Report:")
-            print(classification_report(y_true, y_pred))
+            print(classification_report(stats))
 
-            labels = sorted(set(y_true))
-            cm = confusion_matrix(y_true, y_pred, labels=labels)
-
-            plt.figure(figsize=(12, 10))
-            sns.heatmap(cm, annot=True, fmt='d', xticklabels=labels, yticklabels=labels, cmap='Blues', cbar=False)
-            plt.xlabel("Predicted", fontsize=12)
-            plt.xticks(rotation=15, ha='right', fontsize=10)
-            plt.ylabel("True", fontsize=12)
-            plt.yticks(fontsize=10)
-            plt.title("Confusion Matrix", fontsize=14)
-            plt.savefig("test/house_agency/intent_confusion_matrix.png", bbox_inches='tight')
-            plt.show()
+            if self.plot:
+                plot_confusion_matrix(
+                    stats["confusion_matrix"],
+                    stats["labels"],
+                    "test/house_agency/intent_confusion_matrix.png",
+                )
 
         elif task_type == 'slots':
-            from fuzzywuzzy import fuzz
+            fuzz_decisions = fuzzy_scores(y_true, y_pred) >= fuzz_th
 
-            fuzz_decisions = [
-                fuzz.ratio(t.lower(), p.lower()) >= fuzz_th
-                for t, p in zip(y_true, y_pred)
-            ]
-            
-            for i, decision in enumerate(fuzz_decisions):
-                if not decision:
+            if self.verbose:
+                for i in np.flatnonzero(~fuzz_decisions):
                     print(f"Fuzzy match failed for index {i}: True='{y_true[i]}', Predicted='{y_pred[i]}'")
 
-            y_pred = [y_true[i] if fuzz_decisions[i] else y_pred[i] for i in range(len(y_pred))]
+            y_pred = np.where(fuzz_decisions, np.asarray(y_true, dtype=object), np.asarray(y_pred, dtype=object))
+            stats = compute_metrics(y_true, list(y_pred))
 
-            precision = precision_score(y_true, y_pred, average='macro', zero_division=0)
-            recall = recall_score(y_true, y_pred, average='macro', zero_division=0)
-            f1 = f1_score(y_true, y_pred, average='macro', zero_division=0)
-
-            print(f"Slots Precision: {precision:.2f}")
-            print(f"Slots Recall:    {recall:.2f}")
-            print(f"Slots F1-score:  {f1:.2f}")
+            print(f"Slots Precision: {stats['precision']:.2f}")
+            print(f"Slots Recall:    {stats['recall']:.2f}")
+            print(f"Slots F1-score:  {stats['f1']:.2f}")
 
         elif task_type == 'dm':
-            accuracy = accuracy_score(y_true, y_pred)
-            print(f"DM Accuracy: {accuracy:.2f}")
-
-            precision = precision_score(y_true, y_pred, average='macro', zero_division=0)
-            recall = recall_score(y_true, y_pred, average='macro', zero_division=0)
-            f1 = f1_score(y_true, y_pred, average='macro', zero_division=0)
-            print(f"Slots Precision: {precision:.2f}")
-            print(f"Slots Recall:    {recall:.2f}")
-            print(f"Slots F1-score:  {f1:.2f}")
+            stats = compute_metrics(y_true, y_pred)
+            print(f"DM Accuracy: {stats['accuracy']:.2f}")
+
+            print(f"Slots Precision: {stats['precision']:.2f}")
+            print(f"Slots Recall:    {stats['recall']:.2f}")
+            print(f"Slots F1-score:  {stats['f1']:.2f}")
         else:
-            raise ValueError("task_type must be either 'intent' or 'slots'")
+            raise ValueError("task_type must be either 'intent', 'slots' or 'dm'")
+
+        return stats
 
     def evaluate_NLU(self, nlu_model, conversation):
 
-        test_set = self.create_test_set(cached=False)["nlu_data"]
+        test_set = self.create_test_set()["nlu_data"]
         intent_gt = []
         intent_pred = []
         slots = {}
@@ -307,6 +351,7 @@ class Evaluator:
 
         loop = tqdm(enumerate(test_set), desc="Evaluating NLU", total=len(test_set), colour="green")
         for i, sample in loop:
+            self.set_sample_id("nlu", sample)
             conversation.reset(_for=sample["ground_truth"]["intent"])
 
             user_input = sample["user_input"]
@@ -323,7 +368,7 @@ class Evaluator:
             if len(nlu_output) > 0:
                 nlu_output = nlu_output[0]
                 intent_pred.append(nlu_output["intent"])
-                if ground_truth["intent"] != nlu_output["intent"]:
+                if self.verbose and ground_truth["intent"] != nlu_output["intent"]:
                     print("Accuracy 0 on this sample ================")
                     print(f"Input query: ++++++++++++++\nHistory:\n{conversation.get_history()}\n\nUser: {user_input}\n+++++++++++++++")
                     print(f"NLU output: {nlu_output}")
@@ -349,6 +394,14 @@ class Evaluator:
 
         # Save results
         json.dump(results, open("test/house_agency/nlu_results.json", "w"), indent=4)
+        if self.experiment_store:
+            print(f"Experiment store: {self.experiment_store.stats()}")
+        classifier = getattr(nlu_model, "intent_classifier", None)
+        if classifier is not None:
+            print(f"Intent classifier: {classifier.answered} answered, {classifier.deferred} left to the LLM")
+        slot_extractor = getattr(nlu_model, "slot_extractor", None)
+        if slot_extractor is not None:
+            print(f"Slot extractor: {slot_extractor.resolved} requests resolved without the LLM")
 
         self.compute_stats(intent_gt, intent_pred, task_type="intent")
         for intent, slot_data in slots.items():
@@ -358,11 +411,12 @@ class Evaluator:
             self.compute_stats(slot_gt, slot_pred, task_type="slots")
 
     
-    def evaluate_NLU_fake(self):
+    def evaluate_NLU_fake(self, results_path="test/house_agency/nlu_results.json"):
+        """Re-score the NLU outputs saved by a previous run of `evaluate_NLU`"""
         intent_gt = []
         intent_pred = []
         slots = {}
-        results = json.load(open("test/house_agency/nlu_results.json"))
+        results = json.load(open(results_path))
 
         loop = tqdm(enumerate(results), desc="Evaluating NLU", total=len(results), colour="green")
         for i, test in loop:
@@ -389,14 +443,14 @@ class Evaluator:
                         pred_val = pred_slots[key]
                     slots[ground_truth["intent"]]["gt"].append(str(true_val))
                     slots[ground_truth["intent"]]["pred"].append(str(pred_val))
-                    if true_slots[key] != pred_slots[key]:
+                    if self.verbose and true_slots[key] != pred_slots[key]:
                         print(f"Slots mismatch: [{ground_truth['intent']}] {key} - gt: {true_slots[key]}, Predicted: {pred_slots[key]}")
                         print(f"Input query:\n{test['sample']['user_input']}\n+++++++++++++++")
             else:
                 intent_pred.append("ERROR")
                 print("NLU output is empty")
 
-        # self.compute_stats(intent_gt, intent_pred, task_type="intent")
+        self.compute_stats(intent_gt, intent_pred, task_type="intent")
         for intent, slot_data in slots.items():
             slot_gt = slot_data["gt"]
             slot_pred = slot_data["pred"]
@@ -410,7 +464,7 @@ class Evaluator:
             dm_model (DM): The dialogue manager model to evaluate
             deterministic (bool): If True, the DM will use deterministic outputs
         """
-        test_set = self.create_test_set(cached=False)["dm_data"]
+        test_set = self.create_test_set()["dm_data"]
 
         dm_gt = []
         dm_pred = []
@@ -418,6 +472,7 @@ class Evaluator:
 
         loop = tqdm(enumerate(test_set), desc="Evaluating DM", total=len(test_set), colour="blue")
         for i, sample in loop:
+            self.set_sample_id("dm", sample)
             nlu_output = sample["nlu_output"]
             ground_truth = sample["ground_truth"]
 
@@ -431,7 +486,7 @@ class Evaluator:
             if ground_truth in dm_output:
                 # print(f"DM output matches ground truth: {ground_truth} == {dm_output}")
                 ground_truth = dm_output
-            else:
+            elif self.verbose:
                 print(f"DM output does not match ground truth: {ground_truth} != {dm_output}")
                 print(f"Input query:\n{sample['nlu_output']}\n+++++++++++++++")
 
@@ -443,6 +498,291 @@ class Evaluator:
 
         # Save results
         json.dump(results, open("test/house_agency/dm_results.json", "w"), indent=4)
+        if self.experiment_store:
+            print(f"Experiment store: {self.experiment_store.stats()}")
+
+    def benchmark_DM(self, dm_model, batch_size=8):
+        """Run the rule-based and the LLM policies of the DM on the test set side by side
+
+        The LLM prompts are generated in batches of `batch_size`. For each policy the
+        accuracy, the mean latency per sample and the generated tokens are reported.
+
+        Args:
+            dm_model (DM): The dialogue manager model to benchmark
+            batch_size (int): The number of DM prompts generated together
+        """
+        test_set = self.create_test_set()["dm_data"]
+        states = [sample["nlu_output"] for sample in test_set]
+        ground_truths = [sample["ground_truth"] for sample in test_set]
+
+        report = {}
+        for policy in ["deterministic", "llm"]:
+            outputs, tokens = [], 0
+            start = time.perf_counter()
+            for i in tqdm(range(0, len(states), batch_size), desc=f"DM [{policy}]", colour="blue"):
+                batch = states[i : i + batch_size]
+                batch_outputs, usage = dm_model.batch(
+                    batch, deterministic=policy == "deterministic", use_cache=False, return_usage=True
+                )
+                outputs += batch_outputs
+                tokens += sum(u["completion_tokens"] for u in usage)
+            elapsed = time.perf_counter() - start
+
+            # Only an output made of exactly the expected action is correct
+            correct = sum(gt == dm_model.parse_action(output) for gt, output in zip(ground_truths, outputs))
+            report[policy] = {
+                "accuracy": correct / len(states),
+                "latency_ms": 1000 * elapsed / len(states),
+                "generated_tokens": tokens,
+                "tokens_per_sample": tokens / len(states),
+                "outputs": outputs,
+            }
+
+        print(f"{'Policy':<15}{'Accuracy':>10}{'ms/sample':>12}{'tokens':>10}{'tokens/sample':>15}")
+        for policy, stats in report.items():
+            print(f"{policy:<15}{stats['accuracy']:>10.2f}{stats['latency_ms']:>12.1f}{stats['generated_tokens']:>10d}{stats['tokens_per_sample']:>15.1f}")
+
+        json.dump(report, open("test/house_agency/dm_benchmark.json", "w"), indent=4)
+        return report
+
+    def ab_test_prompts(self, variants, conversation):
+        """Compare the prompt variants (e.g. static and dynamic) on the intent classification
+        and the DM decisions of the test set: accuracy, time per sample and prompt tokens.
+
+        Args:
+            variants (dict): name -> (NLU, DM) built with the prompts of the variant
+            conversation (Conversation): The conversation used as history of the NLU samples
+        """
+        test_set = self.create_test_set()
+        nlu_data, dm_data = test_set["nlu_data"], test_set["dm_data"]
+
+        report = {}
+        for name, (nlu_model, dm_model) in variants.items():
+            nlu_model.prompt_builder.count = dm_model.prompt_builder.count = True
+            correct, start = 0, time.perf_counter()
+            for sample in tqdm(nlu_data, desc=f"Intent [{name}]", colour="green"):
+                self.set_sample_id("nlu", sample)
+                conversation.reset(_for=sample["ground_truth"]["intent"])
+                chunks = nlu_model.classify_intent(sample["user_input"], conversation.get_history())
+                correct += chunks[0]["intent"].upper() == sample["ground_truth"]["intent"]
+            intent_ms = 1000 * (time.perf_counter() - start) / len(nlu_data) if nlu_data else 0.0
+            intent_accuracy = correct / len(nlu_data) if nlu_data else 0.0
+
+            correct, start = 0, time.perf_counter()
+            for sample in tqdm(dm_data, desc=f"DM [{name}]", colour="blue"):
+                self.set_sample_id("dm", sample)
+                correct += sample["ground_truth"] in dm_model(sample["nlu_output"])
+            dm_ms = 1000 * (time.perf_counter() - start) / len(dm_data) if dm_data else 0.0
+            dm_accuracy = correct / len(dm_data) if dm_data else 0.0
+
+            tokens = {**nlu_model.prompt_builder.report(), **dm_model.prompt_builder.report()}
+            report[name] = {
+                "intent_accuracy": intent_accuracy,
+                "intent_ms": intent_ms,
+                "intent_prompt_tokens": tokens.get("intent", {}).get("mean_tokens", 0.0),
+                "dm_accuracy": dm_accuracy,
+                "dm_ms": dm_ms,
+                "dm_prompt_tokens": tokens.get("dm", {}).get("mean_tokens", 0.0),
+            }
+
+        print(f"{'Prompts':<10}{'Intent acc':>12}{'ms':>9}{'tokens':>9}{'DM acc':>10}{'ms':>9}{'tokens':>9}")
+        for name, stats in report.items():
+            print(
+                f"{name:<10}{stats['intent_accuracy']:>12.2f}{stats['intent_ms']:>9.1f}{stats['intent_prompt_tokens']:>9.0f}"
+                f"{stats['dm_accuracy']:>10.2f}{stats['dm_ms']:>9.1f}{stats['dm_prompt_tokens']:>9.0f}"
+            )
+
+        json.dump(report, open("test/house_agency/prompt_ab.json", "w"), indent=4)
+        return report
+
+    def benchmark_decoding(self, model, tokenizer, variants, dm_model):
+        """Compare the decoding variants (e.g. greedy and speculative) on the NLU slot
+        filling and the DM prompts of the test set: generated tokens per second, and
+        share of the outputs equal to the ones of the first variant.
+
+        Args:
+            model: The HuggingFace model
+            tokenizer: The tokenizer of the model
+            variants (dict): name -> arguments of the generation of the variant
+            dm_model (DM): The dialogue manager building the DM prompts
+        """
+        from prompts.house_agency.nlu_prompts import NLU_PROMPTS
+        from utils.json_parser import JSONStreamExtractor
+        from utils.utils import generate, last_usage
+
+        test_set = self.create_test_set()
+        prompts = []
+        for sample in test_set["nlu_data"]:
+            intent = sample["ground_truth"]["intent"]
+            if intent in NLU_PROMPTS:
+                system_prompt = NLU_PROMPTS[intent].format("")
+                prompts.append((dm_model.args.chat_template.format(system_prompt, sample["user_input"]), True))
+        for sample in test_set["dm_data"]:
+            if dm_model.rule_based_choice(sample["nlu_output"]) is None:
+                prompts.append((dm_model.build_prompt(sample["nlu_output"]), False))
+
+        report, reference = {}, None
+        for name, args in variants.items():
+            outputs, tokens = [], 0
+            start = time.perf_counter()
+            for text, is_json in tqdm(prompts, desc=f"Decoding [{name}]", colour="green"):
+                extractor = JSONStreamExtractor() if is_json else None
+                outputs.append(generate(model, text, tokenizer, args, extractor))
+                tokens += last_usage()["completion_tokens"]
+            elapsed = time.perf_counter() - start
+            reference = reference or outputs
+
+            report[name] = {
+                "tokens_per_second": tokens / elapsed if elapsed else 0.0,
+                "ms_per_sample": 1000 * elapsed / len(prompts) if prompts else 0.0,
+                "generated_tokens": tokens,
+                "equal_outputs": sum(a == b for a, b in zip(reference, outputs)) / len(prompts) if prompts else 0.0,
+                "outputs": outputs,
+            }
+
+        print(f"{'Decoding':<15}{'tokens/s':>10}{'ms/sample':>12}{'tokens':>10}{'equal':>8}")
+        for name, stats in report.items():
+            print(f"{name:<15}{stats['tokens_per_second']:>10.1f}{stats['ms_per_sample']:>12.1f}{stats['generated_tokens']:>10d}{stats['equal_outputs']:>8.2f}")
+
+        json.dump(report, open("test/house_agency/decoding_benchmark.json", "w"), indent=4)
+        return report
+
+    def evaluate_DM_fake(self, results_path="test/house_agency/dm_results.json"):
+        """Re-score the DM outputs saved by a previous run of `evaluate_DM`"""
+        results = json.load(open(results_path))
+
+        dm_gt = []
+        dm_pred = []
+        for test in results:
+            ground_truth = test["sample"]["ground_truth"]
+            dm_output = test["dm_output"]
+            dm_gt.append(dm_output if ground_truth in dm_output else ground_truth)
+            dm_pred.append(dm_output)
+
+        return self.compute_stats(dm_gt, dm_pred, task_type="dm")
+
+    def intent_template_split(self, holdout=0.3):
+        """Hold out a share of the NLU templates of every intent to evaluate the intent
+        classifier on sentences it has not been trained on. The intents with a single
+        template keep it for training.
+
+        Returns:
+            held_out (set): The indices in `nlu_templates` of the held-out templates
+        """
+        rng = random.Random(self.seed)
+        by_intent = defaultdict(list)
+        for template_id, (intent, _, _) in enumerate(self.nlu_templates):
+            by_intent[intent].append(template_id)
+        held_out = set()
+        for template_ids in by_intent.values():
+            if len(template_ids) < 2:
+                continue
+            rng.shuffle(template_ids)
+            held_out.update(template_ids[: max(1, round(holdout * len(template_ids)))])
+        return held_out
+
+    def intent_training_data(self, n_per_template=20, traffic_path=None, held_out=()):
+        """Training samples of the intent classifier: the NLU templates filled with random
+        values (with a different seed from the test set), and optionally the samples logged
+        by a previous run of `evaluate_NLU`.
+
+        Args:
+            n_per_template (int): The number of samples of every template
+            traffic_path (str): The NLU results of previous runs, their sentences that are
+                in the test set are discarded
+            held_out (set): The indices of the templates excluded from the training
+
+        Returns:
+            texts (list): The user inputs
+            labels (list): Their intents
+        """
+        rng = random.Random(self.seed + 1)
+        texts, labels = [], []
+        for template_id, (intent, template, keys) in enumerate(self.nlu_templates):
+            if template_id in held_out:
+                continue
+            for _ in range(n_per_template):
+                user_input, _ = self.generate_nlu_sample(template, rng, keys)
+                texts.append(user_input)
+                labels.append(intent)
+
+        if traffic_path and os.path.exists(traffic_path):
+            test_texts = {sample["user_input"] for sample in self.create_test_set()["nlu_data"]}
+            discarded = 0
+            with open(traffic_path) as f:
+                for result in json.load(f):
+                    if result["sample"]["user_input"] in test_texts:
+                        discarded += 1
+                        continue
+                    texts.append(result["sample"]["user_input"])
+                    labels.append(result["sample"]["ground_truth"]["intent"])
+            if discarded:
+                print(f"Discarded {discarded} traffic samples that are in the test set")
+        return texts, labels
+
+    def evaluate_intent_classifier(self, classifier, results_path="test/house_agency/nlu_results.json", thresholds=(0.5, 0.7, 0.8, 0.9, 0.95), held_out=None):
+        """Report how much of the intent classification the local classifier absorbs and at
+        what accuracy cost, for several confidence thresholds.
+
+        The LLM predictions are taken from the results of a previous run of `evaluate_NLU`:
+        the combined accuracy uses the classifier above the threshold and the LLM below it.
+
+        Args:
+            classifier (IntentClassifier): The trained classifier
+            results_path (str): The NLU results with the LLM predictions, optional
+            thresholds (tuple): The confidence thresholds to compare
+            held_out (set): The templates excluded from the training (see
+                `intent_template_split`), only their samples are evaluated
+        """
+        test_set = self.create_test_set()["nlu_data"]
+        if held_out is not None:
+            test_set = [sample for sample in test_set if sample["template_id"] in held_out]
+        texts = [sample["user_input"] for sample in test_set]
+        intent_gt = [sample["ground_truth"]["intent"] for sample in test_set]
+        if not texts:
+            # e.g. a small test set with no sample of the held-out templates
+            print("Intent classifier: no held-out sample in the test set, nothing to evaluate.")
+            return {"samples": 0}
+
+        start = time.perf_counter()
+        predictions = classifier.predict(texts)
+        latency_ms = 1000 * (time.perf_counter() - start) / len(texts)
+        intent_pred = np.array([intent for intent, _ in predictions], dtype=object)
+        confidence = np.array([c for _, c in predictions])
+        correct = intent_pred == np.array(intent_gt, dtype=object)
+
+        llm_correct = None
+        if results_path and os.path.exists(results_path):
+            with open(results_path) as f:
+                llm_outputs = {
+                    result["sample"]["user_input"]: result["nlu_output"][0]["intent"] if result["nlu_output"] else "ERROR"
+                    for result in json.load(f)
+                }
+            if all(text in llm_outputs for text in texts):
+                llm_correct = np.array([llm_outputs[text] == gt for text, gt in zip(texts, intent_gt)])
+
+        print(f"Intent classifier: {latency_ms:.3f} ms/sample, accuracy {correct.mean():.2f} on {len(texts)} held-out samples")
+        if llm_correct is not None:
+            print(f"LLM accuracy: {llm_correct.mean():.2f}")
+        print(f"{'Threshold':>10}{'Coverage':>10}{'Accuracy':>10}{'Combined':>10}")
+        report = {"samples": len(texts), "latency_ms": latency_ms, "accuracy": float(correct.mean()), "thresholds": {}}
+        for threshold in thresholds:
+            covered = confidence >= threshold
+            accuracy = float(correct[covered].mean()) if covered.any() else 0.0
+            combined = float(np.where(covered, correct, llm_correct).mean()) if llm_correct is not None else None
+            report["thresholds"][threshold] = {"coverage": float(covered.mean()), "accuracy": accuracy, "combined_accuracy": combined}
+            print(f"{threshold:>10.2f}{covered.mean():>10.2%}{accuracy:>10.2f}{combined if combined is not None else float('nan'):>10.2f}")
+
+        stats = self.compute_stats(intent_gt, list(intent_pred), task_type="intent")
+        report["f1"] = stats["f1"]
+        return report
+
+    def set_sample_id(self, task, sample):
+        """Record the id of the current sample with the generations of the experiment store"""
+        if self.experiment_store is None:
+            return
+        content = json.dumps(sample, sort_keys=True).encode("utf-8")
+        self.experiment_store.sample_id = f"{task}-{hashlib.sha1(content).hexdigest()[:12]}"
 
 
 
@@ -0,0 +1,212 @@
+import random
+import threading
+import time
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from string import Formatter
+from typing import Dict, List
+
+from components.state_tracker import StateTracker
+from data.database import Database
+from evaluator import PROPERTIES
+from utils.conversation import Conversation
+from utils.logger import get_logger, log_context, set_log_context
+from utils.utils import single_flight_stats
+
+logger = get_logger(__name__)
+
+CONFIRMATIONS = [
+    "Yes, that's correct",
+    "Yes, please show me the houses you found",
+    "Correct, go ahead with the search",
+    "Yes",
+]
+
+# Follow-up utterances to fill the search slots missing from the first message
+SLOT_FOLLOW_UPS = {
+    "house_bhk": "I need {house_bhk} BHK",
+    "house_size": "At least {house_size} square feet",
+    "house_rent": "My budget is {house_rent} rupees per month",
+    "house_location": "It should be in {house_location}",
+    "house_city": "In {house_city}",
+    "house_furnished": "I'd prefer it {house_furnished}",
+}
+
+
+class SessionGenerator:
+    """Compose realistic multi-turn sessions from the NLU test templates.
+
+    A session follows the flow search -> (missing slots) -> confirm -> select ->
+    ask_info, or search -> (missing slots) -> confirm -> compare. The search values are
+    taken from a real house of the database, so that the search returns some results.
+
+    Attributes:
+        database (Database): The database the search values are sampled from
+        templates (dict): The templates of each intent with their parsed fields
+        rng (random.Random): The random generator of the sessions
+    """
+
+    def __init__(self, database: Database, templates: List[dict], seed=0):
+        self.database = database
+        self.rng = random.Random(seed)
+        self.templates = {
+            object["intent"]: [
+                (template, [t[1] for t in Formatter().parse(template) if t[1] is not None])
+                for template in object["templates"]
+            ]
+            for object in templates
+        }
+
+    def search_values(self) -> Dict[str, str]:
+        house = self.rng.choice(self.database.database)
+        return {
+            "house_bhk": str(house.bhk),
+            "house_size": str(max(100, house.size // 100 * 100)),
+            "house_rent": str((house.rent // 1000 + 1) * 1000),
+            "house_location": house.area_locality,
+            "house_city": house.city.capitalize(),
+            "house_furnished": house.furnishing_status,
+        }
+
+    def fill(self, intent: str, values: dict) -> str:
+        template, keys = self.rng.choice(self.templates[intent])
+        indices = list(range(1, 6))
+        properties = list(PROPERTIES)
+        fields = {}
+        for key in keys:
+            if key in values:
+                fields[key] = values[key]
+            elif "info_type" in key or "property" in key:
+                fields[key] = properties.pop(self.rng.randrange(len(properties)))
+            elif "house_index" in key or "house_selected" in key:
+                fields[key] = str(indices.pop(self.rng.randrange(len(indices))))
+        return template.format(**fields)
+
+    def session(self) -> List[str]:
+        """Generate the user messages of a session."""
+        values = self.search_values()
+        template, keys = self.rng.choice(self.templates["HOUSE_SEARCH"])
+        turns = [template.format(**{key: values[key] for key in keys})]
+        for slot, follow_up in SLOT_FOLLOW_UPS.items():
+            if slot not in keys:
+                turns.append(follow_up.format(**values))
+        turns.append(self.rng.choice(CONFIRMATIONS))
+
+        if self.rng.random() < 0.5:
+            turns.append(self.fill("HOUSE_SELECTION", values))
+            turns.append(self.fill("ASK_INFO", values))
+        else:
+            turns.append(self.fill("COMPARE_HOUSES", values))
+        return turns
+
+
+class LoadGenerator:
+    """Replay the generated sessions against the in-process pipeline.
+
+    Sessions start following a Poisson process with the given arrival rate and their
+    turns are run sequentially, each session with its own conversation and state. A
+    failed turn is counted as an error and the session goes on with the next turn, as
+    a user retrying would.
+
+    Attributes:
+        nlu, dm, nlg: The pipeline components, shared by all the sessions
+        database (Database): The database shared by all the sessions
+        concurrency (int): The maximum number of sessions running at the same time
+    """
+
+    def __init__(self, nlu, dm, nlg, database: Database, concurrency=8):
+        self.nlu = nlu
+        self.dm = dm
+        self.nlg = nlg
+        self.database = database
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.failed_sessions = 0
+        self.fallbacks = 0
+        self.sessions = 0
+
+    def run_session(self, turns: List[str]):
+        with self.lock:
+            self.sessions += 1
+            set_log_context(session_id=f"load-{self.sessions}")
+        conversation = Conversation(history_size=3)
+        state_tracker = StateTracker(self.database)
+        failed = False
+        for turn_id, user_input in enumerate(turns, start=1):
+            set_log_context(turn_id=turn_id)
+            start = time.perf_counter()
+            try:
+                with log_context(stage="nlu"):
+                    nlu_output = self.nlu(user_input, conversation.get_history())
+                conversation.update("user", user_input)
+                with log_context(stage="state_tracker"):
+                    state_tracker.update(nlu_output)
+                    current_state = state_tracker.get_state()
+                with log_context(stage="dm"):
+                    dm_output = self.dm(current_state)
+                state_tracker.update_nba(dm_output)
+                with log_context(stage="nlg"):
+                    nlg_output = self.nlg(state_tracker, conversation.get_history())
+                conversation.update("system", nlg_output)
+            except Exception:
+                logger.exception("Error in the load test session")
+                with self.lock:
+                    self.errors += 1
+                    self.failed_sessions += not failed
+                    self.latencies.append(time.perf_counter() - start)
+                failed = True
+                continue
+            with self.lock:
+                self.latencies.append(time.perf_counter() - start)
+                if "fallback_policy" in dm_output:
+                    self.fallbacks += 1
+
+    def run(self, generator: SessionGenerator, n_sessions: int, arrival_rate: float) -> dict:
+        """Run the load test and report throughput, latency and error/fallback rate
+
+        Args:
+            generator (SessionGenerator): The generator of the sessions
+            n_sessions (int): The number of sessions to run
+            arrival_rate (float): The mean number of new sessions per second
+        """
+        sessions = [generator.session() for _ in range(n_sessions)]
+        flights = single_flight_stats()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for turns in sessions:
+                executor.submit(self.run_session, turns)
+                time.sleep(generator.rng.expovariate(arrival_rate))
+        elapsed = time.perf_counter() - start
+
+        latencies = np.asarray(self.latencies)
+        n_turns = len(latencies)
+        report = {
+            "sessions": n_sessions,
+            "turns": n_turns,
+            "elapsed_s": elapsed,
+            "throughput_turns_s": n_turns / elapsed if elapsed else 0.0,
+            "latency_p50_s": float(np.percentile(latencies, 50)) if n_turns else 0.0,
+            "latency_p95_s": float(np.percentile(latencies, 95)) if n_turns else 0.0,
+            "latency_p99_s": float(np.percentile(latencies, 99)) if n_turns else 0.0,
+            "error_rate": self.errors / n_turns if n_turns else 0.0,
+            "session_error_rate": self.failed_sessions / n_sessions if n_sessions else 0.0,
+            "fallback_rate": self.fallbacks / n_turns if n_turns else 0.0,
+            "generations": single_flight_stats()["executed"] - flights["executed"],
+            "shared_generations": single_flight_stats()["saved"] - flights["saved"],
+        }
+        return report
+
+
+def print_report(report: dict):
+    print(f"Sessions:        {report['sessions']} ({report['turns']} turns in {report['elapsed_s']:.1f}s)")
+    print(f"Throughput:      {report['throughput_turns_s']:.2f} turns/s")
+    print(f"Latency p50:     {report['latency_p50_s'] * 1000:.1f} ms")
+    print(f"Latency p95:     {report['latency_p95_s'] * 1000:.1f} ms")
+    print(f"Latency p99:     {report['latency_p99_s'] * 1000:.1f} ms")
+    print(f"Error rate:      {report['error_rate']:.2%} of the turns, {report['session_error_rate']:.2%} of the sessions")
+    print(f"Fallback rate:   {report['fallback_rate']:.2%}")
+    print(f"Generations:     {report['generations']} ({report['shared_generations']} shared with an identical one in flight)")
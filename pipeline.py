@@ -1,19 +1,33 @@
 import argparse
 from argparse import Namespace
+import json
+import logging
 import os
 
+from contextlib import contextmanager, nullcontext
+
 import torch
 import ollama
 
 from utils.utils import load_model, MODELS, TEMPLATES
+from utils.model_server import RemoteModel, serve
+from utils.profiler import TurnProfiler
 from components.nlu import NLU
+from components.intent_classifier import IntentClassifier
+from components.slot_extractor import SlotExtractor
 from components.dm import DM
 from components.nlg import NLG
 from components.state_tracker import StateTracker
 from utils.conversation import Conversation
 from data.database import Database
 from evaluator import Evaluator
-from utils.logger import setup_logging
+from load_generator import LoadGenerator, SessionGenerator, print_report
+from utils.logger import log_context, set_log_context, setup_logging, get_logger
+from utils.session_store import SessionStore
+from utils.history import HistoryArchive, session_memory_report
+from utils.experiment_store import ExperimentStore
+
+logger = get_logger(__name__)
 
 
 def get_args() -> Namespace:
@@ -47,6 +61,24 @@ def get_args() -> Namespace:
         default="bf16",
         help="The data type to use for the model.",
     )
+    parser.add_argument(
+        "--model-cache",
+        type=str,
+        default=None,
+        help="A directory where the model is saved once as sharded safetensors in the chosen dtype, the next runs load it from there.",
+    )
+    parser.add_argument(
+        "--draft-model",
+        type=str,
+        default=None,
+        help="A small model with the same tokenizer (e.g. meta-llama/Llama-3.2-1B-Instruct) drafting the tokens verified by the main model. Not used by the batched generations.",
+    )
+    parser.add_argument(
+        "--prompt-lookup-tokens",
+        type=int,
+        default=0,
+        help="Draft this many tokens by matching the last n-grams in the prompt (0 to disable), ignored with --draft-model.",
+    )
     parser.add_argument(
         "--max-new-tokens",
         type=int,
@@ -66,7 +98,130 @@ def get_args() -> Namespace:
         default="house_dataset/House_Rent_Dataset.csv",
         help="The path to the csv file to use as database.",
     )
+    parser.add_argument(
+        "--gazetteer-path",
+        type=str,
+        default=None,
+        help="A csv file (locality,city,lat,lon) with the coordinates of the localities, enables the search around a location.",
+    )
+    parser.add_argument(
+        "--changelog",
+        type=str,
+        default=None,
+        help="A JSON lines change log of the houses, watched and applied while running.",
+    )
+    parser.add_argument(
+        "--changelog-interval",
+        type=float,
+        default=5.0,
+        help="How often (in seconds) the change log is checked for new changes.",
+    )
+    parser.add_argument(
+        "--intent-classifier",
+        type=str,
+        default=None,
+        dest="intent_classifier_path",
+        help="The path (.npz) of the local intent classifier used before the LLM, trained with --eval-task intent_classifier.",
+    )
+    parser.add_argument(
+        "--intent-traffic",
+        type=str,
+        default=None,
+        help="The NLU results of previous runs, added to the templates to train the intent classifier.",
+    )
+    parser.add_argument(
+        "--intent-threshold",
+        type=float,
+        default=0.7,
+        help="The minimum confidence of the local intent classifier to skip the LLM.",
+    )
+    parser.add_argument(
+        "--no-slot-extractor",
+        action="store_false",
+        dest="slot_extractor",
+        help="Disable the deterministic extraction of the search slots before the LLM.",
+    )
+    parser.add_argument(
+        "--prompt-mode",
+        type=str,
+        choices=["static", "dynamic"],
+        default="static",
+        help="Use the full intent and DM prompts, or only the rules and examples relevant to the request.",
+    )
+    parser.add_argument(
+        "--few-shot-k",
+        type=int,
+        default=3,
+        help="The number of examples of the dynamic prompts.",
+    )
+    parser.add_argument(
+        "--multi-intent",
+        action="store_true",
+        help="Split the user messages with more than one request into chunks, one per intent.",
+    )
+    parser.add_argument(
+        "--model-server",
+        type=str,
+        default=None,
+        help="The address (unix socket path or host:port) of a model server, used instead of loading the model when it is running.",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Load the model once and serve it at --model-server for the other runs.",
+    )
     parser.add_argument("--debug", action="store_true", help="Enable debug logging.")
+    parser.add_argument(
+        "--log-json",
+        type=str,
+        default=None,
+        help="A JSON lines file where the logs are also written, with their session, turn and stage.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        metavar="OUTPUT_DIR",
+        help="Profile the stages of every chat turn and write the artifacts to this directory.",
+    )
+    parser.add_argument(
+        "--profile-tools",
+        type=str,
+        nargs="+",
+        choices=["cprofile", "tracemalloc", "torch"],
+        default=["cprofile", "tracemalloc", "torch"],
+        help="The profilers of --profile, torch is used only with a local HuggingFace model.",
+    )
+    parser.add_argument(
+        "--session-store",
+        type=str,
+        default=None,
+        help="The path of the SQLite file used to persist the chat sessions.",
+    )
+    parser.add_argument(
+        "--session-id",
+        type=str,
+        default="default",
+        help="The id of the chat session to restore and persist.",
+    )
+    parser.add_argument(
+        "--history-retention",
+        type=int,
+        default=64,
+        help="The number of chat messages and next best actions kept in memory.",
+    )
+    parser.add_argument(
+        "--history-archive",
+        type=str,
+        default=None,
+        help="The JSON lines file where the messages dropped from memory are archived.",
+    )
+    parser.add_argument(
+        "--session-ttl",
+        type=float,
+        default=24 * 3600,
+        help="The time to live of a persisted session in seconds.",
+    )
 
     # In case of evaluation
     parser.add_argument(
@@ -76,6 +231,81 @@ def get_args() -> Namespace:
         "--nlu_test_path", type=str, default="test/house_agency/nlu.json"
     )
     parser.add_argument("--dm_test_path", type=str, default="test/house_agency/dm.json")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The seed used to sample the evaluation test set.",
+    )
+    parser.add_argument(
+        "--eval-task",
+        type=str,
+        choices=["nlu", "dm", "dm_benchmark", "intent_classifier", "prompt_ab", "speculative"],
+        default="dm",
+        help="The component to evaluate, dm_benchmark compares the DM policies, intent_classifier trains and evaluates the local intent classifier, prompt_ab compares the static and dynamic prompts, speculative compares the greedy and the speculative decoding.",
+    )
+    parser.add_argument(
+        "--dm-cache",
+        type=int,
+        default=0,
+        help="Reuse the DM decisions of up to this many dialogue states (0 to disable), only with a greedy generation.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="The number of prompts generated together in the benchmarks.",
+    )
+    parser.add_argument(
+        "--experiment-store",
+        dest="experiment_store_path",
+        type=str,
+        default=None,
+        help="The JSON lines file recording the raw model outputs of the evaluations.",
+    )
+    parser.add_argument(
+        "--prompt-version",
+        type=str,
+        default="default",
+        help="The label of the prompts, recorded with the new generations.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Re-score using only the outputs in the experiment store, without a model.",
+    )
+    parser.add_argument(
+        "--plot",
+        action="store_true",
+        help="Save the intent confusion matrix as an image during evaluation.",
+    )
+    parser.add_argument(
+        "--verbose-eval",
+        action="store_true",
+        help="Print every failed sample during evaluation.",
+    )
+
+    # In case of load testing
+    parser.add_argument(
+        "--load-test",
+        action="store_true",
+        help="Replay synthetic multi-turn sessions against the pipeline.",
+    )
+    parser.add_argument(
+        "--sessions", type=int, default=20, help="The number of sessions to replay."
+    )
+    parser.add_argument(
+        "--arrival-rate",
+        type=float,
+        default=1.0,
+        help="The mean number of new sessions per second.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="The maximum number of sessions running at the same time.",
+    )
 
     parsed_args = parser.parse_args()
 
@@ -83,6 +313,18 @@ def get_args() -> Namespace:
         assert (
             parsed_args.nlu_test_path or parsed_args.dm_test_path
         ), "Please provide the test paths for evaluation."
+    assert (
+        not parsed_args.offline or parsed_args.experiment_store_path
+    ), "The offline mode requires an experiment store."
+    assert (
+        not parsed_args.serve or parsed_args.model_server
+    ), "The serve mode requires the --model-server address."
+
+    parsed_args.intent_classifier = None
+    if parsed_args.intent_classifier_path and os.path.exists(parsed_args.intent_classifier_path):
+        parsed_args.intent_classifier = IntentClassifier.load(
+            parsed_args.intent_classifier_path, parsed_args.intent_threshold
+        )
 
     parsed_args.chat_template = TEMPLATES[parsed_args.model_name]
     parsed_args.model_name = MODELS[parsed_args.model_name]
@@ -90,81 +332,240 @@ def get_args() -> Namespace:
         parsed_args.database_path
     ), "The database path does not exist."
 
+    assert (
+        not parsed_args.serve or parsed_args.model_name != MODELS["ollama"]
+    ), "The ollama models are already served by ollama."
+
     return parsed_args
 
 
-def start_chat(args):
+def get_model(args):
+    """Connect to the model server if it is running, otherwise load the model.
+    The served models have no local tokenizer, the prompt tokens are then estimated.
+    """
+    if args.model_server and args.model_name != "llama3.2:3b":
+        model = RemoteModel.connect(args.model_server, args.model_name)
+        if model is not None:
+            return model, None
     if args.model_name != "llama3.2:3b":
-        model, tokenizer = load_model(args)
-    else:
-        ollama.show(args.model_name)
-        model, tokenizer = None, None
+        return load_model(args)
+    ollama.show(args.model_name)
+    return None, None
+
+
+def start_chat(args):
+    model, tokenizer = get_model(args)
 
-    conversation = Conversation(history_size=3)
-    database = Database(args.database_path)
-    state_tracker = StateTracker(database)
+    archive = None
+    if args.history_archive:
+        archive = HistoryArchive(args.history_archive, session_id=args.session_id)
+    conversation = Conversation(
+        history_size=3, retention=args.history_retention, archive=archive
+    )
+    database = Database(args.database_path, gazetteer_path=args.gazetteer_path)
+    if args.changelog:
+        database.watch_changelog(args.changelog, args.changelog_interval)
+    state_tracker = StateTracker(
+        database, nba_retention=args.history_retention, archive=archive
+    )
+
+    session_store = None
+    if args.session_store:
+        session_store = SessionStore(args.session_store, ttl=args.session_ttl)
+        session = session_store.get(args.session_id)
+        if session:
+            conversation.load_payload(session["conversation"])
+            state_tracker.load_payload(session["state_tracker"])
+            print(f"System 🏘️: Session '{args.session_id}' restored.")
     print(f"System 🏘️: {conversation.get_message(-1)}")
 
-    nlu_component = NLU(model, tokenizer, args)
-    dm_component = DM(model, tokenizer, args)
+    slot_extractor = SlotExtractor.from_database(database) if args.slot_extractor else None
+    nlu_component = NLU(model, tokenizer, args, slot_extractor)
+    dm_component = DM(model, tokenizer, args, cache_size=args.dm_cache)
     nlg_component = NLG(model, tokenizer, args)
 
+    profiler = None
+    if args.profile:
+        profiler = TurnProfiler(
+            args.profile,
+            use_cprofile="cprofile" in args.profile_tools,
+            use_tracemalloc="tracemalloc" in args.profile_tools,
+            use_torch="torch" in args.profile_tools and tokenizer is not None,
+        )
+
+    @contextmanager
+    def stage(name):
+        with log_context(stage=name), (profiler.stage(name) if profiler else nullcontext()):
+            yield
+
+    set_log_context(session_id=args.session_id)
+    turn_id = 0
     while True:
         user_input = input("User 🧑🏻‍💻: ")
         if user_input == "reset":
             conversation.reset()
             state_tracker.reset()
+            if session_store:
+                session_store.delete(args.session_id)
             print("System 🏘️: Conversation reset.")
             continue
 
-        # get the NLU output
-        nlu_output = nlu_component(user_input, conversation.get_history())
+        turn_id += 1
+        set_log_context(turn_id=turn_id)
+        if profiler:
+            profiler.start_turn()
+        try:
+            # get the NLU output
+            with stage("nlu"):
+                nlu_output = nlu_component(user_input, conversation.get_history())
 
-        # update the conversation
-        conversation.update("user", user_input)
+            # update the conversation
+            conversation.update("user", user_input)
 
-        # update the state tracker
-        state_tracker.update(nlu_output)
-        current_state = state_tracker.get_state()
+            # update the state tracker
+            with stage("state_tracker"):
+                state_tracker.update(nlu_output)
+                current_state = state_tracker.get_state()
 
-        # get the DM output
-        dm_output = dm_component(current_state)
+            # get the DM output
+            with stage("dm"):
+                dm_output = dm_component(current_state)
 
-        # update the next best actions
-        state_tracker.update_nba(dm_output)
+            # update the next best actions
+            state_tracker.update_nba(dm_output)
 
-        # get the NLG output
-        nlg_output = nlg_component(state_tracker, conversation.get_history())
+            # get the NLG output
+            with stage("nlg"):
+                nlg_output = nlg_component(state_tracker, conversation.get_history())
+        finally:
+            # Also for a failed turn, so that the profiler of the turn is not left active
+            if profiler:
+                profiler.end_turn()
         print(f"System 🏘️: {nlg_output}")
         conversation.update("system", nlg_output)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Session memory: %s", session_memory_report(conversation, state_tracker)
+            )
+            logger.debug(
+                "Prompt tokens: %s",
+                {
+                    **nlu_component.prompt_builder.turn_report(),
+                    **dm_component.prompt_builder.turn_report(),
+                    **nlg_component.prompt_builder.turn_report(),
+                },
+            )
+
+        if session_store:
+            session_store.put(
+                args.session_id,
+                {
+                    "conversation": conversation.to_payload(),
+                    "state_tracker": state_tracker.to_payload(),
+                },
+            )
 
 
 def evaluate(args):
-    if args.model_name != "llama3.2:3b":
+    args.experiment_store = None
+    if args.experiment_store_path:
+        args.experiment_store = ExperimentStore(
+            args.experiment_store_path, args.prompt_version, offline=args.offline
+        )
+
+    if args.offline or args.eval_task == "intent_classifier":
+        model, tokenizer = None, None
+    elif args.eval_task == "speculative":
+        assert (
+            args.model_name != "llama3.2:3b" and (args.draft_model or args.prompt_lookup_tokens)
+        ), "The speculative benchmark requires a HuggingFace model and --draft-model or --prompt-lookup-tokens."
         model, tokenizer = load_model(args)
     else:
-        ollama.show(args.model_name)
-        model, tokenizer = None, None
+        model, tokenizer = get_model(args)
 
     if args.nlu_test_path:
         assert os.path.exists(args.nlu_test_path), "The NLU test path does not exist."
     if args.dm_test_path:
         assert os.path.exists(args.dm_test_path), "The DM test path does not exist."
 
-    evaluator = Evaluator(args.nlu_test_path, args.dm_test_path)
+    evaluator = Evaluator(
+        args.nlu_test_path,
+        args.dm_test_path,
+        plot=args.plot,
+        verbose=args.verbose_eval,
+        experiment_store=args.experiment_store,
+        seed=args.seed,
+    )
+
+    if args.eval_task == "intent_classifier":
+        # Evaluated on held-out templates, then trained on all of them to be used
+        held_out = evaluator.intent_template_split()
+        texts, labels = evaluator.intent_training_data(traffic_path=args.intent_traffic, held_out=held_out)
+        classifier = IntentClassifier(args.intent_threshold).fit(texts, labels)
+        evaluator.evaluate_intent_classifier(classifier, held_out=held_out)
+        texts, labels = evaluator.intent_training_data(traffic_path=args.intent_traffic)
+        classifier = IntentClassifier(args.intent_threshold).fit(texts, labels)
+        classifier.save(args.intent_classifier_path or "test/house_agency/intent_classifier.npz")
+    elif args.eval_task == "nlu":
+        conversation = Conversation(history_size=3)
+        slot_extractor = None
+        if args.slot_extractor:
+            slot_extractor = SlotExtractor.from_database(Database(args.database_path))
+        nlu_component = NLU(model, tokenizer, args, slot_extractor)
+        evaluator.evaluate_NLU(nlu_component, conversation)
+    elif args.eval_task == "prompt_ab":
+        variants = {}
+        for mode in ["static", "dynamic"]:
+            variant_args = Namespace(**{**vars(args), "prompt_mode": mode})
+            nlu_component = NLU(model, tokenizer, variant_args)
+            nlu_component.intent_classifier = None
+            variants[mode] = (nlu_component, DM(model, tokenizer, variant_args))
+        evaluator.ab_test_prompts(variants, Conversation(history_size=3))
+    elif args.eval_task == "speculative":
+        variants = {
+            "greedy": Namespace(
+                **{**vars(args), "draft_model": None, "prompt_lookup_tokens": 0, "experiment_store": None}
+            ),
+            "speculative": Namespace(**{**vars(args), "experiment_store": None}),
+        }
+        evaluator.benchmark_decoding(model, tokenizer, variants, DM(model, tokenizer, args))
+    elif args.eval_task == "dm_benchmark":
+        dm_component = DM(model, tokenizer, args)
+        evaluator.benchmark_DM(dm_component, batch_size=args.batch_size)
+    else:
+        dm_component = DM(model, tokenizer, args)
+        evaluator.evaluate_DM(dm_component, deterministic=False)
+
 
-    # conversation = Conversation(history_size=3)
-    # nlu_component = NLU(model, tokenizer, args)
-    # evaluator.evaluate_NLU(nlu_component, conversation)
+def load_test(args):
+    model, tokenizer = get_model(args)
 
-    dm_component = DM(model, tokenizer, args)
-    evaluator.evaluate_DM(dm_component, deterministic=False)
+    database = Database(args.database_path, gazetteer_path=args.gazetteer_path)
+    if args.changelog:
+        database.watch_changelog(args.changelog, args.changelog_interval)
+    with open(args.nlu_test_path) as f:
+        templates = json.load(f)
+    generator = SessionGenerator(database, templates, seed=args.seed)
+    slot_extractor = SlotExtractor.from_database(database) if args.slot_extractor else None
+    load_generator = LoadGenerator(
+        NLU(model, tokenizer, args, slot_extractor),
+        DM(model, tokenizer, args, cache_size=args.dm_cache),
+        NLG(model, tokenizer, args),
+        database,
+        concurrency=args.concurrency,
+    )
+    report = load_generator.run(generator, args.sessions, args.arrival_rate)
+    print_report(report)
 
 
 if __name__ == "__main__":
     args = get_args()
-    setup_logging(args.debug)
-    if args.eval:
+    setup_logging(args.debug, args.log_json)
+    if args.serve:
+        serve(args)
+    elif args.eval:
         evaluate(args)
+    elif args.load_test:
+        load_test(args)
     else:
         start_chat(args)
@@ -183,4 +183,32 @@ Output a valid JSON object only:
 
 Return only the JSON object. No text, no backticks.
 """
-}
\ No newline at end of file
+}
+
+CHUNKING_PROMPT = """You are the **NLU component** of a conversational agent specializing in **student accommodations in India**. A single user message may contain **more than one request**: your job is to split the **user’s latest message** into chunks, one per request, and map each chunk to **exactly one** of the predefined intents.
+
+Here is provided the chat history, use it to understand the context of the conversation.
+History:
+{}
+
+## 🎯 Intents
+
+- **house_search** — User is looking for available student housing or refining search criteria.
+- **house_selection** — User expresses interest in a **specific** house and wants to focus on that house.
+- **compare_houses** — User wants to compare **two or more houses** or specific features of a **group of houses**.
+- **ask_info** — User asks for some information about a specific house (floors, bathrooms, rent).
+- **out_of_domain** — Input is unrelated to student accommodations in India (e.g. any other LLM tasks).
+
+## Rules
+
+1. Keep the chunks in the order they appear in the message.
+2. Copy the text of each chunk from the message, do not rephrase it.
+3. A message with a single request is a single chunk.
+
+## 💡 Example
+
+- **User:** "I'd like to select the second house. How many bathrooms does it have?"
+- **Output:** [{{"chunk": "I'd like to select the second house.", "intent": "house_selection"}}, {{"chunk": "How many bathrooms does it have?", "intent": "ask_info"}}]
+
+Output only the JSON list, nothing else!
+"""
@@ -0,0 +1,62 @@
+# Bank of the rules and examples of the intent classification and DM prompts, the
+# dynamic prompts include only the ones relevant to the current request.
+
+INTENT_HEADER = """You are the **NLU component** of a conversational agent specializing in **student accommodations in India**. Your job is to analyze the **user’s latest request** (optionally using the chat history for context) and map it to **exactly one** of the predefined intents.
+
+## 🚦 Rules
+
+1. **Process Only the Last User Turn** — Ignore previous user messages except for context.
+2. **Single Intent** — Assign exactly one intent per turn.
+3. **Don’t Invent** — Use only the intents in the list below.
+4. **Short Output** — Return **only** the intent name (no explanations, no JSON wrappers).
+
+## 🎯 Intents
+
+- **house_search** — User is looking for available student housing or refining search criteria.
+- **house_selection** — User expresses interest in a **specific** house and wants to focus on that house.
+- **compare_houses** — User wants to compare **two or more houses** or specific features of a **group of houses**.
+- **ask_info** — User asks for some information about a specific house (floors, bathrooms, rent).
+- **out_of_domain** — Input is unrelated to student accommodations in India (e.g. any other LLM tasks)."""
+
+INTENT_EXAMPLES = [
+    {"intent": "house_search", "user": "Hi, I'd like to search for a house in Mumbai, in kandivali if available under 60000 as rent."},
+    {"intent": "house_search", "user": "I need a 2 BHK semi-furnished flat of at least 800 square feet."},
+    {"intent": "house_search", "user": "Actually, make it unfurnished and in Bangalore."},
+    {"intent": "house_selection", "user": "Show me more details for house one."},
+    {"intent": "house_selection", "user": "I like the third option, let's go with that one."},
+    {"intent": "compare_houses", "user": "Can you compare the floors of house A and house B?"},
+    {"intent": "compare_houses", "user": "Which one is cheaper between the second and the fourth house?"},
+    {"intent": "ask_info", "user": "What is the point of contact of the house?"},
+    {"intent": "ask_info", "user": "How many bathrooms does it have?"},
+    {"intent": "out_of_domain", "user": "What’s the temperature in Delhi today?"},
+    {"intent": "out_of_domain", "user": "Write me a poem about the sea."},
+]
+
+DM_HEADER = """*Role*: You are the Dialogue Manager of a conversational agent. Your task is to determine the next best action based on the current state of the system, represented by intent and slot values.
+
+## Instructions:
+- Strictly follow the predefined actions and arguments below.
+- Do not create new actions, slots, or intents.
+- You action must be referred ONLY to the intent or slots that are given as input.
+- Output only the action and argument as a string.
+- No explanations, no questions, no extra text."""
+
+# The intents each action applies to, None for all of them
+DM_ACTIONS = [
+    {"intents": None, "text": "request_slot(slot_name) → Request the value for an empty slot, which as None as its value."},
+    {"intents": ["HOUSE_SEARCH", "HOUSE_SELECTION", "COMPARE_HOUSES"], "text": "confirmation(intent_name) → Confirm the intent when all slots are filled with a not None value. A list is a valid value."},
+    {"intents": ["ASK_INFO"], "text": "provide_info(property_name) → Provide specific information about a value from 'properties' list. ONLY for the intent ASK_INFO."},
+]
+
+DM_EXAMPLES = [
+    {"intent": "HOUSE_SEARCH", "complete": True, "state": "{'intent': 'HOUSE_SEARCH', 'slots': {'house_size': '100', 'house_bhk': '2', 'house_rent': '10000', 'house_location': 'Bandra', 'house_city': 'Mumbai', 'house_furnished': 'unfurnished'}}", "action": "confirmation(HOUSE_SEARCH)"},
+    {"intent": "HOUSE_SEARCH", "complete": False, "state": "{'intent': 'HOUSE_SEARCH', 'slots': {'house_size': '100', 'house_bhk': '2', 'house_rent': '10000', 'house_location': 'Bandra', 'house_city': 'Mumbai', 'house_furnished': None}}", "action": "request_slot(house_furnished)"},
+    {"intent": "COMPARE_HOUSES", "complete": True, "state": "{'intent': 'COMPARE_HOUSES', 'slots': {'houses': [0,1], 'properties': [\"position\", \"contact info\"]}}", "action": "confirmation(COMPARE_HOUSES)"},
+    {"intent": "COMPARE_HOUSES", "complete": False, "state": "{'intent': 'COMPARE_HOUSES', 'slots': {'houses': None, 'properties': ['rent']}}", "action": "request_slot(houses)"},
+    {"intent": "HOUSE_SELECTION", "complete": False, "state": "{'intent': 'HOUSE_SELECTION', 'slots': {'house_selected': None}}", "action": "request_slot(house_selected)"},
+    {"intent": "ASK_INFO", "complete": True, "state": "{'intent': 'ASK_INFO', 'slots': {\"properties\": [\"contacts\", \"address\"]}}", "action": "provide_info(contacts)"},
+    {"intent": "ASK_INFO", "complete": False, "state": "{'intent': 'ASK_INFO', 'slots': {'properties': None}}", "action": "request_slot(properties)"},
+]
+
+DM_FOOTER = """## Output Format:
+action(argument)"""
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+# The modules are imported from the root of the repository, as in pipeline.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data.houses import House  # noqa: E402
+
+
+def make_house(row_id=0, **fields) -> House:
+    record = {
+        "row_id": row_id,
+        "posted_on": "2022-05-09",
+        "bhk": 2,
+        "rent": 15000,
+        "size": 800,
+        "floor": "1 out of 3",
+        "area_type": "Carpet Area",
+        "area_locality": "Hebbal",
+        "city": "Bangalore",
+        "furnishing_status": "Unfurnished",
+        "tenant_preferred": "Bachelors",
+        "bathroom": 1,
+        "point_of_contact": "Contact Owner",
+    }
+    record.update(fields)
+    return House.from_record(record)
+
+
+@pytest.fixture
+def houses():
+    return [
+        make_house(0, area_locality="Sai Heights, Hebbal", rent=12000),
+        make_house(1, area_locality="J.P. Nagar Phase 1", bhk=3, size=1200),
+        make_house(2, area_locality="Dwarka", city="Delhi", furnishing_status="Furnished"),
+        make_house(3, area_locality="Hebbal", rent=30000),
+    ]
@@ -0,0 +1,78 @@
+import json
+import time
+
+import pytest
+
+from data.database import Database
+from tests.conftest import make_house
+
+
+def write_lines(path, *lines, mode="a"):
+    with open(path, mode) as f:
+        f.writelines(lines)
+
+
+def upsert(row_id, **fields):
+    house = make_house(row_id, **fields).to_dict()
+    return json.dumps({"op": "upsert", "row_id": row_id, "house": house}, default=str) + "\n"
+
+
+def test_ingest_applies_only_complete_lines(tmp_path):
+    path = tmp_path / "changes.jsonl"
+    write_lines(path, upsert(0), upsert(1)[:20], mode="w")
+    database = Database(None)
+    offset = database.ingest_changelog(str(path))
+    assert [house.row_id for house in database.database] == [0]
+    assert offset == len(upsert(0))
+
+    write_lines(path, upsert(1)[20:])
+    assert database.ingest_changelog(str(path), offset) == path.stat().st_size
+    assert len(database.database) == 2
+
+
+def test_ingest_skips_only_the_invalid_lines(tmp_path):
+    path = tmp_path / "changes.jsonl"
+    write_lines(
+        path,
+        upsert(0),
+        "{not json\n",
+        json.dumps({"op": "delete", "row_id": 42}) + "\n",  # Missing house
+        "[1, 2]\n",
+        upsert(1, rent=20000),
+        mode="w",
+    )
+    database = Database(None)
+    assert database.ingest_changelog(str(path)) == path.stat().st_size
+    assert sorted(database.snapshot.houses) == [0, 1]
+    assert database.get_house(1).rent == 20000
+    assert database.snapshot.version == 1  # A single snapshot for the whole batch
+
+
+def test_invalid_batch_is_rejected_atomically(houses):
+    database = Database(None)
+    with pytest.raises(ValueError):
+        database.apply_changes(
+            [{"op": "upsert", "row_id": 0, "house": houses[0].to_dict()}, {"op": "delete", "row_id": 7}]
+        )
+    assert database.snapshot.version == 0
+    assert database.database == ()
+
+
+def test_watcher_survives_the_removal_of_the_log(tmp_path):
+    path = tmp_path / "changes.jsonl"
+    write_lines(path, upsert(0), mode="w")
+    database = Database(None)
+    database.watch_changelog(str(path), interval=0.01)
+    deadline = time.time() + 2
+    while len(database.database) < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(database.database) == 1
+
+    path.unlink()
+    time.sleep(0.05)
+    write_lines(path, upsert(1), mode="w")  # Replaced by a new log
+    deadline = time.time() + 2
+    while len(database.database) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert database.watcher.is_alive()
+    assert sorted(database.snapshot.houses) == [0, 1]
@@ -0,0 +1,89 @@
+import threading
+
+from argparse import Namespace
+
+import pytest
+
+pytest.importorskip("torch")
+
+from components import dm as dm_module  # noqa: E402
+from components.dm import DM  # noqa: E402
+
+
+def make_dm(cache_size=256):
+    return DM(None, None, Namespace(domain="house_agency", chat_template="{} {}"), cache_size=cache_size)
+
+
+def state(n):
+    return {"intent": "HOUSE_SEARCH", "slots": {"house_rent": n}}
+
+
+def test_cache_hit_skips_the_generation(monkeypatch):
+    calls = []
+    monkeypatch.setattr(dm_module, "generate", lambda model, text, tokenizer, args: calls.append(text) or "x\n")
+    dm = make_dm()
+    assert dm(state(1)) == "x"
+    assert dm(state(1)) == "x"
+    assert len(calls) == 1
+
+
+def test_cache_is_bounded_under_concurrent_use():
+    dm = make_dm(cache_size=8)
+    errors = []
+
+    def worker(offset):
+        try:
+            for n in range(500):
+                dm.cache_output(("state", offset, n % 16), "x")
+                dm.cached_output(("state", offset, (n + 1) % 16))
+        except Exception as e:  # e.g. the OrderedDict mutated during move_to_end
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(dm.cache) == 8
+
+
+def test_batch_usage_covers_only_its_own_states(monkeypatch):
+    usage = [{"prompt_tokens": 10, "completion_tokens": 5}]
+    monkeypatch.setattr(dm_module, "generate_batch", lambda model, texts, tokenizer, args: ["confirmation(HOUSE_SEARCH)"])
+    monkeypatch.setattr(dm_module, "last_batch_usage", lambda: usage)
+    dm = make_dm()
+    outputs, batch_usage = dm.batch([state(1)], use_cache=False, return_usage=True)
+    assert batch_usage == usage
+
+    # Answered by the rules, the usage of the previous batch is not reported again
+    rule_state = {"intent": "SHOW_HOUSES", "slots": {"house_rent": 1}}
+    outputs, batch_usage = dm.batch([rule_state], use_cache=False, return_usage=True)
+    assert outputs == ["show_houses(HOUSE_SEARCH)"]
+    assert batch_usage == [{"prompt_tokens": 0, "completion_tokens": 0}]
+
+
+def test_parse_action():
+    dm = make_dm()
+    assert dm.parse_action("request_slot(house_bhk)\n") == "request_slot"
+    assert dm.parse_action("fallback_policy('No houses found.')") == "fallback_policy"
+    assert dm.parse_action("I would ask: request_slot(house_bhk)") is None
+    assert dm.parse_action("request_slot(house_bhk)\nconfirmation(HOUSE_SEARCH)") is None
+
+
+def test_cache_is_opt_in(monkeypatch):
+    calls = []
+    monkeypatch.setattr(dm_module, "generate", lambda model, text, tokenizer, args: calls.append(text) or "x")
+    dm = DM(None, None, Namespace(domain="house_agency", chat_template="{} {}"))
+    dm(state(1))
+    dm(state(1))
+    assert len(calls) == 2
+    assert len(dm.cache) == 0
+
+
+def test_signatures_are_the_frozen_states():
+    from components.dialogue_state import state_signature
+
+    signature = state_signature({"intent": "ASK_INFO", "slots": {"properties": ["rent", "size"]}})
+    assert signature == ("ASK_INFO", (("properties", ("rent", "size")),))
+    assert signature != state_signature({"intent": "ASK_INFO", "slots": {"properties": ["size", "rent"]}})
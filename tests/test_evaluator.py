@@ -0,0 +1,8 @@
+from evaluator import Evaluator
+
+
+def test_intent_classifier_without_held_out_samples(monkeypatch, capsys):
+    evaluator = Evaluator()
+    monkeypatch.setattr(evaluator, "create_test_set", lambda: {"nlu_data": [], "dm_data": []})
+    assert evaluator.evaluate_intent_classifier(object(), results_path=None, held_out=set()) == {"samples": 0}
+    assert "no held-out sample" in capsys.readouterr().out
@@ -0,0 +1,37 @@
+from utils.experiment_store import ExperimentStore
+
+
+def test_generation_settings_are_part_of_the_key(tmp_path):
+    store = ExperimentStore(str(tmp_path / "store.jsonl"))
+    store.put("model", "prompt", 64, '{"intent": "HOUSE_SEARCH"}', json_root="{")
+    assert store.get("model", "prompt", 64, json_root="{") == '{"intent": "HOUSE_SEARCH"}'
+    assert store.get("model", "prompt", 64) is None
+    assert store.get("model", "prompt", 128, json_root="{") is None
+    assert store.get("other", "prompt", 64, json_root="{") is None
+    assert (store.hits, store.misses) == (1, 3)
+
+
+def test_index_is_reloaded(tmp_path):
+    path = str(tmp_path / "store.jsonl")
+    store = ExperimentStore(path, prompt_version="v1")
+    store.put("model", "prompt", 64, "first")
+    store.put("model", "prompt", 64, "second")
+    assert ExperimentStore(path, offline=True).get("model", "prompt", 64) == "second"
+
+
+def test_partial_and_invalid_records(tmp_path):
+    path = tmp_path / "store.jsonl"
+    store = ExperimentStore(str(path))
+    store.put("model", "first", 64, "one")
+    with open(path, "ab") as f:
+        f.write(b"not json\n")
+    store.put("model", "second", 64, "two")
+    with open(path, "ab") as f:
+        f.write(b'{"key": "abc", "outp')  # Interrupted write
+
+    store = ExperimentStore(str(path))
+    assert store.get("model", "first", 64) == "one"
+    assert store.get("model", "second", 64) == "two"
+    assert path.read_bytes().endswith(b"\n")
+    store.put("model", "third", 64, "three")
+    assert ExperimentStore(str(path)).get("model", "third", 64) == "three"
@@ -0,0 +1,43 @@
+from argparse import Namespace
+
+import pytest
+
+pytest.importorskip("torch")
+
+from utils import utils  # noqa: E402
+from utils.json_parser import JSONStreamExtractor  # noqa: E402
+
+ARGS = Namespace(model_name="llama3.2:3b", max_new_tokens=64)
+
+
+class Stream:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_ollama_stream_stopped_at_the_end_of_the_json(monkeypatch):
+    stream = Stream([{"response": '{"a": '}, {"response": "1} and"}, {"response": " more", "done": True}])
+    monkeypatch.setattr(utils.ollama, "generate", lambda *args, **kwargs: stream, raising=False)
+    extractor = JSONStreamExtractor()
+    assert utils._generate(None, "prompt", None, ARGS, extractor) == '{"a": 1} and'
+    assert extractor.result() == {"a": 1}
+    assert stream.closed
+    assert utils.last_usage() == {"prompt_tokens": None, "completion_tokens": 2}
+
+
+def test_ollama_empty_stream(monkeypatch):
+    stream = Stream([])
+    monkeypatch.setattr(utils.ollama, "generate", lambda *args, **kwargs: stream, raising=False)
+    assert utils._generate(None, "prompt", None, ARGS, JSONStreamExtractor()) == ""
+    assert stream.closed
+    assert utils.last_usage() == {"prompt_tokens": None, "completion_tokens": 0}
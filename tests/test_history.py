@@ -0,0 +1,58 @@
+import json
+
+from utils.history import BoundedHistory, HistoryArchive, deep_sizeof
+
+
+def archived(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["item"] for line in f]
+
+
+def test_evicted_entries_are_archived(tmp_path):
+    archive = HistoryArchive(str(tmp_path / "archive.jsonl"), session_id="s1")
+    history = BoundedHistory(maxlen=2, archive=archive, kind="chat")
+    history.extend(["a", "b", "c"])
+    history += ["d"]
+    archive.close()
+    assert list(history) == ["c", "d"]
+    assert archived(archive.path) == ["a", "b"]
+
+
+def test_initial_entries_beyond_the_bound_are_archived(tmp_path):
+    archive = HistoryArchive(str(tmp_path / "archive.jsonl"))
+    history = BoundedHistory(["a", "b", "c"], 2, archive, kind="nba")
+    archive.close()
+    assert list(history) == ["b", "c"]
+    assert archived(archive.path) == ["a"]
+
+
+def test_unbounded_history_keeps_everything():
+    history = BoundedHistory(range(5))
+    assert list(history) == [0, 1, 2, 3, 4]
+
+
+def test_deep_sizeof_counts_shared_objects_once():
+    shared = "x" * 1000
+    assert deep_sizeof([shared, shared]) < 2 * deep_sizeof(shared)
+
+
+def test_restored_history_is_not_archived_again(tmp_path):
+    from utils.conversation import Conversation
+
+    archive = HistoryArchive(str(tmp_path / "archive.jsonl"))
+    conversation = Conversation(history_size=2, retention=2, archive=archive)
+    for i in range(3):
+        conversation.update("user", f"message {i}")
+    archive.close()
+    archived_before = archived(archive.path)
+
+    restored = Conversation(history_size=2, retention=2, archive=archive)
+    restored.load_payload(conversation.to_payload())
+    archive.close()
+    assert list(restored.chat_history) == list(conversation.chat_history)
+    assert archived(archive.path) == archived_before
+
+
+def test_restored_keeps_the_last_entries():
+    history = BoundedHistory.restored(["a", "b", "c"], maxlen=2)
+    assert list(history) == ["b", "c"]
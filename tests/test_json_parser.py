@@ -0,0 +1,35 @@
+import pytest
+
+from utils.json_parser import JSONStreamExtractor, extract_json, loads, repair_json
+
+
+def test_extractor_stops_at_the_end_of_the_value():
+    extractor = JSONStreamExtractor()
+    chunks = ['Sure! {"intent": ', '"HOUSE_SEARCH", "slots": {"house_city": "pu}ne"}', "} and more text"]
+    assert [extractor.feed(chunk) for chunk in chunks] == [False, False, True]
+    assert extractor.result() == {"intent": "HOUSE_SEARCH", "slots": {"house_city": "pu}ne"}}
+
+
+def test_extractor_closes_a_truncated_value():
+    extractor = JSONStreamExtractor()
+    extractor.feed('{"intent": "ASK_INFO", "slots": {"properties": ["rent"')
+    assert not extractor.done
+    assert extractor.result() == {"intent": "ASK_INFO", "slots": {"properties": ["rent"]}}
+
+
+def test_extractor_roots():
+    assert extract_json('[{"chunk": "a"}]', root="[") == [{"chunk": "a"}]
+    assert extract_json('[1] {"a": 1}', root="{") == {"a": 1}
+    assert extract_json("no json here") is None
+    with pytest.raises(ValueError):
+        JSONStreamExtractor().result()
+
+
+def test_repair_python_style_values():
+    assert loads("{'name': 'O\\'Brien', 'ok': True, 'rent': None, 'bhk': [2, 3,],}") == {
+        "name": "O'Brien",
+        "ok": True,
+        "rent": None,
+        "bhk": [2, 3],
+    }
+    assert repair_json('{"a": undefined}') == '{"a": null}'
@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("torch")
+
+from data.database import Database  # noqa: E402
+from load_generator import LoadGenerator  # noqa: E402
+
+
+def nlu(user_input, history):
+    if "fail" in user_input:
+        raise RuntimeError("model server down")
+    return []  # Handled as a fallback by the state tracker
+
+
+def test_failed_turns_are_counted_and_the_session_goes_on():
+    generator = LoadGenerator(
+        nlu, lambda state: "fallback_policy('retry')", lambda tracker, history: "Sorry", Database(None)
+    )
+    generator.run_session(["hello", "fail", "hi", "fail again"])
+    generator.run_session(["hello"])
+    assert len(generator.latencies) == 5
+    assert generator.errors == 2
+    assert generator.failed_sessions == 1
+    assert generator.fallbacks == 3
@@ -0,0 +1,54 @@
+import json
+import logging
+
+import pytest
+
+from utils.logger import _stop_listener, get_logger, log_context, set_log_context, setup_logging
+
+
+@pytest.fixture
+def json_log(tmp_path):
+    path = tmp_path / "log.jsonl"
+    root = logging.getLogger()
+    handlers, level = root.handlers, root.level
+    setup_logging(json_path=str(path))
+    yield path
+    _stop_listener()
+    root.handlers, root.level = handlers, level
+
+
+def read_entries(path):
+    _stop_listener()  # Writes the queued records
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_records_carry_the_context(json_log):
+    logger = get_logger("test")
+    set_log_context(session_id="s1", turn_id=2)
+    with log_context(stage="dm"):
+        logger.info("Chosen %s", "action")
+    logger.info("After the stage")
+    set_log_context(session_id=None, turn_id=None)
+
+    first, second = read_entries(json_log)
+    assert first["message"] == "Chosen action"
+    assert (first["session_id"], first["turn_id"], first["stage"]) == ("s1", 2, "dm")
+    assert second["stage"] is None
+
+
+def test_arguments_are_merged_when_logged(json_log):
+    slots = {"house_bhk": 2}
+    get_logger("test").info("Slots %s", slots)
+    slots["house_bhk"] = 3
+    assert read_entries(json_log)[0]["message"] == "Slots {'house_bhk': 2}"
+
+
+def test_exception_is_kept(json_log):
+    try:
+        raise ValueError("invalid state")
+    except ValueError:
+        get_logger("test").exception("DM failed")
+    (entry,) = read_entries(json_log)
+    assert entry["message"] == "DM failed"
+    assert "ValueError: invalid state" in entry["exception"]
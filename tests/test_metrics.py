@@ -0,0 +1,13 @@
+import numpy as np
+
+from utils.metrics import fuzzy_scores
+
+
+def test_fuzzy_scores_are_rounded_like_fuzzywuzzy():
+    scores = fuzzy_scores(["Hebbal", "J.P. Nagar", "Dwarka"], ["hebal", "jp nagar", "dwarka"])
+    assert scores.dtype == np.float64
+    assert scores.tolist() == [91.0, 89.0, 100.0]
+
+
+def test_fuzzy_scores_of_no_pairs():
+    assert fuzzy_scores([], []).shape == (0,)
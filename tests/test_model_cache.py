@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+
+from utils.utils import save_to_cache  # noqa: E402
+
+
+class FakePretrained:
+    def __init__(self, name):
+        self.name = name
+
+    def save_pretrained(self, path, **kwargs):
+        with open(os.path.join(path, f"{self.name}.json"), "w") as f:
+            f.write("{}")
+
+
+def cached_files(cache):
+    return sorted(os.listdir(cache))
+
+
+def test_save_replaces_an_incomplete_copy(tmp_path):
+    cache, cached_path = str(tmp_path), str(tmp_path / "model-bf16")
+    os.makedirs(cached_path)
+    open(os.path.join(cached_path, "model-00001.safetensors"), "w").close()  # Interrupted conversion
+    save_to_cache(FakePretrained("config"), FakePretrained("tokenizer"), cache, cached_path)
+    assert cached_files(cached_path) == ["config.json", "tokenizer.json"]
+    assert cached_files(cache) == ["model-bf16"]  # No temporary directory left
+
+
+def test_concurrent_winner_is_kept(tmp_path):
+    cache, cached_path = str(tmp_path), str(tmp_path / "model-bf16")
+    os.makedirs(cached_path)
+    with open(os.path.join(cached_path, "config.json"), "w") as f:
+        f.write('{"winner": true}')
+    open(os.path.join(cached_path, "tokenizer.json"), "w").close()
+    save_to_cache(FakePretrained("config"), FakePretrained("tokenizer"), cache, cached_path)
+    with open(os.path.join(cached_path, "config.json")) as f:
+        assert f.read() == '{"winner": true}'
+    assert cached_files(cache) == ["model-bf16"]
@@ -0,0 +1,42 @@
+import os
+import socket
+import stat
+
+import pytest
+
+from utils.model_server import DEFAULT_AUTHKEY, KEY_VARIABLE, get_authkey, listen, parse_address, remove_stale_socket
+
+
+def test_parse_address():
+    assert parse_address("localhost:6000") == ("localhost", 6000)
+    assert parse_address("/tmp/flatfinder.sock") == "/tmp/flatfinder.sock"
+
+
+def test_tcp_requires_a_key(monkeypatch):
+    monkeypatch.delenv(KEY_VARIABLE, raising=False)
+    assert get_authkey("/tmp/flatfinder.sock") == DEFAULT_AUTHKEY
+    with pytest.raises(ValueError):
+        get_authkey(("localhost", 6000))
+    monkeypatch.setenv(KEY_VARIABLE, "secret")
+    assert get_authkey(("localhost", 6000)) == b"secret"
+
+
+def test_regular_files_are_not_removed(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("keep me")
+    with pytest.raises(ValueError):
+        remove_stale_socket(str(path))
+    assert path.read_text() == "keep me"
+
+
+def test_socket_is_private_and_replaced(tmp_path):
+    path = str(tmp_path / "server.sock")
+    with listen(path, DEFAULT_AUTHKEY):
+        assert stat.S_ISSOCK(os.stat(path).st_mode)
+        assert stat.S_IMODE(os.stat(path).st_mode) & 0o077 == 0
+
+    # Socket file left behind by a killed server
+    with socket.socket(socket.AF_UNIX) as stale:
+        stale.bind(path)
+    remove_stale_socket(path)
+    assert not os.path.exists(path)
@@ -0,0 +1,17 @@
+from components.nlg_context import SUMMARY_FIELDS, property_fields
+
+
+def test_a_property_can_ask_for_several_fields():
+    assert property_fields(["size and bhk"]) == ["bhk", "size"]
+    assert property_fields(["bedrooms and bathrooms", "rent"]) == ["bhk", "rent", "bathroom"]
+
+
+def test_specific_keywords_are_not_matched_again():
+    assert property_fields(["bathroom"]) == ["bathroom"]
+    assert property_fields(["super area"]) == ["area_type"]
+    assert property_fields(["area"]) == ["area_locality"]
+
+
+def test_unknown_properties_give_the_summary():
+    assert property_fields(["view"]) == SUMMARY_FIELDS
+    assert property_fields(None) == SUMMARY_FIELDS
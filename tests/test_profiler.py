@@ -0,0 +1,39 @@
+import json
+import os
+
+import pytest
+
+from utils import profiler as profiler_module
+from utils.profiler import TurnProfiler, add_time, profiling, section
+
+
+def test_sections_are_noops_when_not_profiling():
+    assert not profiling()
+    with section("tokenize"):
+        pass
+    add_time("decode", 1.0)
+
+
+def test_turn_summary(tmp_path):
+    profiler = TurnProfiler(str(tmp_path), use_cprofile=True, use_tracemalloc=False)
+    profiler.start_turn()
+    try:
+        with profiler.stage("dm"):
+            with section("tokenize"):
+                pass
+            add_time("decode", 0.5)
+        with pytest.raises(RuntimeError):
+            with profiler.stage("nlg"):
+                raise RuntimeError("failed generation")
+    finally:
+        summary = profiler.end_turn()
+
+    assert not profiling()
+    assert set(summary["stages_s"]) == {"dm", "nlg"}
+    assert summary["sections_s"]["decode"] == 0.5
+    assert "tokenize" in summary["sections_s"]
+    turn_dir = os.path.join(str(tmp_path), "turn_001")
+    assert os.path.exists(os.path.join(turn_dir, "dm.pstats"))
+    with open(os.path.join(turn_dir, "summary.json")) as f:
+        assert json.load(f)["turn"] == 1
+    assert profiler_module._active is None
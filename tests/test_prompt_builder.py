@@ -0,0 +1,34 @@
+import logging
+
+from components.prompt_builder import PromptBuilder
+
+
+class CountingTokenizer:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return type("Encoding", (), {"input_ids": text.split()})()
+
+
+def test_prompts_not_tokenized_on_the_request_path(caplog):
+    caplog.set_level(logging.INFO)
+    tokenizer = CountingTokenizer()
+    builder = PromptBuilder("house_agency", tokenizer)
+    assert builder.record("dm", "a b c") is None
+    assert tokenizer.calls == 0
+    assert builder.report() == {}
+
+
+def test_counted_prompts_keep_running_totals():
+    builder = PromptBuilder("house_agency", CountingTokenizer(), count=True)
+    builder.record("dm", "a b c")
+    builder.record("dm", "a")
+    builder.record("intent", "a b")
+    assert builder.report() == {
+        "dm": {"prompts": 2, "mean_tokens": 2.0},
+        "intent": {"prompts": 1, "mean_tokens": 2.0},
+    }
+    assert builder.turn_report() == {"dm": 4, "intent": 2}
+    assert builder.turn_report() == {}
@@ -0,0 +1,61 @@
+import pytest
+
+from data.database import Database
+from data.search import SearchScan, normalize_slots, parse_numbers
+
+SLOTS = {"house_location": "Hebbal", "house_city": "Bangalore", "house_furnished": "unfurnished"}
+
+
+@pytest.fixture
+def database(houses):
+    database = Database(None)
+    database.apply_changes([{"op": "upsert", "row_id": h.row_id, "house": h.to_dict()} for h in houses])
+    return database
+
+
+def test_parse_numbers():
+    assert parse_numbers(None) == []
+    assert parse_numbers(3) == [3]
+    assert parse_numbers("10000 to 20000") == [10000, 20000]
+    assert parse_numbers("800") == [800]
+
+
+def test_normalize_slots():
+    query = normalize_slots({**SLOTS, "house_bhk": "2", "house_rent": "10000 20000"})
+    assert (query.bhk_min, query.size_min, query.rent_max) == (2, 0, 20000)
+    assert (query.location, query.city, query.furnished) == ("hebbal", "bangalore", "unfurnished")
+    with pytest.raises(AttributeError):
+        normalize_slots({"house_bhk": "2"})
+
+
+def test_scan_is_lazy(houses):
+    scan = SearchScan(normalize_slots(SLOTS), houses)
+    scan.fill(1)
+    assert [house.row_id for house in scan.matches] == [0]
+    assert scan.position == 1
+    scan.fill(5)
+    assert [house.row_id for house in scan.matches] == [0, 3]
+    assert scan.done
+
+
+def test_cursors_share_the_cached_scan(database):
+    first = database.search({**SLOTS, "house_rent": "20000"})
+    second = database.search({**SLOTS, "house_rent": "20000"})
+    assert first.scan is second.scan
+    assert [house.row_id for house in first.next_page(1)] == [0]
+    assert first.exhausted
+    assert [house.row_id for house in second.next_page()] == [0]
+
+
+def test_updates_invalidate_the_cached_scans(database):
+    cursor = database.search(SLOTS)
+    assert len(cursor.next_page()) == 2
+    database.update_house(3, {"rent": 9000, "area_locality": "hebbal kempapura"})
+    database.delete_house(0)
+    assert [house.row_id for house in database.search(SLOTS).next_page()] == [3]
+
+
+def test_invalid_slots_give_an_empty_cursor(database):
+    cursor = database.search({"house_bhk": "two"})
+    assert cursor.exhausted
+    assert cursor.next_page() == []
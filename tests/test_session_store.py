@@ -0,0 +1,49 @@
+import time
+
+from utils.session_store import SessionStore, decode, encode
+
+
+def test_encode_roundtrip():
+    payload = {"conversation": ["ciao", "namaste ✓"], "state": {"house_bhk": 2}}
+    assert decode(encode(payload)) == payload
+
+
+def test_memory_only():
+    store = SessionStore(capacity=2)
+    store.put("a", {"turn": 1})
+    store.put("b", {"turn": 2})
+    store.put("c", {"turn": 3})
+    assert store.get("a") is None  # Evicted from the LRU
+    assert store.get("c") == {"turn": 3}
+    store.delete("c")
+    assert store.get("c") is None
+
+
+def test_workers_see_each_other_updates(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first, second = SessionStore(path), SessionStore(path)
+    first.put("s", {"turn": 1})
+    assert second.get("s") == {"turn": 1}
+
+    second.put("s", {"turn": 2})
+    assert first.get("s") == {"turn": 2}  # The cached turn 1 is stale
+
+    first.delete("s")
+    assert second.get("s") is None
+
+
+def test_restored_after_restart(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SessionStore(path)
+    store.put("s", {"turn": 1})
+    store.close()
+    assert SessionStore(path).get("s") == {"turn": 1}
+
+
+def test_expired(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"), ttl=0.01)
+    store.put("s", {"turn": 1})
+    time.sleep(0.02)
+    assert store.get("s") is None
+    store.evict_expired()
+    assert store.connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 0
@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+
+def run_concurrently(single_flight, key, function, n):
+    results = [None] * n
+
+    def call(i):
+        try:
+            results[i] = single_flight.do(key, function)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_calls_share_the_result():
+    single_flight = SingleFlight()
+    release, calls = threading.Event(), []
+
+    def generate():
+        calls.append(1)
+        release.wait(5)
+        return "output"
+
+    threads, results = run_concurrently(single_flight, "prompt", generate, 4)
+    while single_flight.stats()["saved"] < 3:  # The followers are waiting for the leader
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert {output for output, _ in results} == {"output"}
+    assert single_flight.stats() == {"executed": 1, "saved": 3}
+
+
+def test_errors_are_raised_to_all_the_callers():
+    single_flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError("model server down")
+
+    threads, results = run_concurrently(single_flight, "prompt", fail, 3)
+    while single_flight.stats()["saved"] < 2:
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_nothing_is_kept_after_the_call():
+    single_flight = SingleFlight()
+    assert single_flight.do("prompt", lambda: 1) == (1, False)
+    assert single_flight.do("prompt", lambda: 2) == (2, False)
+    with pytest.raises(ValueError):
+        single_flight.do("prompt", lambda: int("x"))
+    assert single_flight.calls == {}
+    single_flight.count_saved(2)
+    assert single_flight.stats() == {"executed": 3, "saved": 2}
@@ -0,0 +1,47 @@
+from components.slot_extractor import SlotExtractor, parse_amount
+from data.houses import CATEGORIES
+from data.search import normalize_slots
+
+
+def make_extractor(houses):
+    return SlotExtractor(CATEGORIES["city"].values, {house.area_locality for house in houses})
+
+
+def test_numbers_and_categories(houses):
+    slots = make_extractor(houses).extract(
+        "I need a 2 BHK semi-furnished flat of at least 800 sq ft in Delhi, budget 25k"
+    )
+    assert slots == {
+        "house_bhk": 2,
+        "house_size": 800,
+        "house_rent": 25000,
+        "house_furnished": "semi-furnished",
+        "house_city": "delhi",
+    }
+
+
+def test_amounts():
+    assert parse_amount("25,000", None) == 25000
+    assert parse_amount("1.5", "lakh") == 150000
+    assert parse_amount("12", "k") == 12000
+
+
+def test_city_alias(houses):
+    assert make_extractor(houses).extract("a flat in Bengaluru")["house_city"] == "bangalore"
+
+
+def test_punctuated_locality_matches_the_database(houses):
+    extractor = make_extractor(houses)
+    slots = extractor.extract("2 bhk in Sai Heights Hebbal, Bangalore")
+    assert slots["house_location"] == "sai heights, hebbal"
+
+    slots = extractor.extract("Something near J.P. Nagar Phase 1 please")
+    assert slots["house_location"] == "j.p. nagar phase 1"
+
+    query = normalize_slots({**slots, "house_city": "bangalore", "house_furnished": "unfurnished"})
+    match = query.matcher()
+    assert [house.area_locality for house in houses if match(house)] == ["j.p. nagar phase 1"]
+
+
+def test_no_locality_in_generic_words(houses):
+    assert "house_location" not in make_extractor(houses).extract("show me a house in the city")
@@ -1,6 +1,19 @@
+from itertools import islice
+
+from utils.history import BoundedHistory
+
+
 class Conversation:
-    def __init__(self, history_size=3):
+    def __init__(self, history_size=3, retention=64, archive=None):
+        """
+        Args:
+            history_size (int): The number of messages returned by `get_history`.
+            retention (int): The number of messages kept in memory, None for no limit.
+            archive (HistoryArchive): Where the messages dropped from memory are saved.
+        """
         self.history_size = history_size
+        self.retention = max(retention, history_size) if retention else None
+        self.archive = archive
         self.reset()
 
     def update(self, role: str, text):
@@ -16,10 +29,8 @@ class Conversation:
     
     def get_history(self):
         formatted_chat = ""
-        tmp_chat = self.chat_history.copy()
-
-        max_length = min(self.history_size, len(self.chat_history))
-        tmp_chat = tmp_chat[-self.history_size:] if -self.history_size >= -max_length else tmp_chat[:max_length]
+        start = max(0, len(self.chat_history) - self.history_size)
+        tmp_chat = islice(self.chat_history, start, None)
 
         for message in tmp_chat:
             formatted_chat += f"{message['role']}: {message['text']}\n"
@@ -36,8 +47,13 @@ class Conversation:
         else:
             return self.chat_history[idx]["text"]
     
+    def _new_history(self, messages, restore=False):
+        if restore:
+            return BoundedHistory.restored(messages, self.retention, self.archive, kind="chat")
+        return BoundedHistory(messages, self.retention, self.archive, kind="chat")
+
     def reset(self, _for=None):
-        self.chat_history = [{"role": "system", "text": "Hello! I am a conversational agent specialized on student's accomodation searching in India. How can I help you today?"}]
+        self.chat_history = self._new_history([{"role": "system", "text": "Hello! I am a conversational agent specialized on student's accomodation searching in India. How can I help you today?"}])
 
         if _for == "HOUSE_SELECTION" or _for == "COMPARE_HOUSES":
             self.chat_history.append({"role": "system", "text": "I've noted down your search criteria. You're looking for a 2 BHK house in Kandivali, Mumbai, with a minimum size of 500 sq ft, unfurnished, and a rent of under 60,000. Is this correct?"})
@@ -46,4 +62,14 @@ class Conversation:
         elif _for == "ASK_INFO":
             self.chat_history.append({"role": "system", "text": "Found 5 matching houses:\n\n1. Deep Heights, Nalasopara: 2 BHK , 790 sqft, ₹6.5k/month\n2. New Panvel: 2 BHK, 890 sqft, ₹8k/month\n3. Nakoda Heights, Nalasopara: 2 BHK, 550 sqft, ₹8k/month\n4. New Panvel: 2 BHK, 890 sqft, ₹8k/month\n5. Nakoda Heights, Nalasopara: 2 BHK, 550 sqft, ₹8k/month\n\nWhich one would you like to know more about?"})
             self.chat_history.append({"role": "user", "text": "I want to select the second house"})
-            self.chat_history.append({"role": "system", "text": "Which properties would you like to know more about?"})
\ No newline at end of file
+            self.chat_history.append({"role": "system", "text": "Which properties would you like to know more about?"})
+
+    def to_payload(self) -> dict:
+        """Serializable representation of the conversation."""
+        return {"history": [[m["role"], m["text"]] for m in self.chat_history]}
+
+    def load_payload(self, payload: dict):
+        """Restore the conversation from a payload created by `to_payload`."""
+        self.chat_history = self._new_history(
+            ({"role": role, "text": text} for role, text in payload["history"]), restore=True
+        )
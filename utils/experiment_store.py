@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from typing import Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def generation_key(model_name: str, text: str, max_new_tokens: int, json_root: Optional[str] = None) -> str:
+    """Key of a generation: the model, the full prompt sent to it and the settings that
+    change the output, i.e. the maximum number of new tokens and the JSON root at which
+    the generation is stopped.
+    """
+    content = f"{model_name}\0{text}\0{max_new_tokens}\0{json_root or ''}"
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+class ExperimentStore:
+    """Append-only JSON lines store of the raw model outputs.
+
+    Every generation is recorded with its key (model, full prompt and generation
+    settings, see `generation_key`), the prompt version
+    and the id of the evaluated sample. The file is indexed by key at load time, so that
+    a later run only calls the model for the prompts that changed, and in offline mode
+    the post-processing and the metrics can be re-computed without any model.
+
+    Attributes:
+        path (str): The path of the store file
+        prompt_version (str): The label recorded with the new generations
+        offline (bool): If True, missing generations are not computed
+        sample_id (str): The id of the sample being evaluated, set by the evaluator
+        hits (int): The number of generations found in the store
+        misses (int): The number of generations not found in the store
+    """
+
+    def __init__(self, path: str, prompt_version="default", offline=False):
+        self.path = path
+        self.prompt_version = prompt_version
+        self.offline = offline
+        self.sample_id: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.index = {}
+        self.lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self):
+        """Index the records by key.
+
+        An invalid record is skipped. A partial last line, left by an interrupted write,
+        is truncated, so that the next record is not appended to it.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            offset = 0
+            for line in f:
+                try:
+                    self.index[json.loads(line)["key"]] = offset
+                except (ValueError, KeyError, TypeError) as e:
+                    if not line.endswith(b"\n"):
+                        logger.warning("Truncating the partial last record of %s at offset %d.", self.path, offset)
+                        f.truncate(offset)
+                        break
+                    logger.warning("Skipping the invalid record at offset %d of %s: %s", offset, self.path, e)
+                offset += len(line)
+        logger.info("Experiment store loaded with %d generations.", len(self.index))
+
+    def _read(self, offset: int) -> dict:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def get(self, model_name: str, text: str, max_new_tokens: int, json_root: Optional[str] = None) -> Optional[str]:
+        """Get the recorded output of a generation, None if it was never recorded."""
+        key = generation_key(model_name, text, max_new_tokens, json_root)
+        with self.lock:
+            offset = self.index.get(key)
+            if offset is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._read(offset)["output"]
+
+    def put(self, model_name: str, text: str, max_new_tokens: int, output: str, json_root: Optional[str] = None):
+        """Record the output of a generation."""
+        key = generation_key(model_name, text, max_new_tokens, json_root)
+        record = {
+            "key": key,
+            "model": model_name,
+            "max_new_tokens": max_new_tokens,
+            "json_root": json_root,
+            "prompt_version": self.prompt_version,
+            "sample_id": self.sample_id,
+            "ts": time.time(),
+            "output": output,
+        }
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self.lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(line)
+            self.index[key] = offset
+
+    def stats(self) -> str:
+        return f"{self.hits} generations reused, {self.misses} not in the store"
@@ -0,0 +1,125 @@
+import json
+import sys
+import threading
+import time
+
+from collections import deque
+from typing import Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class HistoryArchive:
+    """Append-only JSON lines archive for the entries evicted from the histories.
+
+    Attributes:
+        path (str): The path of the archive file
+        session_id (str): The session the archived entries belong to
+    """
+
+    def __init__(self, path: str, session_id: Optional[str] = None):
+        self.path = path
+        self.session_id = session_id
+        self.lock = threading.Lock()
+        self.file = None
+
+    def write(self, kind: str, item):
+        record = {"ts": time.time(), "session": self.session_id, "kind": kind, "item": item}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class BoundedHistory(deque):
+    """Ring buffer keeping the last `maxlen` entries of a history.
+
+    When the buffer is full the oldest entry is dropped, after being written to the
+    archive if one is given. This also holds for the initial entries: the ones beyond
+    `maxlen` are archived.
+
+    Attributes:
+        archive (HistoryArchive): The archive for the evicted entries, if any
+        kind (str): The kind of history, recorded in the archive
+    """
+
+    def __init__(self, iterable=(), maxlen=None, archive=None, kind="history"):
+        super().__init__((), maxlen)
+        self.archive: Optional[HistoryArchive] = archive
+        self.kind = kind
+        self.extend(iterable)
+
+    @classmethod
+    def restored(cls, items, maxlen=None, archive=None, kind="history") -> "BoundedHistory":
+        """Restore a saved history as it was, without archiving its entries again.
+
+        Only the last `maxlen` entries are kept if the saved history is longer.
+        """
+        history = cls(maxlen=maxlen, archive=archive, kind=kind)
+        deque.extend(history, items)
+        return history
+
+    def append(self, item):
+        if self.maxlen is not None and len(self) == self.maxlen:
+            if self.archive is not None:
+                self.archive.write(self.kind, self[0])
+        super().append(item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+
+def deep_sizeof(obj, seen=None) -> int:
+    """Approximate the memory used by an object and the objects it references."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(
+            deep_sizeof(getattr(obj, name), seen)
+            for name in obj.__slots__
+            if hasattr(obj, name)
+        )
+    return size
+
+
+def session_memory_report(conversation, state_tracker) -> dict:
+    """Report the memory (in bytes) used by the per-session objects.
+
+    The houses are shared with the database, so only the references to them are
+    counted.
+    """
+    report = {
+        "chat_history": deep_sizeof(conversation.chat_history),
+        "next_best_actions": deep_sizeof(state_tracker.next_best_actions),
+        "state": deep_sizeof(state_tracker.state),
+        "house_references": sys.getsizeof(state_tracker.current_houses)
+        + sys.getsizeof(state_tracker.houses_to_compare),
+    }
+    report["total"] = sum(report.values())
+    return report
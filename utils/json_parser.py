@@ -0,0 +1,164 @@
+import json
+import re
+
+from typing import Any, Optional
+
+# Python/JS style literals that LLMs often emit instead of JSON ones
+LITERALS = {
+    "None": "null",
+    "True": "true",
+    "False": "false",
+    "null": "null",
+    "true": "true",
+    "false": "false",
+    "undefined": "null",
+    "NaN": "null",
+}
+OPENING = {"{": "}", "[": "]"}
+
+
+class JSONStreamExtractor:
+    """Incremental extractor for the first top-level JSON value in a text stream.
+
+    The extractor is fed with the generated text chunk by chunk (e.g. token by token)
+    and keeps track of the bracket depth, so that the generation can be stopped as soon
+    as the top-level object (or array) is closed. Single quoted strings are tracked as
+    well, since LLMs often produce python-like dictionaries.
+
+    Attributes:
+        root (str): The characters that can open the top-level value ('{', '[' or both)
+        buffer (str): The text of the JSON value collected so far
+        done (bool): True once the top-level value has been closed
+    """
+
+    def __init__(self, root="{"):
+        self.root = root
+        self.buffer = ""
+        self.done = False
+        self._stack = []
+        self._quote = None
+        self._escape = False
+
+    def feed(self, text: str) -> bool:
+        """Feed a new chunk of text to the extractor.
+
+        Args:
+            text (str): The new chunk of generated text
+
+        Returns:
+            done (bool): True if the top-level JSON value has been closed
+        """
+        if self.done:
+            return True
+
+        for i, char in enumerate(text):
+            if not self._stack:
+                if char in self.root:
+                    self._stack.append(OPENING[char])
+                    self.buffer = char
+                continue
+
+            self.buffer += char
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == self._quote:
+                    self._quote = None
+            elif char in "\"'":
+                self._quote = char
+            elif char in OPENING:
+                self._stack.append(OPENING[char])
+            elif char == self._stack[-1]:
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+                    return True
+
+        return False
+
+    def result(self) -> Any:
+        """Parse the collected JSON value, repairing it if needed.
+
+        Raises:
+            ValueError: If no JSON value has been found in the stream
+        """
+        if not self.buffer:
+            raise ValueError("No JSON value found in the generated text.")
+        text = self.buffer
+        if not self.done:  # Truncated generation, close the pending brackets
+            text += (self._quote or "") + "".join(reversed(self._stack))
+        return loads(text)
+
+
+def repair_json(text: str) -> str:
+    """Fix the most common errors in LLM generated JSON.
+
+    - single quoted strings are converted to double quoted strings
+    - python literals (None, True, False) are converted to JSON literals
+    - trailing commas before a closing bracket are removed
+    """
+    output = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char in "\"'":
+            # Copy the whole string, re-quoting it with double quotes
+            j = i + 1
+            value = []
+            while j < len(text) and text[j] != char:
+                if text[j] == "\\" and j + 1 < len(text):
+                    value.append(text[j : j + 2])
+                    j += 2
+                    continue
+                if text[j] == '"':
+                    value.append('\\"')
+                else:
+                    value.append(text[j])
+                j += 1
+            output.append('"' + "".join(value).replace("\\'", "'") + '"')
+            i = j + 1
+        elif char.isalpha() and not (output and output[-1][-1].isalnum()):
+            match = re.match(r"[A-Za-z_]\w*", text[i:])
+            word = match.group(0)
+            output.append(LITERALS.get(word, json.dumps(word)))
+            i += len(word)
+        elif char == ",":
+            rest = text[i + 1 :].lstrip()
+            if not rest or rest[0] in "}]":
+                i += 1
+                continue
+            output.append(char)
+            i += 1
+        else:
+            output.append(char)
+            i += 1
+
+    return "".join(output)
+
+
+def loads(text: str) -> Any:
+    """Parse a JSON string, falling back to a repaired version of it on errors."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(repair_json(text))
+
+
+def extract_json(text: str, root="{") -> Optional[Any]:
+    """Extract and parse the first top-level JSON value found in the given text.
+
+    Args:
+        text (str): The generated text, possibly containing extra text around the JSON
+        root (str): The characters that can open the top-level value
+
+    Returns:
+        The parsed value, or None if the text does not contain a parsable JSON value
+    """
+    extractor = JSONStreamExtractor(root=root)
+    extractor.feed(text)
+    try:
+        return extractor.result()
+    except ValueError:
+        return None
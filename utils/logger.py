@@ -1,6 +1,15 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
+import queue
 import sys
 
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
 # ANSI escape codes for colors
 LOG_COLORS = {
     "DEBUG": "\033[36m",  # Cyan
@@ -11,6 +20,26 @@ LOG_COLORS = {
 }
 RESET_COLOR = "\033[0m"
 
+# Context of the records: the chat session, the turn and the pipeline stage
+LOG_CONTEXT = {
+    "session_id": contextvars.ContextVar("session_id", default=None),
+    "turn_id": contextvars.ContextVar("turn_id", default=None),
+    "stage": contextvars.ContextVar("stage", default=None),
+}
+
+_listener = None
+
+
+def _stop_listener():
+    """Write the queued records and stop the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(_stop_listener)
+
 
 class ColoredFormatter(logging.Formatter):
     def format(self, record):
@@ -19,8 +48,85 @@ class ColoredFormatter(logging.Formatter):
         return f"{color}{message}{RESET_COLOR}"
 
 
-def setup_logging(debug: bool = False):
-    """Set up logging with file and function name in the format, with colored output."""
+class JSONFormatter(logging.Formatter):
+    """Format the records as JSON lines, with their session, turn and stage."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "function": record.funcName,
+            "message": record.getMessage(),
+        }
+        for name in LOG_CONTEXT:
+            entry[name] = getattr(record, name, None)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text  # Formatted by LocalQueueHandler
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the log context of the calling thread to the record, before it is queued."""
+
+    def filter(self, record):
+        for name, variable in LOG_CONTEXT.items():
+            setattr(record, name, variable.get())
+        return True
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queue the records for the listener thread of the same process.
+
+    The base handler formats the whole record in the calling thread, traceback
+    included, and drops the exception. Here only the message is merged with its
+    arguments (they may change before the listener writes the record), and the
+    traceback is kept as `exc_text`, so that each formatter of the listener lays it
+    out as usual (e.g. the "exception" field of the JSON lines).
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)  # The other handlers of the logger see the original record
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # The traceback is formatted now, keeping it would keep its frames alive
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def set_log_context(**fields):
+    """Set the session_id, turn_id or stage of the following records of the current context."""
+    for name, value in fields.items():
+        LOG_CONTEXT[name].set(value)
+
+
+@contextmanager
+def log_context(**fields):
+    """Set the session_id, turn_id or stage of the records logged inside the block."""
+    tokens = [(LOG_CONTEXT[name], LOG_CONTEXT[name].set(value)) for name, value in fields.items()]
+    try:
+        yield
+    finally:
+        for variable, token in reversed(tokens):
+            variable.reset(token)
+
+
+def setup_logging(debug: bool = False, json_path: str = None):
+    """Set up logging with file and function name in the format, with colored output.
+
+    The records are put in a queue and written by a background thread, so that the
+    logging calls do not wait for the I/O. With `json_path`, the records are also
+    appended to that file as JSON lines with their session, turn and stage.
+    """
+    global _listener
+    _stop_listener()
+
     level = logging.DEBUG if debug else logging.INFO
     handler = logging.StreamHandler(sys.stdout)
     formatter = ColoredFormatter(
@@ -28,10 +134,22 @@ def setup_logging(debug: bool = False):
         datefmt="%Y-%m-%d %H:%M:%S",
     )
     handler.setFormatter(formatter)
+    handlers = [handler]
+    if json_path:
+        json_handler = logging.FileHandler(json_path, encoding="utf-8")
+        json_handler.setFormatter(JSONFormatter())
+        handlers.append(json_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    _listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _listener.start()
+
     root_logger = logging.getLogger()
     root_logger.setLevel(level)
     root_logger.handlers = []  # Remove any existing handlers
-    root_logger.addHandler(handler)
+    root_logger.addHandler(queue_handler)
     # Suppress noisy library logs
     logging.getLogger("httpx").setLevel(logging.WARNING)
     logging.getLogger("httpcore").setLevel(logging.WARNING)
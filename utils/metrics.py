@@ -0,0 +1,125 @@
+import numpy as np
+
+from typing import Dict, List, Sequence, Tuple
+
+
+def encode_labels(
+    y_true: Sequence[str], y_pred: Sequence[str]
+) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Map the string labels to integer codes.
+
+    Returns:
+        labels (list): The sorted labels, the code of a label is its position
+        true_codes (np.ndarray): The codes of the ground truth labels
+        pred_codes (np.ndarray): The codes of the predicted labels
+    """
+    labels = sorted(set(y_true) | set(y_pred))
+    codes = {label: i for i, label in enumerate(labels)}
+    true_codes = np.fromiter((codes[y] for y in y_true), dtype=np.int64, count=len(y_true))
+    pred_codes = np.fromiter((codes[y] for y in y_pred), dtype=np.int64, count=len(y_pred))
+    return labels, true_codes, pred_codes
+
+
+def confusion_matrix(true_codes: np.ndarray, pred_codes: np.ndarray, n_labels: int):
+    """Confusion matrix with the true labels on the rows and the predicted on the columns."""
+    flat = np.bincount(true_codes * n_labels + pred_codes, minlength=n_labels**2)
+    return flat.reshape(n_labels, n_labels)
+
+
+def per_class_scores(cm: np.ndarray) -> Dict[str, np.ndarray]:
+    """Precision, recall, F1 and support of each class, 0 when undefined."""
+    tp = np.diag(cm).astype(np.float64)
+    predicted = cm.sum(axis=0)
+    support = cm.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        f1 = np.where(
+            precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0
+        )
+    return {"precision": precision, "recall": recall, "f1": f1, "support": support}
+
+
+def compute_metrics(y_true: Sequence[str], y_pred: Sequence[str]) -> dict:
+    """Compute accuracy, macro averaged and per-class scores for the given labels.
+
+    The macro averages are computed over all the labels found either in the ground truth
+    or in the predictions, as done by scikit-learn.
+    """
+    labels, true_codes, pred_codes = encode_labels(y_true, y_pred)
+    cm = confusion_matrix(true_codes, pred_codes, len(labels))
+    scores = per_class_scores(cm)
+    total = cm.sum()
+    return {
+        "labels": labels,
+        "confusion_matrix": cm,
+        "per_class": scores,
+        "accuracy": float(np.trace(cm) / total) if total else 0.0,
+        "precision": float(scores["precision"].mean()) if labels else 0.0,
+        "recall": float(scores["recall"].mean()) if labels else 0.0,
+        "f1": float(scores["f1"].mean()) if labels else 0.0,
+    }
+
+
+def classification_report(metrics: dict) -> str:
+    """Format the per-class scores as a text table."""
+    width = max([len(label) for label in metrics["labels"]] + [12])
+    lines = [f"{'':>{width}} precision    recall  f1-score   support", ""]
+    scores = metrics["per_class"]
+    for i, label in enumerate(metrics["labels"]):
+        lines.append(
+            f"{label:>{width}} {scores['precision'][i]:9.2f} {scores['recall'][i]:9.2f}"
+            f" {scores['f1'][i]:9.2f} {scores['support'][i]:9d}"
+        )
+    total = int(scores["support"].sum())
+    lines.append("")
+    lines.append(
+        f"{'macro avg':>{width}} {metrics['precision']:9.2f} {metrics['recall']:9.2f}"
+        f" {metrics['f1']:9.2f} {total:9d}"
+    )
+    return "\n".join(lines)
+
+
+def fuzzy_scores(y_true: Sequence[str], y_pred: Sequence[str]) -> np.ndarray:
+    """Pairwise fuzzy similarity (0-100) between the lower-cased true and predicted values.
+
+    Uses the batched C implementation of rapidfuzz when available, falling back to
+    fuzzywuzzy otherwise. The rapidfuzz ratios are rounded to integers as the
+    fuzzywuzzy ones, so that the thresholds select the same pairs with both.
+    """
+    true_values = [t.lower() for t in y_true]
+    pred_values = [p.lower() for p in y_pred]
+    try:
+        from rapidfuzz import fuzz, process
+
+        return np.rint(process.cpdist(true_values, pred_values, scorer=fuzz.ratio, dtype=np.float64))
+    except ImportError:
+        from fuzzywuzzy import fuzz
+
+        return np.fromiter(
+            (fuzz.ratio(t, p) for t, p in zip(true_values, pred_values)),
+            dtype=np.float64,
+            count=len(true_values),
+        )
+
+
+def plot_confusion_matrix(cm: np.ndarray, labels: List[str], path: str, show=False):
+    """Save the confusion matrix as an image, showing it only if requested."""
+    import matplotlib
+
+    if not show:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.figure(figsize=(12, 10))
+    sns.heatmap(cm, annot=True, fmt='d', xticklabels=labels, yticklabels=labels, cmap='Blues', cbar=False)
+    plt.xlabel("Predicted", fontsize=12)
+    plt.xticks(rotation=15, ha='right', fontsize=10)
+    plt.ylabel("True", fontsize=12)
+    plt.yticks(fontsize=10)
+    plt.title("Confusion Matrix", fontsize=14)
+    plt.savefig(path, bbox_inches='tight')
+    if show:
+        plt.show()
+    plt.close()
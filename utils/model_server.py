@@ -0,0 +1,227 @@
+import os
+import stat
+import threading
+import time
+
+from argparse import Namespace
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import List, Optional, Tuple
+
+from utils.logger import get_logger
+from utils.single_flight import SingleFlight
+
+logger = get_logger(__name__)
+
+# Shared secret of the connections. The default key is public, so it is only accepted on
+# unix sockets, which are protected by the file permissions.
+KEY_VARIABLE = "FLATFINDER_MODEL_SERVER_KEY"
+DEFAULT_AUTHKEY = b"flatfinder"
+
+WARMUP_PROMPT = "Hello"
+
+
+def parse_address(address: str):
+    """A "host:port" address is a TCP socket, anything else the path of a unix socket."""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return (host, int(port))
+    return address
+
+
+def get_authkey(address) -> bytes:
+    """The key of the connections to the parsed address.
+
+    Raises:
+        ValueError: If the address is a TCP socket and no key is set in the environment
+    """
+    key = os.environ.get(KEY_VARIABLE)
+    if key:
+        return key.encode()
+    if isinstance(address, tuple):
+        raise ValueError(
+            f"A TCP model server address requires a secret key in {KEY_VARIABLE}, "
+            "the requests are unpickled by the server."
+        )
+    return DEFAULT_AUTHKEY
+
+
+def remove_stale_socket(address):
+    """Remove the unix socket left at the address by a previous server.
+
+    Raises:
+        ValueError: If the path exists and is not a socket
+    """
+    if isinstance(address, str) and os.path.exists(address):
+        if not stat.S_ISSOCK(os.stat(address).st_mode):
+            raise ValueError(f"{address} exists and is not a socket, refusing to replace it.")
+        os.remove(address)
+
+
+def listen(address, authkey: bytes) -> Listener:
+    """Bind the listener, a unix socket is created accessible only to the current user."""
+    umask = os.umask(0o077)  # Set before the bind, so that the socket is never open to others
+    try:
+        return Listener(address, authkey=authkey)
+    finally:
+        os.umask(umask)
+
+
+class RemoteModel:
+    """Client of a model served by `serve`, used in place of the HuggingFace model.
+
+    Every thread keeps its own connection to the server, the generations of the
+    different connections are serialized by the server.
+
+    Attributes:
+        address: The address of the server
+        model_name (str): The name of the served model
+    """
+
+    def __init__(self, address: str):
+        self.address = parse_address(address)
+        self.model_name = None
+        self._local = threading.local()
+
+    @staticmethod
+    def connect(address: str, model_name: str) -> Optional["RemoteModel"]:
+        """Connect to the server at the address, None if it is not running or serves another model."""
+        model = RemoteModel(address)
+        try:
+            model.model_name = model.request({"op": "info"})["model_name"]
+        except (OSError, EOFError, AuthenticationError, ValueError) as e:
+            logger.info("Model server not available at %s (%s), loading the model locally.", address, e)
+            return None
+        if model.model_name != model_name:
+            logger.warning(
+                "The model server at %s serves %s instead of %s, loading the model locally.",
+                address,
+                model.model_name,
+                model_name,
+            )
+            return None
+        logger.info("Connected to the model server at %s (%s).", address, model_name)
+        return model
+
+    def _connection(self):
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = Client(self.address, authkey=get_authkey(self.address))
+        return self._local.connection
+
+    def request(self, message: dict) -> dict:
+        """Send a request to the server, reconnecting once if the connection was closed."""
+        for attempt in range(2):
+            try:
+                connection = self._connection()
+                connection.send(message)
+                response = connection.recv()
+                break
+            except (OSError, EOFError):
+                self._local.connection = None
+                if attempt:
+                    raise
+        if "error" in response:
+            raise RuntimeError(f"Model server error: {response['error']}")
+        return response
+
+    def generate(self, text: str, max_new_tokens: int, json_root=None) -> Tuple[str, dict]:
+        """The generated text with its token counts.
+
+        Args:
+            json_root (str): If given, the server stops the generation as soon as the
+                top-level JSON value opened by one of these characters is closed.
+        """
+        response = self.request(
+            {"op": "generate", "text": text, "max_new_tokens": max_new_tokens, "json_root": json_root}
+        )
+        return response["output"], response["usage"]
+
+    def generate_batch(self, texts: List[str], max_new_tokens: int) -> Tuple[List[str], List[dict]]:
+        response = self.request(
+            {"op": "generate_batch", "texts": texts, "max_new_tokens": max_new_tokens}
+        )
+        return response["outputs"], response["usage"]
+
+
+def serve(args: Namespace):
+    """Load the model once and serve its generations until interrupted.
+
+    The requests are dictionaries with an `op`:
+    - "info": the name of the served model
+    - "generate": the generation of `text`, optionally stopped at the end of the JSON value
+    - "generate_batch": the generations of `texts` in a single batch
+
+    The speculative decoding of `--draft-model` or `--prompt-lookup-tokens` is only
+    applied to "generate", the batched generations decode without it.
+    """
+    from utils.json_parser import JSONStreamExtractor
+    from utils.utils import _generate, last_batch_usage, last_usage, load_model, model_generate_batch
+
+    # Checked before loading the model
+    address = parse_address(args.model_server)
+    authkey = get_authkey(address)
+    remove_stale_socket(address)
+
+    start = time.perf_counter()
+    model, tokenizer = load_model(args)
+    _generate(model, WARMUP_PROMPT, tokenizer, Namespace(**{**vars(args), "max_new_tokens": 1}))
+    logger.info("Model %s loaded and warmed up in %.1fs.", args.model_name, time.perf_counter() - start)
+    if args.draft_model or args.prompt_lookup_tokens:
+        logger.info("Speculative decoding enabled for the single generations, not for the batches.")
+
+    model_lock = threading.Lock()
+    # The identical requests of different clients running at the same time are generated once
+    single_flight = SingleFlight()
+
+    def handle(message: dict) -> dict:
+        if message["op"] == "info":
+            return {"model_name": args.model_name}
+        request_args = Namespace(**{**vars(args), "max_new_tokens": message["max_new_tokens"]})
+        if message["op"] == "generate":
+
+            def run():
+                extractor = None
+                if message.get("json_root"):
+                    extractor = JSONStreamExtractor(root=message["json_root"])
+                with model_lock:
+                    output = _generate(model, message["text"], tokenizer, request_args, extractor)
+                return output, last_usage()
+
+            key = (message["text"], message["max_new_tokens"], message.get("json_root"))
+            (output, usage), shared = single_flight.do(key, run)
+            if shared:
+                usage = {"prompt_tokens": 0, "completion_tokens": 0}
+            return {"output": output, "usage": usage}
+        if message["op"] == "generate_batch":
+            with model_lock:
+                outputs = model_generate_batch(model, message["texts"], tokenizer, request_args)
+                return {"outputs": outputs, "usage": last_batch_usage()}
+        return {"error": f"unknown operation {message['op']!r}"}
+
+    def serve_connection(connection):
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = handle(message)
+                except Exception as e:
+                    logger.exception("Request %s failed", message.get("op"))
+                    response = {"error": repr(e)}
+                connection.send(response)
+
+    with listen(address, authkey) as listener:
+        print(f"Serving {args.model_name} at {args.model_server}, press Ctrl+C to stop.")
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    logger.warning("Connection refused: %s", e)
+                    continue
+                threading.Thread(target=serve_connection, args=(connection,), daemon=True).start()
+        except KeyboardInterrupt:
+            stats = single_flight.stats()
+            print(f"Model server stopped, {stats['executed']} generations, {stats['saved']} shared.")
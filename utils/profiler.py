@@ -0,0 +1,145 @@
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager, nullcontext
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# The profiler of the running turn, the sections of the code are timed only when set
+_active = None
+
+
+def profiling() -> bool:
+    return _active is not None
+
+
+def section(name: str):
+    """Time a section of a stage (e.g. tokenization, prefill, decode), a no-op when not profiling."""
+    if _active is None:
+        return nullcontext()
+    return _active.section(name)
+
+
+def add_time(name: str, seconds: float):
+    """Add the time of a section measured elsewhere (e.g. by the ollama server)."""
+    if _active is not None:
+        _active.sections[name] += seconds
+
+
+class TurnProfiler:
+    """Profile the stages of the chat turns (NLU, state tracker, DM, NLG).
+
+    For every turn the artifacts are written to `<output_dir>/turn_<n>/`:
+    - `<stage>.pstats`: the cProfile statistics of the stage
+    - `<stage>_memory.txt`: the allocations of the stage, from two tracemalloc snapshots
+    - `<stage>_trace.json`: the chrome trace of the stage from `torch.profiler`, with the
+      sections (tokenization, prefill, decode, ...) as labelled ranges
+    - `summary.json`: the time of the stages and of their sections
+
+    Attributes:
+        output_dir (str): The directory of the artifacts
+        use_cprofile (bool): If True, run cProfile on every stage
+        use_tracemalloc (bool): If True, diff the memory allocations of every stage
+        use_torch (bool): If True, record a torch.profiler trace of every stage
+        turn (int): The number of the current turn
+    """
+
+    def __init__(self, output_dir: str, use_cprofile=True, use_tracemalloc=True, use_torch=False):
+        self.output_dir = output_dir
+        self.use_cprofile = use_cprofile
+        self.use_tracemalloc = use_tracemalloc
+        self.use_torch = use_torch
+        self.turn = 0
+        self.turn_dir = None
+        self.stages = {}
+        self.sections = defaultdict(float)
+        os.makedirs(output_dir, exist_ok=True)
+
+    def start_turn(self):
+        global _active
+        self.turn += 1
+        self.turn_dir = os.path.join(self.output_dir, f"turn_{self.turn:03d}")
+        os.makedirs(self.turn_dir, exist_ok=True)
+        self.stages = {}
+        self.sections = defaultdict(float)
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _active = self
+
+    def end_turn(self) -> dict:
+        """Write the summary of the turn and return it."""
+        global _active
+        _active = None
+        summary = {"turn": self.turn, "stages_s": self.stages, "sections_s": dict(self.sections)}
+        with open(os.path.join(self.turn_dir, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=4)
+        print(
+            "Profile: "
+            + ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in self.stages.items())
+            + f" ({self.turn_dir})"
+        )
+        return summary
+
+    @contextmanager
+    def stage(self, name: str):
+        """Profile a stage of the turn."""
+        if self.turn_dir is None:
+            yield
+            return
+
+        profiler = cProfile.Profile() if self.use_cprofile else None
+        before = tracemalloc.take_snapshot() if self.use_tracemalloc else None
+        with ExitStack() as stack:
+            if self.use_torch:
+                import torch
+
+                from torch.profiler import ProfilerActivity, profile
+
+                activities = [ProfilerActivity.CPU]
+                if torch.cuda.is_available():
+                    activities.append(ProfilerActivity.CUDA)
+                trace = stack.enter_context(profile(activities=activities, profile_memory=True))
+            start = time.perf_counter()
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+        if self.use_torch:
+            trace.export_chrome_trace(os.path.join(self.turn_dir, f"{name}_trace.json"))
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(self.turn_dir, f"{name}.pstats"))
+        if before is not None:
+            # The allocations of the profilers themselves are not reported
+            filters = [tracemalloc.Filter(False, cProfile.__file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+            diff = tracemalloc.take_snapshot().filter_traces(filters).compare_to(
+                before.filter_traces(filters), "lineno"
+            )
+            current, peak = tracemalloc.get_traced_memory()
+            with open(os.path.join(self.turn_dir, f"{name}_memory.txt"), "w") as f:
+                f.write(f"Traced memory: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n")
+                f.writelines(f"{stat}\n" for stat in diff[:25])
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def section(self, name: str):
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            if self.use_torch:
+                from torch.profiler import record_function
+
+                stack.enter_context(record_function(name))
+            try:
+                yield
+            finally:
+                self.sections[name] += time.perf_counter() - start
@@ -0,0 +1,151 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+from typing import Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def encode(payload: dict) -> bytes:
+    """Encode a session payload as compressed compact JSON."""
+    data = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+    return zlib.compress(data.encode("utf-8"))
+
+
+def decode(blob: bytes) -> dict:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class SessionStore:
+    """Two-level store for the dialogue sessions.
+
+    Sessions are kept in an in-process LRU cache and written through to a SQLite
+    database, so that any worker sharing the database file can restore a session
+    started by another worker. Every write increments the version of the session: a
+    cached session is only used if its version is still the one in the database, so a
+    session updated by another worker is read again. Sessions not updated for `ttl`
+    seconds are evicted.
+
+    Attributes:
+        path (str): The path of the SQLite database, None to keep sessions in memory only
+        capacity (int): The maximum number of sessions kept in memory
+        ttl (float): The time to live of a session in seconds
+    """
+
+    def __init__(self, path: Optional[str] = None, capacity=128, ttl=24 * 3600):
+        self.path = path
+        self.capacity = capacity
+        self.ttl = ttl
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = None
+
+        if path:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL, "
+                "version INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(sessions)")]
+            if "version" not in columns:  # Database created before the versions
+                self.connection.execute(
+                    "ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+                )
+            self.connection.commit()
+            self.evict_expired()
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """Get the payload of a session, None if it does not exist or is expired."""
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(session_id)
+            if self.connection is None:
+                if cached is None or cached[1] <= now:
+                    self.cache.pop(session_id, None)
+                    return None
+                self.cache.move_to_end(session_id)
+                return decode(cached[2])
+
+            # Only the version is read if the cached session is still the latest one
+            row = self.connection.execute(
+                "SELECT version, expires FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                self.cache.pop(session_id, None)
+                return None
+            version, expires = row
+            if cached is not None and cached[0] == version:
+                self._cache_put(session_id, version, expires, cached[2])
+                return decode(cached[2])
+
+            row = self.connection.execute(
+                "SELECT data FROM sessions WHERE id = ? AND version = ?", (session_id, version)
+            ).fetchone()
+            if row is None:  # Updated or deleted in the meantime
+                self.cache.pop(session_id, None)
+                return None
+            self._cache_put(session_id, version, expires, row[0])
+            return decode(row[0])
+
+    def put(self, session_id: str, payload: dict):
+        """Save the payload of a session, refreshing its time to live."""
+        blob = encode(payload)
+        expires = time.time() + self.ttl
+        with self.lock:
+            version = 0
+            if self.connection is not None:
+                # The update and the read of the new version are in the same transaction
+                updated = self.connection.execute(
+                    "UPDATE sessions SET data = ?, expires = ?, version = version + 1 WHERE id = ?",
+                    (blob, expires, session_id),
+                ).rowcount
+                if not updated:
+                    self.connection.execute(
+                        "INSERT INTO sessions (id, data, expires, version) VALUES (?, ?, ?, 1)",
+                        (session_id, blob, expires),
+                    )
+                version = self.connection.execute(
+                    "SELECT version FROM sessions WHERE id = ?", (session_id,)
+                ).fetchone()[0]
+                self.connection.commit()
+            self._cache_put(session_id, version, expires, blob)
+        logger.debug("Session %s saved (%d bytes)", session_id, len(blob))
+
+    def delete(self, session_id: str):
+        with self.lock:
+            self.cache.pop(session_id, None)
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                self.connection.commit()
+
+    def evict_expired(self):
+        """Remove the expired sessions from memory and from disk."""
+        now = time.time()
+        with self.lock:
+            for session_id in [k for k, (_, exp, _) in self.cache.items() if exp <= now]:
+                del self.cache[session_id]
+            if self.connection is not None:
+                deleted = self.connection.execute(
+                    "DELETE FROM sessions WHERE expires <= ?", (now,)
+                ).rowcount
+                self.connection.commit()
+                if deleted:
+                    logger.info("Evicted %d expired sessions.", deleted)
+
+    def _cache_put(self, session_id, version, expires, blob):
+        self.cache[session_id] = (version, expires, blob)
+        self.cache.move_to_end(session_id)
+        if len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
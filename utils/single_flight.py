@@ -0,0 +1,77 @@
+import threading
+
+from typing import Callable, Dict, Hashable, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce the identical calls running at the same time.
+
+    The first caller of a key runs the function, the callers of the same key arriving
+    while it is running wait for its result instead of running it again. Nothing is
+    kept once the call has returned.
+
+    Attributes:
+        executed (int): The number of calls that ran the function
+        saved (int): The number of calls that reused the result of a running call
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.saved = 0
+
+    def do(self, key: Hashable, function: Callable) -> Tuple[object, bool]:
+        """Run the function for the key, or wait for the call of the key in flight.
+
+        Returns:
+            result: The result of the function, the exceptions are raised to all the callers
+            shared (bool): True if the result comes from another caller
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            shared = call is not None
+            if shared:
+                self.saved += 1
+            else:
+                call = self.calls[key] = _Call()
+
+        if shared:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+                self.executed += 1
+            call.done.set()
+        return call.result, False
+
+    def count_saved(self, n: int):
+        """Count the calls deduplicated by the caller, e.g. the repeated prompts of a batch."""
+        with self.lock:
+            self.saved += n
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"executed": self.executed, "saved": self.saved}
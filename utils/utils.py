@@ -1,17 +1,34 @@
 
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+
 import torch
 import ollama
 
+from utils.logger import get_logger
+from utils.model_server import RemoteModel
+from utils.profiler import add_time, profiling, section
+from utils.single_flight import SingleFlight
+
 from argparse import Namespace
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     BatchEncoding,
     PreTrainedTokenizer,
-    PreTrainedModel
+    PreTrainedModel,
+    StoppingCriteria,
+    StoppingCriteriaList,
 )
 
+logger = get_logger(__name__)
+
 MODELS = {
     "llama2": "meta-llama/Llama-2-7b-chat-hf",
     "llama3": "meta-llama/Meta-Llama-3-8B-Instruct",
@@ -152,44 +169,382 @@ Possible next best actions are:
 }
 
 
+# The draft models of the speculative decoding, by name, loaded once by `load_model`
+_draft_models: Dict[str, PreTrainedModel] = {}
+
+
 def load_model(args: Namespace) -> Tuple[PreTrainedModel, PreTrainedTokenizer]:
+    """Load the model and its tokenizer, reporting the load time and the peak memory.
+
+    The weights are materialized directly in the target dtype and device
+    (`low_cpu_mem_usage`), from memory-mapped safetensors files when available. With
+    `args.model_cache` the model is converted once to sharded safetensors in the
+    target dtype, and the next runs load that local copy.
+    """
     print("Loading model...")
+    start = time.perf_counter()
+    dtype = torch.float32 if args.dtype == "f32" else torch.bfloat16
+    path, use_safetensors = args.model_name, None
+    cache = getattr(args, "model_cache", None)
+    if cache:
+        cached_path = os.path.join(cache, f"{args.model_name.replace('/', '--')}-{args.dtype}")
+        if os.path.exists(os.path.join(cached_path, "config.json")):
+            path, use_safetensors = cached_path, True
+
     model = AutoModelForCausalLM.from_pretrained(
-        args.model_name,
-        device_map="auto" if args.parallel else args.device, 
-        torch_dtype=torch.float32 if args.dtype == "f32" else torch.bfloat16,
+        path,
+        device_map="auto" if args.parallel else args.device,
+        torch_dtype=dtype,
+        low_cpu_mem_usage=True,
+        use_safetensors=use_safetensors,
     )
-    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+    tokenizer = AutoTokenizer.from_pretrained(path)
+
+    if getattr(args, "draft_model", None) and args.draft_model not in _draft_models:
+        # The draft model must share the tokenizer of the main model
+        _draft_models[args.draft_model] = AutoModelForCausalLM.from_pretrained(
+            args.draft_model,
+            device_map="auto" if args.parallel else args.device,
+            torch_dtype=dtype,
+            low_cpu_mem_usage=True,
+        )
+
+    if cache and path == args.model_name:
+        save_to_cache(model, tokenizer, cache, cached_path)
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024**2
+    report = f"Model loaded from {path} in {time.perf_counter() - start:.1f}s, peak RSS {peak_rss:.2f} GB"
+    if torch.cuda.is_available():
+        report += f", peak GPU memory {torch.cuda.max_memory_allocated() / 1024**3:.2f} GB"
+    print(report)
     return model, tokenizer  # type: ignore
 
+class JSONStoppingCriteria(StoppingCriteria):
+    """Stop the generation as soon as the top-level JSON value has been closed.
+
+    The tokens added since the previous call are decoded together, since the
+    speculative decoding can accept several tokens per step.
+    """
+
+    def __init__(self, extractor, tokenizer: PreTrainedTokenizer, prompt_length: int):
+        self.extractor = extractor
+        self.tokenizer = tokenizer
+        self.position = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        new_text = self.tokenizer.decode(input_ids[0, self.position :], skip_special_tokens=True)
+        self.position = input_ids.shape[1]
+        done = self.extractor.feed(new_text)
+        return torch.full(
+            (input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device
+        )
+
+
+class DecodeMarker(StoppingCriteria):
+    """Close the prefill section and open the decode one once the first token is generated.
+    Used only when profiling, it never stops the generation.
+    """
+
+    def __init__(self):
+        self.current = section("prefill")
+        self.current.__enter__()
+        self.decoding = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if not self.decoding:
+            self.current.__exit__(None, None, None)
+            self.current = section("decode")
+            self.current.__enter__()
+            self.decoding = True
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    def close(self):
+        self.current.__exit__(None, None, None)
+
+
+def save_to_cache(model: PreTrainedModel, tokenizer: PreTrainedTokenizer, cache: str, cached_path: str):
+    """Save the model and its tokenizer to the cache as sharded safetensors.
+
+    They are saved to a new temporary directory first and then renamed, so that an
+    interrupted conversion is never loaded. If another process completed the same
+    conversion in the meantime its copy is kept, and an incomplete copy left by an
+    older version is replaced.
+    """
+    os.makedirs(cache, exist_ok=True)
+    temp_path = tempfile.mkdtemp(prefix=os.path.basename(cached_path) + ".", suffix=".tmp", dir=cache)
+    try:
+        model.save_pretrained(temp_path, safe_serialization=True, max_shard_size="2GB")
+        tokenizer.save_pretrained(temp_path)
+        if os.path.isdir(cached_path) and not os.path.exists(os.path.join(cached_path, "config.json")):
+            shutil.rmtree(cached_path, ignore_errors=True)  # Incomplete copy
+        try:
+            os.rename(temp_path, cached_path)
+        except OSError:
+            if not os.path.exists(os.path.join(cached_path, "config.json")):
+                raise
+            logger.info("The model was saved to the cache %s by another process.", cached_path)
+            return
+    finally:
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path, ignore_errors=True)
+    logger.info("Model saved to the cache %s", cached_path)
+
+
+def speculative_kwargs(args: Namespace) -> dict:
+    """The `generate` arguments of the speculative decoding: the draft model loaded by
+    `load_model`, or the number of tokens drafted by looking up the last n-grams in the
+    prompt. The greedy outputs are the same as without speculative decoding.
+    """
+    draft_model = _draft_models.get(getattr(args, "draft_model", None))
+    if draft_model is not None:
+        return {"assistant_model": draft_model}
+    if getattr(args, "prompt_lookup_tokens", 0):
+        return {"prompt_lookup_num_tokens": args.prompt_lookup_tokens}
+    return {}
+
+
 def model_generate(
     model: PreTrainedModel,
     inputs: BatchEncoding,
     tokenizer: PreTrainedTokenizer,
     args: Namespace,
+    extractor=None,
 ) -> str:
-    output = model.generate(
-        inputs.input_ids,
-        attention_mask=inputs.attention_mask,
-        max_new_tokens=args.max_new_tokens,
-        pad_token_id=tokenizer.eos_token_id,
-    )
-    return tokenizer.decode(
-        output[0][len(inputs.input_ids[0]) :], skip_special_tokens=True
-    )
+    stopping_criteria = StoppingCriteriaList()
+    if extractor is not None:
+        stopping_criteria.append(JSONStoppingCriteria(extractor, tokenizer, inputs.input_ids.shape[1]))
+    marker = None
+    if profiling():
+        marker = DecodeMarker()
+        stopping_criteria.append(marker)
+    try:
+        output = model.generate(
+            inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            max_new_tokens=args.max_new_tokens,
+            pad_token_id=tokenizer.eos_token_id,
+            stopping_criteria=stopping_criteria or None,
+            **speculative_kwargs(args),
+        )
+    finally:
+        if marker is not None:
+            marker.close()
+    new_tokens = output[0][len(inputs.input_ids[0]) :]
+    record_usage(len(inputs.input_ids[0]), len(new_tokens))
+    with section("detokenize"):
+        return tokenizer.decode(new_tokens, skip_special_tokens=True)
 
-def generate(model, text, tokenizer, args):
-    import time
-    if model is None:
-        response = ollama.generate(args.model_name, text, raw=True)
 
-        eval_count = response['eval_count']
-        eval_duration_ns = response['eval_duration']
-        eval_duration_s = eval_duration_ns / 1e9  # Convert nanoseconds to seconds
-        tokens_per_second = eval_count / eval_duration_s
+def model_generate_batch(
+    model: PreTrainedModel,
+    texts: List[str],
+    tokenizer: PreTrainedTokenizer,
+    args: Namespace,
+) -> List[str]:
+    """Generate the responses for a batch of prompts in a single `generate` call.
+    The speculative decoding is not used, it supports a single prompt at a time.
+    """
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"  # Keep the prompts aligned to the generated tokens
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    with section("tokenize"):
+        inputs = tokenizer(texts, return_tensors="pt", padding=True).to(model.device)
+    tokenizer.padding_side = padding_side
+
+    marker = DecodeMarker() if profiling() else None
+    try:
+        output = model.generate(
+            inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            max_new_tokens=args.max_new_tokens,
+            pad_token_id=tokenizer.eos_token_id,
+            stopping_criteria=StoppingCriteriaList([marker]) if marker is not None else None,
+        )
+    finally:
+        if marker is not None:
+            marker.close()
+    new_tokens = output[:, inputs.input_ids.shape[1] :]
+    prompt_tokens = inputs.attention_mask.sum(dim=1).tolist()
+    completion_tokens = (new_tokens != tokenizer.pad_token_id).sum(dim=1).tolist()
+    _usage.batch = [
+        {"prompt_tokens": p, "completion_tokens": c}
+        for p, c in zip(prompt_tokens, completion_tokens)
+    ]
+    with section("detokenize"):
+        return tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
 
-        # print(f"Time taken for generation: {eval_duration_s}s - {tokens_per_second}tok/s")
+
+_usage = threading.local()
+_single_flight = SingleFlight()
+
+
+def record_usage(prompt_tokens: Optional[int], completion_tokens: int):
+    """Record the token counts of a generation, `prompt_tokens` is None when unknown."""
+    _usage.last = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+
+def last_usage() -> dict:
+    """Token counts of the last generation made by the current thread.
+
+    The prompt tokens are None when the model did not report them, e.g. for an ollama
+    stream stopped before its final chunk.
+    """
+    return getattr(_usage, "last", {"prompt_tokens": 0, "completion_tokens": 0})
+
+
+def single_flight_stats() -> dict:
+    """The number of generations executed, and saved by reusing an identical one in flight."""
+    return _single_flight.stats()
+
+
+def last_batch_usage() -> List[dict]:
+    """Token counts of each prompt of the last batch generated by the current thread."""
+    return getattr(_usage, "batch", [])
+
+
+def _stored_output(store, args, text, json_root=None) -> Optional[str]:
+    """The output of the generation recorded in the experiment store, None if missing."""
+    output = store.get(args.model_name, text, args.max_new_tokens, json_root)
+    if output is None and store.offline:
+        logger.warning(
+            "Generation not found in the experiment store (offline), using an empty output: %.80r", text
+        )
+    return output
+
+
+def _store_output(store, args, text, output, json_root=None):
+    store.put(args.model_name, text, args.max_new_tokens, output, json_root)
+
+
+def generate(model, text, tokenizer, args, extractor=None):
+    """Generate a response for the given text.
+
+    Args:
+        extractor (JSONStreamExtractor): If given, the generated text is fed to the
+            extractor while it is produced and the generation stops as soon as the
+            top-level JSON value is closed.
+
+    If `args.experiment_store` is set, the outputs are recorded in the store and
+    reused when the same prompt is generated again with the same model. The identical
+    generations running at the same time are coalesced, see `single_flight_stats`.
+    """
+    store = getattr(args, "experiment_store", None)
+    json_root = extractor.root if extractor is not None else None
+    if store is not None:
+        output = _stored_output(store, args, text, json_root)
+        if output is not None:
+            if extractor is not None:
+                extractor.feed(output)
+            record_usage(0, 0)
+            return output
+        if store.offline:
+            return ""
+
+    def _run():
+        output = _generate(model, text, tokenizer, args, extractor)
+        if store is not None:
+            _store_output(store, args, text, output, json_root)
+        return output
+
+    key = (args.model_name, text, args.max_new_tokens, json_root)
+    output, shared = _single_flight.do(key, _run)
+    if shared:
+        logger.debug("Generation shared with an identical request in flight")
+        if extractor is not None:
+            extractor.feed(output)
+        record_usage(0, 0)
+    return output
+
+
+def generate_batch(model, texts, tokenizer, args) -> List[str]:
+    """Generate the responses for a batch of prompts.
+
+    The HuggingFace models (local or served) generate the whole batch in a single call,
+    while the ollama prompts are sent concurrently. The token counts of each prompt are available from
+    `last_batch_usage`.
+    """
+    store = getattr(args, "experiment_store", None)
+    outputs = [None] * len(texts)
+    usage = [{"prompt_tokens": 0, "completion_tokens": 0} for _ in texts]
+    if store is not None:
+        # The batched generations are never stopped at a JSON root
+        outputs = [_stored_output(store, args, text) for text in texts]
+    missing = [i for i, output in enumerate(outputs) if output is None]
+
+    if missing and not (store is not None and store.offline):
+        # The repeated prompts of the batch are generated once
+        missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+        _single_flight.count_saved(len(missing) - len(missing_texts))
+        if isinstance(model, RemoteModel):
+            with section("remote_generate"):
+                generated, generated_usage = model.generate_batch(missing_texts, args.max_new_tokens)
+        elif model is None:
+
+            def _ollama_generate(text):
+                output, shared = _single_flight.do(
+                    (args.model_name, text, args.max_new_tokens, None),
+                    lambda: _generate(None, text, None, args),
+                )
+                return output, ({"prompt_tokens": 0, "completion_tokens": 0} if shared else last_usage())
+
+            with ThreadPoolExecutor(max_workers=len(missing_texts)) as executor:
+                results = list(executor.map(_ollama_generate, missing_texts))
+            generated = [output for output, _ in results]
+            generated_usage = [u for _, u in results]
+        else:
+            generated = model_generate_batch(model, missing_texts, tokenizer, args)
+            generated_usage = last_batch_usage()
+
+        results = dict(zip(missing_texts, zip(generated, generated_usage)))
+        first = {}
+        for i in missing:
+            if texts[i] in first:
+                outputs[i] = outputs[first[texts[i]]]
+                continue
+            first[texts[i]] = i
+            outputs[i], usage[i] = results[texts[i]]
+            if store is not None:
+                _store_output(store, args, texts[i], outputs[i])
+
+    _usage.batch = usage
+    return [output if output is not None else "" for output in outputs]
+
+
+def _generate(model, text, tokenizer, args, extractor=None):
+    if isinstance(model, RemoteModel):
+        with section("remote_generate"):
+            output, usage = model.generate(
+                text, args.max_new_tokens, extractor.root if extractor is not None else None
+            )
+        if extractor is not None:
+            extractor.feed(output)
+        record_usage(usage["prompt_tokens"], usage["completion_tokens"])
+        return output
+    elif model is None:
+        if extractor is not None:
+            response, n_chunks, chunk = "", 0, {}
+            stream = ollama.generate(args.model_name, text, raw=True, stream=True)
+            try:
+                for chunk in stream:
+                    response += chunk["response"]
+                    n_chunks += 1
+                    if extractor.feed(chunk["response"]) or chunk.get("done"):
+                        break
+            finally:
+                stream.close()  # Ends the HTTP stream when stopped early
+            # Only the final chunk has the prompt count
+            record_usage(chunk.get("prompt_eval_count"), n_chunks)
+            return response
+
+        response = ollama.generate(args.model_name, text, raw=True)
+        record_usage(response.get("prompt_eval_count"), response["eval_count"])
+        # The durations measured by the ollama server, in nanoseconds
+        add_time("prefill", (response.get("prompt_eval_duration") or 0) / 1e9)
+        add_time("decode", (response.get("eval_duration") or 0) / 1e9)
         return response["response"]
     else:
-        input_tokens = tokenizer(text, return_tensors="pt").to(model.device)
-        return model_generate(model, input_tokens, tokenizer, args)
\ No newline at end of file
+        with section("tokenize"):
+            input_tokens = tokenizer(text, return_tensors="pt").to(model.device)
+        return model_generate(model, input_tokens, tokenizer, args, extractor)